@@ -37,6 +37,14 @@ copy "%BUILD_DIR%\models.py" .
 copy "%BUILD_DIR%\crud.py" .
 copy "%BUILD_DIR%\database.py" .
 copy "%BUILD_DIR%\schemas.py" .
+copy "%BUILD_DIR%\migrations.py" .
+copy "%BUILD_DIR%\exports.py" .
+copy "%BUILD_DIR%\imports.py" .
+copy "%BUILD_DIR%\invoices.py" .
+copy "%BUILD_DIR%\backups.py" .
+copy "%BUILD_DIR%\changelog.py" .
+copy "%BUILD_DIR%\query_cache.py" .
+copy "%BUILD_DIR%\portable_config.py" .
 copy "%BUILD_DIR%\requirements.txt" .
 
 echo [OK] Core files copied
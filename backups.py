@@ -0,0 +1,339 @@
+"""
+Database backups
+snapshot() copies the live database with SQLite's online backup API a batch of pages at a time, so
+writers get the database back between steps and a commit landing mid-copy restarts the copy instead
+of tearing it. The copy goes into a temporary file next to the database, is checked there, and is
+streamed to the client from disk a chunk at a time, then deleted.
+An import goes the other way: receive_upload() streams the upload to a staging file in fixed chunks,
+and restore_database() checks it and copies it over the live database with the same API.
+BackupScheduler writes throttled, gzip-compressed snapshots on a timer and keeps the newest few; with
+several server workers only the process holding the backup directory's lock file runs the timer.
+"""
+import glob
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger('fabric.backups')
+
+BACKUP_PAGES_PER_STEP = 256  # 1 MiB at the default 4 KiB page size
+STREAM_CHUNK_BYTES = 256 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+SQLITE_HEADER = b'SQLite format 3\x00'
+REQUIRED_TABLES = {'companies', 'suppliers', 'customers', 'purchases', 'sales'}
+CHECKS = {'quick': 'PRAGMA quick_check', 'full': 'PRAGMA integrity_check', 'none': None}
+
+def check_database(conn: sqlite3.Connection, check: str = 'quick'):
+    """Run quick_check (O(pages), skips index cross-checks) or the full integrity_check; raises ValueError"""
+    if check not in CHECKS:
+        raise ValueError(f"Unknown check '{check}', use one of: {', '.join(CHECKS)}")
+    if CHECKS[check] is None:
+        return
+    problems = [row[0] for row in conn.execute(CHECKS[check]).fetchall()]
+    if problems != ['ok']:
+        raise ValueError(f"Database {check} check failed: {'; '.join(problems[:5])}")
+
+def backup_to_file(engine, path: str, pages: int = BACKUP_PAGES_PER_STEP, progress=None):
+    """Online backup of the engine's database into a new file"""
+    source = engine.raw_connection()
+    target = sqlite3.connect(path)
+    try:
+        source.driver_connection.backup(target, pages=pages, progress=progress)
+    finally:
+        target.close()
+        source.close()
+
+def _database_dir(engine):
+    """Directory of the engine's database file (None for an in-memory database: the system temp dir)"""
+    database = engine.url.database
+    if not database or database == ':memory:':
+        return None
+    return os.path.dirname(os.path.abspath(database))
+
+def snapshot(engine, check: str = 'quick', pages: int = BACKUP_PAGES_PER_STEP):
+    """Consistent copy of the engine's database in a temporary file next to it; returns its path (caller removes it)"""
+    # mkstemp rather than NamedTemporaryFile: on Windows an open NamedTemporaryFile can't be reopened by SQLite
+    fd, path = tempfile.mkstemp(prefix='fabric_export_', suffix='.db', dir=_database_dir(engine))
+    os.close(fd)
+    try:
+        backup_to_file(engine, path, pages)
+        copy = sqlite3.connect(path)
+        try:
+            check_database(copy, check)
+        finally:
+            copy.close()
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+def iter_snapshot(path: str, chunk_bytes: int = STREAM_CHUNK_BYTES):
+    """Yield a snapshot file a chunk at a time, deleting it once sent (or the stream is abandoned)"""
+    try:
+        with open(path, 'rb') as f:
+            while chunk := f.read(chunk_bytes):
+                yield chunk
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+def backup_filename(prefix: str = 'fabric_backup', compress: bool = False):
+    return f'{prefix}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db' + ('.gz' if compress else '')
+
+
+# Import
+
+async def receive_upload(upload, chunk_bytes: int = UPLOAD_CHUNK_BYTES):
+    """
+    Copy an UploadFile to a staging file a chunk at a time and return its path (caller removes it).
+    The first chunk must carry the SQLite file header, so anything else is refused before the rest is read.
+    """
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='fabric_import_')
+    try:
+        with os.fdopen(fd, 'wb') as staged:
+            first = True
+            while chunk := await upload.read(chunk_bytes):
+                if first and not chunk.startswith(SQLITE_HEADER):
+                    raise ValueError("Not a SQLite database file")
+                first = False
+                staged.write(chunk)
+        if first:
+            raise ValueError("The uploaded file is empty")
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+def check_import(path: str, check: str = 'quick'):
+    """Open a staged database read-only and check it carries this app's tables; raises ValueError"""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.Error as e:
+        raise ValueError(f"Invalid SQLite database file: {e}")
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        missing = REQUIRED_TABLES - tables
+        if missing:
+            raise ValueError(f"Invalid database schema: missing required tables: {', '.join(sorted(missing))}")
+        check_database(conn, check)
+    except sqlite3.Error as e:
+        raise ValueError(f"Invalid SQLite database file: {e}")
+    finally:
+        conn.close()
+
+def restore_database(engine, staged_path: str, backup_dir: str, check: str = 'quick'):
+    """
+    Replace the engine's database with a staged file; returns the path of the pre-import backup.
+    The current database is backed up first, then the staged pages are copied over it in a single
+    backup step: one write transaction through SQLite's own journal, so other connections see either
+    the old database or the new one. (Renaming the file over the live one would strand the old -wal
+    file beside it and fails on Windows while any connection is open.) The pool is disposed afterwards
+    so every connection is reopened against the new schema.
+    """
+    check_import(staged_path, check)
+    os.makedirs(backup_dir, exist_ok=True)
+    backup_path = os.path.join(backup_dir, backup_filename('fabric_backup_before_import'))
+    backup_to_file(engine, backup_path)
+
+    engine.dispose()
+    staged = sqlite3.connect(f"file:{staged_path}?mode=ro", uri=True)
+    target = engine.raw_connection()
+    try:
+        staged.backup(target.driver_connection, pages=-1)
+    except sqlite3.Error as e:
+        raise ValueError(f"Database import failed, current database left unchanged: {e}")
+    finally:
+        target.close()
+        staged.close()
+        engine.dispose()
+    return backup_path
+
+
+# Scheduled backups
+
+SCHEDULED_PREFIX = 'fabric_auto_backup'
+SCHEDULER_LOCK = '.scheduler.lock'
+
+def _throttled(pause: float):
+    def progress(status, remaining, total):
+        # called after every step, while the source is unlocked: writers get the database meanwhile
+        if remaining:
+            time.sleep(pause)
+    return progress
+
+def write_backup(engine, directory: str, pause: float = 0.0, pages: int = BACKUP_PAGES_PER_STEP):
+    """
+    Snapshot the engine's database into directory as a gzip file; returns its path.
+    The snapshot is copied in page steps and compressed a chunk at a time with pause seconds between
+    steps, and only renamed to its final name once complete.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{SCHEDULED_PREFIX}_{datetime.now():%Y%m%d_%H%M%S_%f}.db.gz')
+    raw = path[:-len('.gz')] + '.tmp'
+    packed = path + '.tmp'
+    try:
+        backup_to_file(engine, raw, pages, progress=_throttled(pause))
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        with open(raw, 'rb') as src, open(packed, 'wb') as out:
+            while chunk := src.read(UPLOAD_CHUNK_BYTES):
+                out.write(compressor.compress(chunk))
+                time.sleep(pause)
+            out.write(compressor.flush())
+        os.replace(packed, path)
+    finally:
+        for leftover in (raw, packed):
+            if os.path.exists(leftover):
+                os.unlink(leftover)
+    return path
+
+def scheduled_backups(directory: str):
+    """Scheduled backup files, oldest first (names sort by timestamp)"""
+    return sorted(glob.glob(os.path.join(directory, f'{SCHEDULED_PREFIX}_*.db.gz')))
+
+def prune_backups(directory: str, keep: int):
+    """Delete all but the newest keep scheduled backups; returns the deleted paths"""
+    stale = scheduled_backups(directory)[:-keep] if keep > 0 else []
+    pruned = []
+    for path in stale:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue  # another process pruned it first
+        pruned.append(path)
+    return pruned
+
+def _stat(path: str):
+    """os.stat of a backup, or None if it was pruned meanwhile"""
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+def acquire_lock(path: str):
+    """
+    Take an exclusive, non-blocking lock on path; returns the open file (close it to release) or None
+    if another process holds it. The OS drops the lock when its holder exits, so a crash leaves no
+    stale lock behind, unlike a lock file that only exists while held.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle = open(path, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+class BackupScheduler:
+    """
+    Background thread writing a backup every interval seconds (counted from the newest backup on disk,
+    so restarts don't reset the clock) and, if on_startup, once when started. after_backup(engine), if
+    given, runs after each successful backup for housekeeping such as pruning the change log.
+    Every uvicorn/gunicorn worker imports the app and starts a scheduler; start() takes the lock file in
+    the backup directory first, so only one process runs the timer and the others just serve run_now().
+    """
+
+    def __init__(self, engine, directory: str, interval: float, history: int, pause: float = 0.0,
+                 on_startup: bool = False, after_backup=None):
+        self.engine = engine
+        self.directory = directory
+        self.interval = interval
+        self.history = history
+        self.pause = pause
+        self.on_startup = on_startup
+        self.after_backup = after_backup
+        self.last = None
+        self.next_run_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._process_lock = None
+
+    @property
+    def enabled(self):
+        return self.interval > 0 or self.on_startup
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._process_lock = acquire_lock(os.path.join(self.directory, SCHEDULER_LOCK))
+        if self._process_lock is None:
+            logger.info("Backup scheduler already running in another process")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='backup-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._process_lock is not None:
+            self._process_lock.close()
+            self._process_lock = None
+
+    def _seconds_until_due(self):
+        if self.interval <= 0:
+            return None
+        stats = [stat for stat in map(_stat, scheduled_backups(self.directory)) if stat]
+        newest = stats[-1].st_mtime if stats else 0
+        due = newest + self.interval
+        self.next_run_at = datetime.fromtimestamp(max(due, time.time()))
+        return max(0.0, due - time.time())
+
+    def _loop(self):
+        if self.on_startup:
+            self.run_now()
+        # wait() returns True once stop() is called; a None timeout waits for that alone
+        while not self._stop.wait(self._seconds_until_due()):
+            self.run_now()
+
+    def run_now(self):
+        """Write one backup and prune old ones; returns the status of this run"""
+        with self._lock:
+            started = time.time()
+            run = {"started_at": datetime.fromtimestamp(started).isoformat(timespec='seconds')}
+            try:
+                path = write_backup(self.engine, self.directory, self.pause)
+                run.update(file=os.path.basename(path), bytes=os.path.getsize(path),
+                           pruned=len(prune_backups(self.directory, self.history)))
+                if self.after_backup is not None:
+                    self.after_backup(self.engine)
+                logger.info("Backup written: %s", path)
+            except Exception as e:
+                run["error"] = str(e)
+                logger.exception("Scheduled backup failed")
+            run["duration_ms"] = round((time.time() - started) * 1000, 1)
+            self.last = run
+            return run
+
+    def status(self):
+        backups = [(path, stat) for path in reversed(scheduled_backups(self.directory)) if (stat := _stat(path))]
+        return {
+            "enabled": self.enabled,
+            "running": self._lock.locked(),
+            "interval_hours": round(self.interval / 3600, 2),
+            "history": self.history,
+            "directory": self.directory,
+            "next_run_at": self.next_run_at.isoformat(timespec='seconds') if self.next_run_at and self._thread else None,
+            "last": self.last,
+            "backups": [{"file": os.path.basename(path), "bytes": stat.st_size,
+                         "created_at": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds')}
+                        for path, stat in backups],
+        }
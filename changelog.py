@@ -0,0 +1,98 @@
+"""
+Change log (change data capture)
+Every flush appends one change_log row per inserted, updated or deleted row of the business tables,
+through the flushing session's own connection, so a change and its log entry commit or roll back
+together. Consumers poll get_changes(since=last seq seen) and re-read only the rows listed.
+Tables crud maintains from the others (stock positions, FIFO lots and allocations, bank checkpoints)
+are not logged: they change whenever their sources do and can be rebuilt from them.
+The names of all tables a transaction wrote are also kept in session.info['changed_tables'] until it
+ends, so query_cache can skip its entries for a session that has not committed yet.
+prune_changes() drops entries older than the retention period, except each table's newest one, which
+query_cache compares against; a consumer that falls further behind than that should re-read in full.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, inspect, insert, select
+from sqlalchemy.orm import Session
+
+import models
+
+UNLOGGED_TABLES = {'change_log', 'stock_positions', 'stock_lots', 'sale_allocations', 'bank_balance_checkpoints'}
+MAX_CHANGES = 5000
+
+def _changed_tables(session: Session):
+    return session.info.setdefault('changed_tables', set())
+
+def _entry(session, obj, operation, columns=None):
+    mapper = inspect(obj).mapper
+    table = mapper.local_table.name
+    _changed_tables(session).add(table)
+    if table in UNLOGGED_TABLES:
+        return None
+    return {"table_name": table, "row_id": mapper.primary_key_from_instance(obj)[0], "operation": operation,
+            "columns": ','.join(columns) if columns else None}
+
+def _changed_columns(obj):
+    state = inspect(obj)
+    return [attr.key for attr in state.mapper.column_attrs if state.attrs[attr.key].history.has_changes()]
+
+@event.listens_for(Session, 'after_flush')
+def _log_flush(session, flush_context):
+    # new/dirty/deleted and attribute history still describe what this flush wrote
+    entries = [_entry(session, obj, 'insert') for obj in session.new]
+    for obj in session.dirty:
+        columns = _changed_columns(obj)
+        if columns:
+            entries.append(_entry(session, obj, 'update', columns))
+    entries += [_entry(session, obj, 'delete') for obj in session.deleted]
+    entries = [entry for entry in entries if entry is not None]
+    if entries:
+        session.connection().execute(insert(models.ChangeLog.__table__), entries)
+
+def record(db: Session, table_name: str, row_ids, operation: str):
+    """Log rows written with Core statements, which bypass the flush (e.g. crud's batched imports)"""
+    if not row_ids:
+        return
+    _changed_tables(db).add(table_name)
+    if table_name in UNLOGGED_TABLES:
+        return
+    db.connection().execute(insert(models.ChangeLog.__table__), [
+        {"table_name": table_name, "row_id": row_id, "operation": operation} for row_id in row_ids
+    ])
+
+def get_changes(db: Session, since: int = 0, limit: int = 1000, table_name: str = None):
+    """
+    Changes with seq > since, oldest first: {'changes': [...], 'last_seq', 'has_more'}.
+    Pass last_seq back as since to continue.
+    """
+    if limit < 1 or limit > MAX_CHANGES:
+        raise ValueError(f"limit must be between 1 and {MAX_CHANGES}")
+    q = db.query(models.ChangeLog).filter(models.ChangeLog.seq > since)
+    if table_name:
+        q = q.filter(models.ChangeLog.table_name == table_name)
+    rows = q.order_by(models.ChangeLog.seq).limit(limit + 1).all()
+    changes = [{
+        "seq": row.seq,
+        "changed_at": row.changed_at,
+        "table": row.table_name,
+        "row_id": row.row_id,
+        "operation": row.operation,
+        "columns": row.columns.split(',') if row.columns else None,
+    } for row in rows[:limit]]
+    return {"changes": changes, "last_seq": changes[-1]["seq"] if changes else since, "has_more": len(rows) > limit}
+
+def prune_changes(db: Session, older_than_days: float):
+    """Delete changes older than older_than_days, keeping the newest of every table; returns the number deleted"""
+    if older_than_days <= 0:
+        return 0
+    log = models.ChangeLog
+    # seq grows with changed_at, so walk back from the newest entry to the first one past the cutoff
+    # instead of scanning the whole table for old rows
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    last_old = db.query(log.seq).filter(log.changed_at < cutoff).order_by(log.seq.desc()).limit(1).scalar()
+    if last_old is None:
+        return 0
+    newest = select(func.max(log.seq)).group_by(log.table_name)
+    deleted = db.execute(delete(log).where(log.seq <= last_old, log.seq.not_in(newest))).rowcount
+    db.commit()
+    return deleted
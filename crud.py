@@ -1,7 +1,10 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, contains_eager, joinedload, selectinload
 import models
+import changelog
+from query_cache import cached
+import weakref
 from datetime import datetime
-from sqlalchemy import func
+from sqlalchemy import case, column, func, insert, literal, literal_column, or_, select, table, text, tuple_, union_all
 
 # Default tax rate removed as it's now dynamic
 # Companies
@@ -43,34 +46,66 @@ def create_customer(db: Session, name: str, contact: str | None = None):
     db.refresh(c)
     return c
 
+# Fabric catalog
+# Purchases, sales, positions and lots all point at a fabrics row; the catalog matches keys
+# case-insensitively (NOCASE columns) so 'Lawn ' and 'lawn' resolve to the same fabric_id.
+def _fabric_key(fabric_type: str | None, fabric_code: str | None = None, composition: str | None = None):
+    """Normalized catalog key: surrounding whitespace dropped, blank code/composition stored as NULL"""
+    return (fabric_type or '').strip(), (fabric_code or '').strip() or None, (composition or '').strip() or None
+
+def get_fabric(db: Session, fabric_type: str | None, fabric_code: str | None = None, composition: str | None = None):
+    fabric_type, fabric_code, composition = _fabric_key(fabric_type, fabric_code, composition)
+    return db.query(models.Fabric).filter(
+        models.Fabric.fabric_type == fabric_type,
+        models.Fabric.fabric_code == fabric_code,
+        models.Fabric.composition == composition
+    ).first()
+
+def get_or_create_fabric(db: Session, fabric_type: str, fabric_code: str | None = None, composition: str | None = None):
+    fabric = get_fabric(db, fabric_type, fabric_code, composition)
+    if fabric is None:
+        fabric_type, fabric_code, composition = _fabric_key(fabric_type, fabric_code, composition)
+        if not fabric_type:
+            raise ValueError("fabric_type is required")
+        fabric = models.Fabric(fabric_type=fabric_type, fabric_code=fabric_code, composition=composition)
+        db.add(fabric)
+        db.flush()
+    return fabric
+
+def get_fabrics(db: Session):
+    return db.query(models.Fabric).order_by(
+        models.Fabric.fabric_type, models.Fabric.fabric_code, models.Fabric.composition
+    ).all()
+
 # Purchase
-def create_purchase(db: Session, supplier_id: int, fabric_type: str, quantity_meters: float, price_per_meter: float, 
-                   fabric_code: str | None = None, composition: str | None = None, payment_method: str = 'cash', 
-                   payment_status: str = 'paid', amount_paid: float = None):
-    total_cost = quantity_meters * price_per_meter
-    
-    # Calculate payment amounts
+def _purchase_payment(total_cost: float, payment_status: str, amount_paid: float | None):
+    """(amount_paid, amount_due) for a new purchase; raises ValueError for an inconsistent payment"""
     if payment_status == 'paid':
-        actual_amount_paid = total_cost
-        actual_amount_due = 0.0
-    elif payment_status == 'pending':
-        actual_amount_paid = 0.0
-        actual_amount_due = total_cost
-    elif payment_status == 'partial':
+        return total_cost, 0.0
+    if payment_status == 'pending':
+        return 0.0, total_cost
+    if payment_status == 'partial':
         if amount_paid is None or amount_paid <= 0:
             raise ValueError("For partial payment, amount_paid must be provided and greater than 0")
         if amount_paid >= total_cost:
             raise ValueError("For partial payment, amount_paid must be less than total cost")
-        actual_amount_paid = amount_paid
-        actual_amount_due = total_cost - amount_paid
-    else:
-        raise ValueError(f"Invalid payment_status: {payment_status}")
+        return amount_paid, total_cost - amount_paid
+    raise ValueError(f"Invalid payment_status: {payment_status}")
+
+def create_purchase(db: Session, supplier_id: int, fabric_type: str, quantity_meters: float, price_per_meter: float, 
+                   fabric_code: str | None = None, composition: str | None = None, payment_method: str = 'cash', 
+                   payment_status: str = 'paid', amount_paid: float = None):
+    fabric = get_or_create_fabric(db, fabric_type, fabric_code, composition)
+    total_cost = quantity_meters * price_per_meter
+    actual_amount_paid, actual_amount_due = _purchase_payment(total_cost, payment_status, amount_paid)
     
     p = models.Purchase(
         supplier_id=supplier_id,
-        fabric_type=fabric_type,
-        fabric_code=fabric_code,
-        composition=composition,
+        date=datetime.utcnow(),
+        fabric_id=fabric.fabric_id,
+        fabric_type=fabric.fabric_type,
+        fabric_code=fabric.fabric_code,
+        composition=fabric.composition,
         quantity_meters=quantity_meters,
         price_per_meter=price_per_meter,
         total_cost=total_cost,
@@ -80,34 +115,21 @@ def create_purchase(db: Session, supplier_id: int, fabric_type: str, quantity_me
         amount_due=actual_amount_due
     )
     db.add(p)
+    db.flush()
+    # new purchase is the newest FIFO lot, so its full cost adds to the valuation
+    db.add(_lot_for_purchase(p))
+    _apply_stock_delta(db, fabric, purchased=quantity_meters, valuation=total_cost)
     db.commit()
     db.refresh(p)
     return p
 
 # Sale
-def create_sale(db: Session, company_id: int, customer_id: int, fabric_type: str, quantity_meters: float, 
-                price_per_meter: float, fabric_code: str | None = None, composition: str | None = None, 
-                apply_tax: bool = True, tax_rate: float = 0.18, payment_method: str = 'cash', 
-                payment_status: str = 'paid', amount_paid: float = None):
-    # stock check: sum purchases - sum sales for this fabric_type (+ optional fabric_code/composition)
-    purchase_filter = [models.Purchase.fabric_type==fabric_type]
-    sale_filter = [models.Sale.fabric_type==fabric_type]
-    if fabric_code:
-        purchase_filter.append(models.Purchase.fabric_code==fabric_code)
-        sale_filter.append(models.Sale.fabric_code==fabric_code)
-    if composition:
-        purchase_filter.append(models.Purchase.composition==composition)
-        sale_filter.append(models.Sale.composition==composition)
-    tp = db.query(func.coalesce(func.sum(models.Purchase.quantity_meters), 0)).filter(*purchase_filter).scalar() or 0
-    ts = db.query(func.coalesce(func.sum(models.Sale.quantity_meters), 0)).filter(*sale_filter).scalar() or 0
-    available = float(tp - ts)
-    if quantity_meters > available:
-        raise ValueError(f"Insufficient stock for {fabric_type}. Available: {available}")
-
+def _sale_amounts(quantity_meters: float, price_per_meter: float, apply_tax: bool, tax_rate: float,
+                  payment_status: str, amount_paid: float | None):
+    """Tax, total and payment columns of a new sale; the status follows from the amount paid"""
     subtotal = quantity_meters * price_per_meter
     tax = round(subtotal * tax_rate, 2) if apply_tax else 0.0
     total_with_tax = subtotal if not apply_tax else round(subtotal + tax, 2)
-    actual_tax_rate = tax_rate if apply_tax else 0.0
     
     # Calculate payment amounts
     if amount_paid is None:
@@ -122,92 +144,776 @@ def create_sale(db: Session, company_id: int, customer_id: int, fabric_type: str
         payment_status = 'partial'
     else:
         payment_status = 'pending'
-    
+    return {
+        "apply_tax": apply_tax,
+        "tax_rate": tax_rate if apply_tax else 0.0,
+        "tax": tax,
+        "total_price_with_tax": total_with_tax,
+        "payment_status": payment_status,
+        "amount_paid": amount_paid,
+        "amount_due": amount_due,
+    }
+
+def create_sale(db: Session, company_id: int, customer_id: int, fabric_type: str | None, quantity_meters: float, 
+                price_per_meter: float, fabric_code: str | None = None, composition: str | None = None, 
+                apply_tax: bool = True, tax_rate: float = 0.18, payment_method: str = 'cash', 
+                payment_status: str = 'paid', amount_paid: float = None, fabric_id: int | None = None):
+    # the fabric is picked by catalog id (sale form) or by its key (API, scripts)
+    if fabric_id is not None:
+        fabric = db.get(models.Fabric, fabric_id)
+        if fabric is None:
+            raise ValueError(f"Unknown fabric_id {fabric_id}")
+    else:
+        fabric = get_fabric(db, fabric_type, fabric_code, composition)
+    # quick check against the materialized position for this exact fabric; _consume_lots checks
+    # again against the lots once the sale's INSERT holds the write lock
+    position = _get_stock_position(db, fabric.fabric_id) if fabric else None
+    available = float(position.balance_in_meters) if position else 0.0
+    if position is None or quantity_meters > available:
+        raise ValueError(f"Insufficient stock for {fabric.fabric_type if fabric else fabric_type}. Available: {available}")
+
     s = models.Sale(
         company_id=company_id,
         customer_id=customer_id,
-        fabric_type=fabric_type,
+        fabric_id=fabric.fabric_id,
+        fabric_type=fabric.fabric_type,
         quantity_meters=quantity_meters,
-        fabric_code=fabric_code,
-        composition=composition,
+        fabric_code=fabric.fabric_code,
+        composition=fabric.composition,
         price_per_meter=price_per_meter,
-        apply_tax=apply_tax,
-        tax_rate=actual_tax_rate,
-        tax=tax,
-        total_price_with_tax=total_with_tax,
         payment_method=payment_method,
-        payment_status=payment_status,
-        amount_paid=amount_paid,
-        amount_due=amount_due,
+        **_sale_amounts(quantity_meters, price_per_meter, apply_tax, tax_rate, payment_status, amount_paid)
     )
     db.add(s)
+    db.flush()
+    try:
+        cost_of_sale = _consume_lots(db, s)
+    except ValueError:
+        db.rollback()
+        raise
+    _apply_stock_delta(db, fabric, sold=quantity_meters, valuation=-cost_of_sale)
     db.commit()
     db.refresh(s)
     return s
 
+# Keyset pagination
+# Listings are ordered newest first on (date, id); a cursor is the (date, id) of the row a page
+# starts or ends at, so every page is an index range scan no matter how deep into history it is.
+# Rows without a date come last, newest id first, and are read as a segment of their own (a cursor
+# on one has an empty date part) so neither segment's range scan needs an OR across NULLs.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(date: datetime | None, row_id: int):
+    return f"{date.isoformat() if date is not None else ''}|{row_id}"
+
+def decode_cursor(cursor: str):
+    try:
+        date_part, id_part = cursor.rsplit('|', 1)
+        return (datetime.fromisoformat(date_part) if date_part else None), int(id_part)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid page cursor: {cursor}")
+
+def _estimate_total(query, id_col):
+    """Row count for a listing: max(id) for unfiltered tables (an upper bound, O(log n)), else an indexed COUNT"""
+    if query.whereclause is None:
+        return query.with_entities(func.max(id_col)).scalar() or 0
+    return query.with_entities(func.count(id_col)).scalar() or 0
+
+def _page_segments(query, date_col, id_col, position, backwards: bool):
+    """The queries a page reads in turn, each already ordered from the cursor outwards"""
+    dated = query.filter(date_col.isnot(None))
+    undated = query.filter(date_col.is_(None))
+    if backwards:
+        date, row_id = position
+        if date is None:
+            # newer than an undated row: the undated rows above it, then every dated row from the oldest
+            segments = [undated.filter(id_col > row_id), dated]
+        else:
+            segments = [dated.filter(tuple_(date_col, id_col) > tuple_(date, row_id))]
+        return [segment.order_by(date_col.asc(), id_col.asc()) for segment in segments]
+    if position is None:
+        segments = [dated, undated]
+    elif position[0] is None:
+        segments = [undated.filter(id_col < position[1])]
+    else:
+        segments = [dated.filter(tuple_(date_col, id_col) < tuple_(*position)), undated]
+    return [segment.order_by(date_col.desc(), id_col.desc()) for segment in segments]
+
+def paginate_keyset(query, date_col, id_col, limit: int = None, cursor: str = None, direction: str = 'next',
+                    total_estimate: int = None):
+    """
+    One newest-first page of query.
+    direction='next' returns rows older than cursor, direction='prev' rows newer than it.
+    Returns {'rows', 'next_cursor', 'prev_cursor', 'limit', 'total_estimate'}
+    """
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    if total_estimate is None:
+        total_estimate = _estimate_total(query, id_col)
+    backwards = direction == 'prev' and cursor is not None
+
+    rows = []
+    for segment in _page_segments(query, date_col, id_col, decode_cursor(cursor) if cursor else None, backwards):
+        rows += segment.limit(limit + 1 - len(rows)).all()
+        if len(rows) > limit:
+            break
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, cursor is not None
+
+    def row_cursor(row):
+        return encode_cursor(getattr(row, date_col.key), getattr(row, id_col.key))
+
+    return {
+        'rows': rows,
+        'next_cursor': row_cursor(rows[-1]) if rows and has_next else None,
+        'prev_cursor': row_cursor(rows[0]) if rows and has_prev else None,
+        'limit': limit,
+        'total_estimate': total_estimate
+    }
+
 # Queries
-from sqlalchemy import func
+# List queries load the many-to-one parents their pages and exports print (supplier, customer,
+# company, a payment's sale) in the same SELECT, so a page costs a fixed number of queries
+# rather than one more per row.
+def get_purchases(db: Session, limit: int = None, cursor: str = None, direction: str = 'next'):
+    query = db.query(models.Purchase).options(joinedload(models.Purchase.supplier))
+    return paginate_keyset(query, models.Purchase.date, models.Purchase.purchase_id,
+                           limit=limit, cursor=cursor, direction=direction)
+
+def get_sales(db: Session, limit: int = None, cursor: str = None, direction: str = 'next'):
+    query = db.query(models.Sale).options(joinedload(models.Sale.customer), joinedload(models.Sale.company))
+    return paginate_keyset(query, models.Sale.date, models.Sale.sale_id,
+                           limit=limit, cursor=cursor, direction=direction)
+
+# Stock positions
+def _get_stock_position(db: Session, fabric_id: int):
+    return db.query(models.StockPosition).filter(models.StockPosition.fabric_id == fabric_id).first()
 
-def get_purchases(db: Session):
-    return db.query(models.Purchase).order_by(models.Purchase.date.desc()).all()
+def _apply_stock_delta(db: Session, fabric, purchased: float = 0.0, sold: float = 0.0, valuation: float = 0.0):
+    """
+    Adjust the materialized position for one catalog fabric inside the caller's transaction.
+    The deltas are added in SQL, to the row as it is when the UPDATE takes the write lock: totals read
+    into the session earlier may be stale, and writing them back would drop a concurrent sale.
+    """
+    P = models.StockPosition
+    updated = db.query(P).filter(P.fabric_id == fabric.fabric_id).update({
+        P.total_purchased: P.total_purchased + purchased,
+        P.total_sold: P.total_sold + sold,
+        P.balance_in_meters: P.balance_in_meters + (purchased - sold),
+        P.stock_valuation: P.stock_valuation + valuation,
+    }, synchronize_session='fetch')
+    if not updated:
+        db.add(models.StockPosition(
+            fabric_id=fabric.fabric_id,
+            fabric_type=fabric.fabric_type,
+            fabric_code=fabric.fabric_code,
+            composition=fabric.composition,
+            total_purchased=purchased,
+            total_sold=sold,
+            balance_in_meters=purchased - sold,
+            stock_valuation=valuation
+        ))
 
-def get_sales(db: Session):
-    return db.query(models.Sale).order_by(models.Sale.date.desc()).all()
+def _stock_dict(fabric_type, fabric_code, composition, total_purchased, total_sold, stock_valuation):
+    remaining = float(total_purchased) - float(total_sold)
+    valuation = float(stock_valuation)
+    avg_cost = (valuation / remaining) if remaining > 0 else 0.0
+    return {
+        "fabric_type": fabric_type,
+        "fabric_code": fabric_code,
+        "composition": composition,
+        "total_purchased": float(total_purchased),
+        "total_sold": float(total_sold),
+        "balance_in_meters": remaining,
+        "avg_cost_per_meter": round(avg_cost, 2),
+        "stock_valuation": round(valuation, 2),
+    }
+
+def stock_position_dict(position):
+    return _stock_dict(position.fabric_type, position.fabric_code, position.composition,
+                       position.total_purchased, position.total_sold, position.stock_valuation)
+
+def _stock_search_filter(model, q: str):
+    search_text = func.lower(
+        func.coalesce(model.fabric_type, '') + ' ' +
+        func.coalesce(model.fabric_code, '') + ' ' +
+        func.coalesce(model.composition, '')
+    )
+    return search_text.contains(q.lower(), autoescape=True)
+
+def stock_positions_query(db: Session, q: str | None = None):
+    query = db.query(models.StockPosition)
+    if q:
+        query = query.filter(_stock_search_filter(models.StockPosition, q))
+    return query.order_by(
+        models.StockPosition.fabric_type, models.StockPosition.fabric_code, models.StockPosition.composition
+    )
 
 def get_stock_summary(db: Session, q: str | None = None):
-    # returns list of dicts grouped by (fabric_type, fabric_code, composition)
-    purchases_q = db.query(models.Purchase.fabric_type, models.Purchase.fabric_code, models.Purchase.composition).distinct()
-    sales_q = db.query(models.Sale.fabric_type, models.Sale.fabric_code, models.Sale.composition).distinct()
+    # returns list of dicts, one per (fabric_type, fabric_code, composition), read from stock_positions
+    return [stock_position_dict(p) for p in stock_positions_query(db, q)]
+
+def _ledger_stock_totals(db: Session, q: str | None = None):
+    """
+    Per-fabric_id (total_purchased, total_sold, fifo_valuation) computed from the raw ledgers alone, with two
+    queries built on running SUM windows. A sale takes what it needs from the lots dated at or before it,
+    oldest first (the rule stock_lots follow, see _replay_fifo), so the meters consumed are always the oldest
+    prefix of a fabric's lots and their length follows from the running totals (see below). Each lot then
+    keeps whatever of it lies past that prefix.
+    """
+    P, S = models.Purchase, models.Sale
+
+    # purchases and sales of a fabric in replay order; a purchase dated with a sale comes before it
+    events = union_all(
+        select(P.fabric_id, P.date, literal(0).label('kind'), P.purchase_id.label('row_id'),
+               P.quantity_meters.label('bought'), literal(0.0).label('sold')),
+        select(S.fabric_id, S.date, literal(1), S.sale_id, literal(0.0), S.quantity_meters),
+    ).subquery()
+    to_date = dict(partition_by=events.c.fabric_id, order_by=(events.c.date, events.c.kind, events.c.row_id),
+                   rows=(None, 0))
+    running = select(
+        events.c.fabric_id,
+        events.c.kind,
+        events.c.sold,
+        func.sum(events.c.bought).over(**to_date).label('bought'),
+        func.sum(events.c.sold).over(**to_date).label('sold_to_date'),
+    ).subquery()
+    # sale k leaves consumed = min(consumed before + its quantity, bought up to its date); unrolled over the
+    # history that is total sold + min(0, lowest bought - sold_to_date at any sale): whatever the worst
+    # sale couldn't cover was never taken from a lot
+    uncovered = func.min(case((running.c.kind == 1, running.c.bought - running.c.sold_to_date)))
+    total_sold = func.sum(running.c.sold)
+    sold_q = db.query(
+        running.c.fabric_id,
+        total_sold.label('total_sold'),
+        (total_sold + func.min(0, func.coalesce(uncovered, 0))).label('consumed'),
+    ).group_by(running.c.fabric_id)
+    if q:
+        sold_q = sold_q.join(models.Fabric, models.Fabric.fabric_id == running.c.fabric_id).filter(
+            _stock_search_filter(models.Fabric, q))
+    sold = sold_q.subquery()
+
+    # meters purchased up to and including each lot, oldest first within a fabric
+    lots = db.query(
+        P.fabric_id,
+        P.quantity_meters,
+        P.price_per_meter,
+        func.sum(P.quantity_meters).over(
+            partition_by=P.fabric_id,
+            order_by=(P.date.asc(), P.purchase_id.asc()),
+            rows=(None, 0)
+        ).label('cumulative')
+    ).subquery()
+    # remaining in a lot = cumulative purchased - meters consumed, clamped to [0, lot quantity]
+    remaining = func.max(0, func.min(lots.c.quantity_meters, lots.c.cumulative - func.coalesce(sold.c.consumed, 0)))
+    purchased_q = db.query(
+        lots.c.fabric_id,
+        func.sum(lots.c.quantity_meters),
+        func.sum(remaining * lots.c.price_per_meter),
+    ).join(sold, lots.c.fabric_id == sold.c.fabric_id).group_by(lots.c.fabric_id)
+
+    totals = {}
+    for fabric_id, ts, _ in sold_q:
+        totals[fabric_id] = [0.0, float(ts or 0), 0.0]
+    for fabric_id, tp, valuation in purchased_q:
+        totals[fabric_id][0] = float(tp or 0)
+        totals[fabric_id][2] = float(valuation or 0)
+
+    return totals
+
+def _catalog_entries(db: Session, fabric_ids):
+    """{fabric_id: Fabric} for the given ids"""
+    return {f.fabric_id: f for f in db.query(models.Fabric).filter(models.Fabric.fabric_id.in_(list(fabric_ids)))}
+
+def compute_stock_summary(db: Session, q: str | None = None):
+    """
+    Stock summary straight from the ledgers (bypassing stock_positions), same dicts as get_stock_summary
+    """
+    totals = _ledger_stock_totals(db, q)
+    fabrics = sorted(_catalog_entries(db, totals).values(),
+                     key=lambda f: (f.fabric_type, f.fabric_code or '', f.composition or ''))
+    return [_stock_dict(f.fabric_type, f.fabric_code, f.composition, *totals[f.fabric_id]) for f in fabrics]
 
-    types = set([(r[0], r[1], r[2]) for r in purchases_q]) | set([(r[0], r[1], r[2]) for r in sales_q])
+def rebuild_stock_positions(db: Session):
+    """
+    Recompute stock_positions, stock_lots and sale_allocations from the raw purchase and sale ledgers.
+    Returns the number of positions written.
+    """
+    lots, allocations = _replay_fifo(db)
+
+    # 'fetch' evicts the deleted rows from the session so re-inserted primary keys don't collide
+    db.query(models.SaleAllocation).delete(synchronize_session='fetch')
+    db.query(models.StockLot).delete(synchronize_session='fetch')
+    db.query(models.StockPosition).delete(synchronize_session='fetch')
+
+    db.add_all(lots.values())
+    db.add_all(allocations)
+    totals = _ledger_stock_totals(db)
+    fabrics = _catalog_entries(db, totals)
+    for fabric_id, (tp, ts, valuation) in totals.items():
+        fabric = fabrics[fabric_id]
+        db.add(models.StockPosition(
+            fabric_id=fabric_id,
+            fabric_type=fabric.fabric_type,
+            fabric_code=fabric.fabric_code,
+            composition=fabric.composition,
+            total_purchased=tp,
+            total_sold=ts,
+            balance_in_meters=tp - ts,
+            stock_valuation=valuation
+        ))
+    db.commit()
+    return len(totals)
+
+def verify_stock_positions(db: Session):
+    """
+    Diff stock_positions against totals recomputed from the purchase and sale ledgers alone, and the stored
+    FIFO lots against that ledger valuation and the position's balance (the meters differ when a sale was
+    not covered by the lots dated before it). Returns a list of mismatch descriptions (empty when consistent).
+    """
+    expected = _ledger_stock_totals(db)
+    L = models.StockLot
+    in_lots = {fabric_id: (float(meters or 0), float(value or 0)) for fabric_id, meters, value in
+               db.query(L.fabric_id, func.sum(L.remaining_meters), func.sum(L.remaining_meters * L.price_per_meter))
+               .group_by(L.fabric_id)}
+    problems = []
+    for position in db.query(models.StockPosition):
+        key = position.fabric_id
+        tp, ts, valuation = expected.pop(key, (0.0, 0.0, 0.0))
+        actual = (position.total_purchased, position.total_sold, position.stock_valuation)
+        if any(abs(a - e) > 1e-6 for a, e in zip(actual, (tp, ts, valuation))):
+            problems.append(f"position for fabric {key}: stored {actual} != ledger {(tp, ts, valuation)}")
+        lot_meters, lot_value = in_lots.get(key, (0.0, 0.0))
+        if abs(lot_value - valuation) > 1e-6:
+            problems.append(f"lots of fabric {key}: valued at {lot_value} != ledger {valuation}")
+        if abs(position.balance_in_meters - lot_meters) > 1e-6:
+            problems.append(f"position for fabric {key}: balance {position.balance_in_meters} != "
+                            f"{lot_meters} left in FIFO lots")
+    for key in expected:
+        problems.append(f"position for fabric {key}: missing")
+    return problems
+
+def ensure_stock_positions(db: Session):
+    """Build stock positions and FIFO lots on databases created before those tables existed"""
+    if db.query(models.Purchase.purchase_id).first() is None and db.query(models.Sale.sale_id).first() is None:
+        return False
+    if db.query(models.StockPosition.position_id).first() is not None and \
+            db.query(models.StockLot.purchase_id).first() is not None:
+        return False
+    rebuild_stock_positions(db)
+    return True
+
+# FIFO lots
+# Every purchase opens a lot; every sale consumes the oldest open lots of its fabric dated at or before
+# the sale and records what it took in sale_allocations, so valuation only ever reads the open lots.
+# Writing a sale and replaying the history in date order (_replay_fifo) apply this same rule.
+FIFO_EPSILON = 1e-9
+
+def _lot_for_purchase(purchase):
+    return models.StockLot(
+        purchase_id=purchase.purchase_id,
+        fabric_id=purchase.fabric_id,
+        fabric_type=purchase.fabric_type,
+        fabric_code=purchase.fabric_code,
+        composition=purchase.composition,
+        date=purchase.date,
+        quantity_meters=float(purchase.quantity_meters),
+        price_per_meter=float(purchase.price_per_meter),
+        remaining_meters=float(purchase.quantity_meters)
+    )
+
+def _open_lots(db: Session, fabric_id: int, as_of: datetime | None = None):
+    query = db.query(models.StockLot).filter(
+        models.StockLot.fabric_id == fabric_id,
+        models.StockLot.remaining_meters > literal_column('0')
+    )
+    if as_of is not None:
+        query = query.filter(models.StockLot.date <= as_of)
+    return query.order_by(models.StockLot.date.asc(), models.StockLot.purchase_id.asc())
+
+def _take_from_lots(lots, quantity: float):
+    """
+    Allocate quantity against lots (oldest first), decrementing remaining_meters in place.
+    Yields (lot, meters_taken) pairs.
+    """
+    to_allocate = float(quantity)
+    for lot in lots:
+        if to_allocate <= FIFO_EPSILON:
+            break
+        taken = min(lot.remaining_meters, to_allocate)
+        lot.remaining_meters -= taken
+        if lot.remaining_meters <= FIFO_EPSILON:
+            lot.remaining_meters = 0.0
+        to_allocate -= taken
+        yield lot, taken
+
+def _consume_lots(db: Session, sale):
+    """
+    Consume the open lots dated up to a flushed sale and record its allocations.
+    Returns the FIFO cost of the meters sold; raises ValueError if those lots can't cover the sale
+    (stock bought after the sale's date is not available to it).
+    """
+    lots = _open_lots(db, sale.fabric_id, as_of=sale.date)
+    cost = 0.0
+    allocated = 0.0
+    for lot, taken in _take_from_lots(lots, sale.quantity_meters):
+        db.add(models.SaleAllocation(
+            sale_id=sale.sale_id,
+            purchase_id=lot.purchase_id,
+            quantity_meters=taken,
+            price_per_meter=lot.price_per_meter
+        ))
+        cost += taken * lot.price_per_meter
+        allocated += taken
+    if sale.quantity_meters - allocated > FIFO_EPSILON:
+        raise ValueError(f"Insufficient stock for {sale.fabric_type} as of {sale.date:%Y-%m-%d}. "
+                         f"Available: {round(allocated, 2)}")
+    return cost
+
+def _replay_fifo(db: Session):
+    """
+    Replay the whole purchase/sale history in date order without touching the stored FIFO tables.
+    Returns ({purchase_id: StockLot}, [SaleAllocation]) as transient objects.
+    """
+    purchases = db.query(models.Purchase).order_by(models.Purchase.date.asc(), models.Purchase.purchase_id.asc()).all()
+    sales = db.query(models.Sale.sale_id, models.Sale.date, models.Sale.fabric_id, models.Sale.quantity_meters).order_by(
+        models.Sale.date.asc(), models.Sale.sale_id.asc()
+    ).all()
+
+    lots = {}
+    open_lots = {}
+    allocations = []
+    p_index = 0
+    for sale in sales:
+        # purchases dated at or before the sale are available to it
+        while p_index < len(purchases) and purchases[p_index].date <= sale.date:
+            lot = _lot_for_purchase(purchases[p_index])
+            lots[lot.purchase_id] = lot
+            open_lots.setdefault(lot.fabric_id, []).append(lot)
+            p_index += 1
+        key_lots = open_lots.get(sale.fabric_id, [])
+        for lot, taken in _take_from_lots(key_lots, sale.quantity_meters):
+            allocations.append(models.SaleAllocation(
+                sale_id=sale.sale_id,
+                purchase_id=lot.purchase_id,
+                quantity_meters=taken,
+                price_per_meter=lot.price_per_meter
+            ))
+        key_lots[:] = [lot for lot in key_lots if lot.remaining_meters > 0]
+    for purchase in purchases[p_index:]:
+        lots[purchase.purchase_id] = _lot_for_purchase(purchase)
+    return lots, allocations
+
+def verify_fifo_allocations(db: Session):
+    """
+    Replay history and diff it against stored stock_lots and sale_allocations.
+    Returns a list of mismatch descriptions (empty when the stored state is consistent).
+    """
+    lots, allocations = _replay_fifo(db)
+    problems = []
+
+    stored_lots = {l.purchase_id: l.remaining_meters for l in db.query(models.StockLot.purchase_id, models.StockLot.remaining_meters)}
+    for purchase_id, lot in lots.items():
+        stored = stored_lots.pop(purchase_id, None)
+        if stored is None:
+            problems.append(f"purchase {purchase_id}: missing lot")
+        elif abs(stored - lot.remaining_meters) > 1e-6:
+            problems.append(f"purchase {purchase_id}: remaining {stored} != replayed {lot.remaining_meters}")
+    for purchase_id in stored_lots:
+        problems.append(f"purchase {purchase_id}: lot has no matching purchase")
+
+    def by_sale(rows):
+        out = {}
+        for r in rows:
+            out.setdefault(r.sale_id, {}).setdefault(r.purchase_id, 0.0)
+            out[r.sale_id][r.purchase_id] += r.quantity_meters
+        return out
+
+    replayed = by_sale(allocations)
+    stored = by_sale(db.query(models.SaleAllocation.sale_id, models.SaleAllocation.purchase_id,
+                              models.SaleAllocation.quantity_meters))
+    for sale_id in sorted(set(replayed) | set(stored)):
+        expected = replayed.get(sale_id, {})
+        actual = stored.get(sale_id, {})
+        for purchase_id in set(expected) | set(actual):
+            if abs(expected.get(purchase_id, 0.0) - actual.get(purchase_id, 0.0)) > 1e-6:
+                problems.append(f"sale {sale_id}: allocation from purchase {purchase_id} is "
+                                f"{actual.get(purchase_id, 0.0)}, replay gives {expected.get(purchase_id, 0.0)}")
+    return problems
+
+def get_fifo_valuation(db: Session):
+    """
+    Open FIFO lots grouped per fabric for the valuation report
+    """
+    lots = db.query(models.StockLot, models.Fabric).join(
+        models.Fabric, models.Fabric.fabric_id == models.StockLot.fabric_id
+    ).filter(models.StockLot.remaining_meters > literal_column('0')).order_by(
+        models.Fabric.fabric_type, models.Fabric.fabric_code, models.Fabric.composition,
+        models.StockLot.date, models.StockLot.purchase_id
+    )
+    data = []
+    current = None
+    for lot, fabric in lots:
+        key = (fabric.fabric_type, fabric.fabric_code, fabric.composition)
+        if current is None or current['fabric_id'] != fabric.fabric_id:
+            current = {"key": key, "fabric_id": fabric.fabric_id, "fabric_type": key[0], "fabric_code": key[1],
+                       "composition": key[2], "lots": [], "total_valuation": 0.0}
+            data.append(current)
+        val = round(lot.remaining_meters * lot.price_per_meter, 2)
+        current['lots'].append({"date": lot.date, "remaining": lot.remaining_meters,
+                                "price_per_meter": lot.price_per_meter, "value": val})
+        current['total_valuation'] = round(current['total_valuation'] + val, 2)
+    return data
+
+# Bulk import
+# Purchases and sales from an upload go in with executemany INSERTs, batch_size rows at a time, inside one
+# transaction. Sales are checked and allocated against the fabric's open lots held in memory; positions are
+# adjusted once per fabric at the end instead of once per row.
+IMPORT_BATCH_ROWS = 500
+MAX_IMPORT_BATCH_ROWS = 5000
+
+def _import_fabric(db: Session, cache: dict, data: dict, create: bool):
+    key = tuple(part.lower() if part else part
+                for part in _fabric_key(data.get('fabric_type'), data.get('fabric_code'), data.get('composition')))
+    if key not in cache:
+        lookup = get_or_create_fabric if create else get_fabric
+        cache[key] = lookup(db, data.get('fabric_type'), data.get('fabric_code'), data.get('composition'))
+    return cache[key]
+
+def _latest_transaction_date(db: Session):
+    dates = [db.query(func.max(models.Purchase.date)).scalar(), db.query(func.max(models.Sale.date)).scalar()]
+    dates = [d for d in dates if d is not None]
+    return max(dates) if dates else None
+
+def _insert_batch(db: Session, model, primary_key, rows: list):
+    """
+    executemany INSERT of rows; returns their new primary keys in row order.
+    RETURNING would make SQLAlchemy fall back to one INSERT per row to keep the order, so read the ids
+    back instead: from the first INSERT on the session holds SQLite's write lock until commit, and
+    integer primary keys are handed out in ascending order, so the newest len(rows) ids are ours.
+    """
+    db.execute(insert(model), rows)
+    ids = [row[0] for row in db.query(primary_key).order_by(primary_key.desc()).limit(len(rows))][::-1]
+    changelog.record(db, model.__tablename__, ids, 'insert')
+    return ids
+
+def _import_date(data: dict, latest: datetime | None):
+    """(row date, whether it lands before an existing transaction) for one imported row"""
+    date = data.get('date') or datetime.utcnow()
+    return date, latest is not None and date < latest
 
-    result = []
-    for t_type, t_code, t_comp in types:
-        # optional search filter
-        if q:
-            if q.lower() not in (str(t_type or '').lower() + ' ' + str(t_code or '').lower() + ' ' + str(t_comp or '').lower()):
+def _finish_import(db: Session, backdated: bool):
+    # purchases dated before existing history add lots that a date-ordered replay gives to earlier sales,
+    # so rebuild the derived stock tables from the ledgers instead (extra earlier stock never uncovers a sale)
+    if backdated:
+        db.flush()
+        rebuild_stock_positions(db)
+    else:
+        db.commit()
+
+def bulk_create_purchases(db: Session, rows, errors: list, batch_size: int = IMPORT_BATCH_ROWS):
+    """
+    Insert purchases from (row_number, data) pairs, data being create_purchase's keyword arguments plus an
+    optional date. Rows failing a check are appended to errors as (row_number, message) and skipped.
+    Returns the number of purchases inserted; nothing is written if an unexpected error escapes.
+    """
+    supplier_ids = {row[0] for row in db.query(models.Supplier.supplier_id)}
+    fabrics = {}
+    stock = {}  # fabric_id -> [fabric, meters, cost] added by this import
+    latest = _latest_transaction_date(db)
+    backdated = False
+    batch = []
+    inserted = 0
+
+    def flush():
+        nonlocal inserted
+        ids = _insert_batch(db, models.Purchase, models.Purchase.purchase_id, batch)
+        db.execute(insert(models.StockLot), [
+            {"purchase_id": purchase_id, "fabric_id": p['fabric_id'], "fabric_type": p['fabric_type'],
+             "fabric_code": p['fabric_code'], "composition": p['composition'], "date": p['date'],
+             "quantity_meters": p['quantity_meters'], "price_per_meter": p['price_per_meter'],
+             "remaining_meters": p['quantity_meters']}
+            for purchase_id, p in zip(ids, batch)
+        ])
+        inserted += len(batch)
+        batch.clear()
+
+    try:
+        for row_number, data in rows:
+            try:
+                if data['supplier_id'] not in supplier_ids:
+                    raise ValueError(f"Unknown supplier_id {data['supplier_id']}")
+                fabric = _import_fabric(db, fabrics, data, create=True)
+                total_cost = data['quantity_meters'] * data['price_per_meter']
+                amount_paid, amount_due = _purchase_payment(total_cost, data.get('payment_status') or 'paid',
+                                                            data.get('amount_paid'))
+            except ValueError as e:
+                errors.append((row_number, str(e)))
                 continue
+            date, before = _import_date(data, latest)
+            backdated = backdated or before
+            batch.append({
+                "supplier_id": data['supplier_id'],
+                "date": date,
+                "fabric_id": fabric.fabric_id,
+                "fabric_type": fabric.fabric_type,
+                "fabric_code": fabric.fabric_code,
+                "composition": fabric.composition,
+                "quantity_meters": data['quantity_meters'],
+                "price_per_meter": data['price_per_meter'],
+                "total_cost": total_cost,
+                "payment_method": data.get('payment_method') or 'cash',
+                "payment_status": data.get('payment_status') or 'paid',
+                "amount_paid": amount_paid,
+                "amount_due": amount_due,
+            })
+            totals = stock.setdefault(fabric.fabric_id, [fabric, 0.0, 0.0])
+            totals[1] += data['quantity_meters']
+            totals[2] += total_cost
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        for fabric, meters, cost in stock.values():
+            _apply_stock_delta(db, fabric, purchased=meters, valuation=cost)
+        _finish_import(db, backdated)
+    except Exception:
+        db.rollback()
+        raise
+    return inserted
 
-        # totals
-        tp = db.query(func.coalesce(func.sum(models.Purchase.quantity_meters), 0)).filter(models.Purchase.fabric_type==t_type, models.Purchase.fabric_code==t_code).scalar() or 0
-        ts = db.query(func.coalesce(func.sum(models.Sale.quantity_meters), 0)).filter(models.Sale.fabric_type==t_type, models.Sale.fabric_code==t_code).scalar() or 0
-
-        # FIFO valuation: iterate purchases oldest->newest, subtract sold quantities to find remaining lots
-        purchases = db.query(models.Purchase).filter(models.Purchase.fabric_type==t_type, models.Purchase.fabric_code==t_code).order_by(models.Purchase.date.asc()).all()
-        total_sold = float(ts)
-        valuation = 0.0
-        remaining = 0.0
-
-        # allocate sold against purchase lots
-        for p in purchases:
-            lot_qty = float(p.quantity_meters)
-            if total_sold >= lot_qty:
-                # this lot fully consumed
-                total_sold -= lot_qty
-                lot_remaining = 0.0
-            else:
-                lot_remaining = lot_qty - total_sold
-                total_sold = 0.0
-            if lot_remaining > 0:
-                valuation += lot_remaining * float(p.price_per_meter)
-                remaining += lot_remaining
-
-        balance = float(tp - ts)
-        avg_cost = (valuation / remaining) if remaining > 0 else 0.0
-
-        result.append({
-            "fabric_type": t_type,
-            "fabric_code": t_code,
-            "composition": t_comp,
-            "total_purchased": float(tp),
-            "total_sold": float(ts),
-            "balance_in_meters": balance,
-            "avg_cost_per_meter": round(avg_cost, 2),
-            "stock_valuation": round(valuation, 2),
-        })
-    return result
+def bulk_create_sales(db: Session, rows, errors: list, batch_size: int = IMPORT_BATCH_ROWS):
+    """
+    Insert sales from (row_number, data) pairs, data being create_sale's keyword arguments plus an optional
+    date. Each sale takes from the lots dated up to its own date that earlier sales left open, exactly as
+    create_sale and a date-ordered replay would. A row is rejected (appended to errors as (row_number,
+    message)) when those lots can't cover it, or when it is dated in the future or before a sale already
+    recorded: slotting it in would change what later sales were allocated. Returns the number inserted.
+    """
+    customer_ids = {row[0] for row in db.query(models.Customer.customer_id)}
+    company_ids = {row[0] for row in db.query(models.Company.company_id)}
+    fabrics = {}
+    open_lots = {}  # fabric_id -> open StockLot objects, oldest first, consumed as rows are accepted
+    stock = {}  # fabric_id -> [fabric, meters, cost] sold by this import
+    latest = db.query(func.max(models.Sale.date)).scalar()
+    now = datetime.utcnow()
+    batch = []
+    batch_allocations = []  # per batch row: [(lot, meters taken)]
+    inserted = 0
+
+    def flush():
+        nonlocal inserted
+        ids = _insert_batch(db, models.Sale, models.Sale.sale_id, batch)
+        allocations = [{"sale_id": sale_id, "purchase_id": lot.purchase_id, "quantity_meters": taken,
+                        "price_per_meter": lot.price_per_meter}
+                       for sale_id, taken_lots in zip(ids, batch_allocations) for lot, taken in taken_lots]
+        if allocations:
+            db.execute(insert(models.SaleAllocation), allocations)
+        inserted += len(batch)
+        batch.clear()
+        batch_allocations.clear()
+
+    try:
+        for row_number, data in rows:
+            try:
+                if data['customer_id'] not in customer_ids:
+                    raise ValueError(f"Unknown customer_id {data['customer_id']}")
+                if data.get('company_id') is not None and data['company_id'] not in company_ids:
+                    raise ValueError(f"Unknown company_id {data['company_id']}")
+                date = data.get('date') or now
+                if date > now:
+                    raise ValueError(f"Sale date {date:%Y-%m-%d %H:%M} is in the future")
+                if latest is not None and date < latest:
+                    raise ValueError(f"Sale date {date:%Y-%m-%d %H:%M} is before the latest recorded sale "
+                                     f"({latest:%Y-%m-%d %H:%M})")
+                fabric = _import_fabric(db, fabrics, data, create=False)
+                if fabric is not None and fabric.fabric_id not in open_lots:
+                    open_lots[fabric.fabric_id] = _open_lots(db, fabric.fabric_id).all()
+                usable = [lot for lot in open_lots[fabric.fabric_id] if lot.date <= date] if fabric else []
+                left = sum(lot.remaining_meters for lot in usable)
+                if fabric is None or data['quantity_meters'] - left > FIFO_EPSILON:
+                    raise ValueError(f"Insufficient stock for {data.get('fabric_type')}. Available: {round(left, 2)}")
+            except ValueError as e:
+                errors.append((row_number, str(e)))
+                continue
+            latest = date
+            taken_lots = list(_take_from_lots(usable, data['quantity_meters']))
+            open_lots[fabric.fabric_id] = [lot for lot in open_lots[fabric.fabric_id] if lot.remaining_meters > 0]
+            totals = stock.setdefault(fabric.fabric_id, [fabric, 0.0, 0.0])
+            totals[1] += data['quantity_meters']
+            totals[2] += sum(taken * lot.price_per_meter for lot, taken in taken_lots)
+            apply_tax = data.get('apply_tax', True)
+            batch.append({
+                "company_id": data.get('company_id'),
+                "customer_id": data['customer_id'],
+                "date": date,
+                "fabric_id": fabric.fabric_id,
+                "fabric_type": fabric.fabric_type,
+                "fabric_code": fabric.fabric_code,
+                "composition": fabric.composition,
+                "quantity_meters": data['quantity_meters'],
+                "price_per_meter": data['price_per_meter'],
+                "payment_method": data.get('payment_method') or 'cash',
+                **_sale_amounts(data['quantity_meters'], data['price_per_meter'], apply_tax,
+                                data.get('tax_rate', 0.18), data.get('payment_status') or 'paid',
+                                data.get('amount_paid')),
+            })
+            batch_allocations.append(taken_lots)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        for fabric, meters, cost in stock.values():
+            _apply_stock_delta(db, fabric, sold=meters, valuation=-cost)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return inserted
+
+# Invoices
+def _row_dict(obj):
+    return {column.name: getattr(obj, column.name) for column in obj.__table__.columns}
+
+def _invoice_snapshot(sale):
+    return {
+        "sale": _row_dict(sale),
+        "customer": _row_dict(sale.customer),
+        "company": _row_dict(sale.company) if sale.company else None,
+        "payments": [_row_dict(p) for p in sorted(sale.payments, key=lambda p: p.payment_id)],
+    }
+
+def get_invoice_snapshot(db: Session, sale_id: int):
+    """
+    Everything an invoice shows for one sale as plain dicts (sale, customer, company, payments),
+    read in two queries; None if the sale doesn't exist
+    """
+    sale = db.query(models.Sale).options(
+        joinedload(models.Sale.customer), joinedload(models.Sale.company), selectinload(models.Sale.payments)
+    ).filter(models.Sale.sale_id == sale_id).first()
+    return _invoice_snapshot(sale) if sale else None
+
+def get_invoice_snapshots(db: Session, limit: int, **filters):
+    """
+    Invoice snapshots for the sales matching sale_ledger_query's filters, oldest first, in three
+    queries whatever their number. Raises ValueError when more than limit sales match.
+    """
+    sales = sale_ledger_query(db, **filters).order_by(None).order_by(
+        models.Sale.date.asc(), models.Sale.sale_id.asc()
+    ).options(
+        contains_eager(models.Sale.customer), joinedload(models.Sale.company), selectinload(models.Sale.payments)
+    ).limit(limit + 1).all()
+    if len(sales) > limit:
+        raise ValueError(f"More than {limit} sales match; narrow the filter")
+    return [_invoice_snapshot(sale) for sale in sales]
 
 # Profit/Loss (simple): total sales (net) - total purchases
+@cached('purchases', 'sales')
 def get_profit_loss(db: Session):
     total_purchased_cost = db.query(func.coalesce(func.sum(models.Purchase.total_cost), 0)).scalar() or 0
     total_sales_revenue = db.query(func.coalesce(func.sum(models.Sale.total_price_with_tax), 0)).scalar() or 0
@@ -215,18 +921,86 @@ def get_profit_loss(db: Session):
     return {"total_purchased_cost": float(total_purchased_cost), "total_sales_revenue": float(total_sales_revenue), "profit": profit}
 
 
+# Fabric typeahead search
+# fabric_search is an FTS5 trigram index over stock_positions' fabric keys (see migrations.py): terms of
+# three or more characters match anywhere inside a word. Results are ranked with fabric_type prefix hits
+# first, then by bm25 relevance. A search nothing contains (usually a typo) is retried fuzzily, matching
+# fabrics that share any trigram with the terms; bm25 puts the ones sharing the most first.
+FABRIC_SEARCH_LIMIT = 20
+MAX_FABRIC_SEARCH_LIMIT = 100
+FABRIC_SEARCH_WEIGHTS = (10.0, 5.0, 1.0)  # bm25 weights of fabric_type, fabric_code, composition
+_fabric_search = table('fabric_search', column('rowid'))
+_fabric_search_binds = weakref.WeakKeyDictionary()  # engine -> whether its database has fabric_search
+
+def set_fabric_search(bind, available: bool):
+    """Record whether bind's database has the fabric_search index (migrations.ensure_fabric_search calls this)"""
+    _fabric_search_binds[bind.engine] = available
+
+def _has_fabric_search(db: Session):
+    bind = db.get_bind().engine
+    if bind not in _fabric_search_binds:
+        # a database prepare_database never saw (scripts, tests): look once
+        set_fabric_search(bind, db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fabric_search'")).first() is not None)
+    return _fabric_search_binds[bind]
+
+def get_fabric_catalog_version(db: Session):
+    """Changes whenever the set of searchable fabrics changes; used for HTTP validators"""
+    count, last_id = db.query(func.count(models.StockPosition.position_id),
+                              func.max(models.StockPosition.position_id)).one()
+    return f"{count}-{last_id or 0}"
+
+def _fts_phrase(value: str):
+    return '"%s"' % value.replace('"', '""')
+
+def _matching_fabrics(db: Session, terms, substring_terms, limit: int, match: str | None = None):
+    position = models.StockPosition
+    query = db.query(position.fabric_type, position.fabric_code, position.composition)
+    ranking = []
+    if terms:
+        ranking.append(case((func.lower(position.fabric_type).startswith(terms[0], autoescape=True), 0), else_=1))
+    if match is not None:
+        query = query.join(_fabric_search, _fabric_search.c.rowid == position.position_id).filter(
+            literal_column('fabric_search').op('MATCH')(match)
+        )
+        ranking.append(func.bm25(literal_column('fabric_search'), *FABRIC_SEARCH_WEIGHTS))
+    for term in substring_terms:
+        query = query.filter(_stock_search_filter(position, term))
+    rows = query.order_by(*ranking, position.fabric_type, position.fabric_code, position.composition).limit(limit)
+    return [{"fabric_type": t, "fabric_code": code, "composition": comp} for t, code, comp in rows]
+
+def search_fabrics(db: Session, q: str | None = None, limit: int = None):
+    """
+    Distinct fabrics (type, code, composition) matching every word of q, best matches first; when none
+    contains every word, the closest fuzzy matches instead
+    """
+    limit = max(1, min(int(limit or FABRIC_SEARCH_LIMIT), MAX_FABRIC_SEARCH_LIMIT))
+    terms = (q or '').lower().split()
+    indexed_terms = [t for t in terms if len(t) >= 3]
+    if not indexed_terms or not _has_fabric_search(db):
+        # short terms (or no FTS5 in this SQLite build): substring scan of the small positions table
+        return _matching_fabrics(db, terms, terms, limit)
+
+    short_terms = [t for t in terms if t not in indexed_terms]
+    rows = _matching_fabrics(db, terms, short_terms, limit, ' AND '.join(map(_fts_phrase, indexed_terms)))
+    if not rows:
+        trigrams = sorted({t[i:i + 3] for t in indexed_terms for i in range(len(t) - 2)})
+        rows = _matching_fabrics(db, terms, short_terms, limit, ' OR '.join(map(_fts_phrase, trigrams)))
+    return rows
+
 def get_available_fabrics(db: Session):
     # return fabrics with positive balance
-    stock = get_stock_summary(db)
-    return [s for s in stock if s['balance_in_meters'] > 0]
+    positions = db.query(models.StockPosition).filter(models.StockPosition.balance_in_meters > 0).order_by(
+        models.StockPosition.fabric_type, models.StockPosition.fabric_code, models.StockPosition.composition
+    ).all()
+    return [{**stock_position_dict(p), "fabric_id": p.fabric_id} for p in positions]
 
 # Ledger functions with advanced filtering
-def get_purchase_ledger(db: Session, supplier_id: int = None, fabric_type: str = None, 
-                        fabric_code: str = None, date_from: datetime = None, 
-                        date_to: datetime = None, search_query: str = None):
+def purchase_ledger_query(db: Session, supplier_id: int = None, fabric_type: str = None, 
+                          fabric_code: str = None, date_from: datetime = None, 
+                          date_to: datetime = None, search_query: str = None):
     """
-    Get purchase ledger with advanced filters
-    Returns list of purchases with calculated totals
+    Filtered purchase ledger query (purchases joined to suppliers), newest first
     """
     query = db.query(models.Purchase).join(models.Supplier)
     
@@ -259,26 +1033,43 @@ def get_purchase_ledger(db: Session, supplier_id: int = None, fabric_type: str =
             (models.Supplier.name.ilike(search_pattern))
         )
     
-    purchases = query.order_by(models.Purchase.date.desc()).all()
+    return query.order_by(models.Purchase.date.desc())
+
+def get_purchase_ledger(db: Session, supplier_id: int = None, fabric_type: str = None, 
+                        fabric_code: str = None, date_from: datetime = None, 
+                        date_to: datetime = None, search_query: str = None,
+                        limit: int = None, cursor: str = None, direction: str = 'next'):
+    """
+    Get purchase ledger with advanced filters
+    Totals cover the whole filter (one aggregate query); 'purchases' is one keyset page of rows
+    """
+    query = purchase_ledger_query(db, supplier_id=supplier_id, fabric_type=fabric_type, fabric_code=fabric_code,
+                                  date_from=date_from, date_to=date_to, search_query=search_query).order_by(None)
     
-    # Calculate totals
-    total_quantity = sum(p.quantity_meters for p in purchases)
-    total_amount = sum(p.total_cost for p in purchases)
+    count, total_quantity, total_amount = query.with_entities(
+        func.count(models.Purchase.purchase_id),
+        func.coalesce(func.sum(models.Purchase.quantity_meters), 0.0),
+        func.coalesce(func.sum(models.Purchase.total_cost), 0.0)
+    ).one()
+    
+    page = paginate_keyset(query.options(contains_eager(models.Purchase.supplier)),
+                           models.Purchase.date, models.Purchase.purchase_id,
+                           limit=limit, cursor=cursor, direction=direction, total_estimate=count)
     
     return {
-        'purchases': purchases,
+        'purchases': page['rows'],
+        'page': page,
         'total_quantity': round(total_quantity, 2),
         'total_amount': round(total_amount, 2),
-        'count': len(purchases)
+        'count': count
     }
 
-def get_sale_ledger(db: Session, customer_id: int = None, company_id: int = None,
-                   fabric_type: str = None, fabric_code: str = None, 
-                   date_from: datetime = None, date_to: datetime = None, 
-                   search_query: str = None, apply_tax_filter: bool = None):
+def sale_ledger_query(db: Session, customer_id: int = None, company_id: int = None,
+                      fabric_type: str = None, fabric_code: str = None, 
+                      date_from: datetime = None, date_to: datetime = None, 
+                      search_query: str = None, apply_tax_filter: bool = None):
     """
-    Get sale ledger with advanced filters
-    Returns list of sales with calculated totals
+    Filtered sale ledger query (sales joined to customers), newest first
     """
     query = db.query(models.Sale).join(models.Customer)
     
@@ -317,23 +1108,44 @@ def get_sale_ledger(db: Session, customer_id: int = None, company_id: int = None
             (models.Customer.name.ilike(search_pattern))
         )
     
-    sales = query.order_by(models.Sale.date.desc()).all()
-    
-    # Calculate totals
-    total_quantity = sum(s.quantity_meters for s in sales)
-    subtotal = sum(s.quantity_meters * s.price_per_meter for s in sales)
-    total_tax = sum(s.tax for s in sales)
-    total_amount = sum(s.total_price_with_tax for s in sales)
+    return query.order_by(models.Sale.date.desc())
+
+def get_sale_ledger(db: Session, customer_id: int = None, company_id: int = None,
+                   fabric_type: str = None, fabric_code: str = None, 
+                   date_from: datetime = None, date_to: datetime = None, 
+                   search_query: str = None, apply_tax_filter: bool = None,
+                   limit: int = None, cursor: str = None, direction: str = 'next'):
+    """
+    Get sale ledger with advanced filters
+    Totals cover the whole filter (one aggregate query); 'sales' is one keyset page of rows
+    """
+    query = sale_ledger_query(db, customer_id=customer_id, company_id=company_id, fabric_type=fabric_type,
+                              fabric_code=fabric_code, date_from=date_from, date_to=date_to,
+                              search_query=search_query, apply_tax_filter=apply_tax_filter).order_by(None)
+    
+    count, total_quantity, subtotal, total_tax, total_amount = query.with_entities(
+        func.count(models.Sale.sale_id),
+        func.coalesce(func.sum(models.Sale.quantity_meters), 0.0),
+        func.coalesce(func.sum(models.Sale.quantity_meters * models.Sale.price_per_meter), 0.0),
+        func.coalesce(func.sum(models.Sale.tax), 0.0),
+        func.coalesce(func.sum(models.Sale.total_price_with_tax), 0.0)
+    ).one()
+    
+    page = paginate_keyset(query.options(contains_eager(models.Sale.customer), joinedload(models.Sale.company)),
+                           models.Sale.date, models.Sale.sale_id,
+                           limit=limit, cursor=cursor, direction=direction, total_estimate=count)
     
     return {
-        'sales': sales,
+        'sales': page['rows'],
+        'page': page,
         'total_quantity': round(total_quantity, 2),
         'subtotal': round(subtotal, 2),
         'total_tax': round(total_tax, 2),
         'total_amount': round(total_amount, 2),
-        'count': len(sales)
+        'count': count
     }
 
+@cached('customers', 'sales')
 def get_customer_ledger_summary(db: Session, date_from: datetime = None, date_to: datetime = None):
     """
     Get summary of sales grouped by customer for ledger overview
@@ -366,6 +1178,7 @@ def get_customer_ledger_summary(db: Session, date_from: datetime = None, date_to
         'total_amount': round(float(r.total_amount or 0), 2)
     } for r in results]
 
+@cached('suppliers', 'purchases')
 def get_supplier_ledger_summary(db: Session, date_from: datetime = None, date_to: datetime = None):
     """
     Get summary of purchases grouped by supplier for ledger overview
@@ -446,17 +1259,46 @@ def get_payments_for_sale(db: Session, sale_id: int):
     """
     return db.query(models.Payment).filter(models.Payment.sale_id == sale_id).order_by(models.Payment.payment_date.desc()).all()
 
-def get_pending_payments(db: Session, customer_id: int = None):
-    """
-    Get all sales with pending or partial payments
-    """
+def _pending_sales_query(db: Session, customer_id: int = None):
     query = db.query(models.Sale).filter(models.Sale.payment_status.in_(['pending', 'partial']))
     
     if customer_id:
         query = query.filter(models.Sale.customer_id == customer_id)
     
-    return query.order_by(models.Sale.date.desc()).all()
+    return query
+
+def get_pending_payments(db: Session, customer_id: int = None, limit: int = None, cursor: str = None,
+                         direction: str = 'next'):
+    """
+    Get one page of sales with pending or partial payments, plus totals over the whole filter
+    """
+    totals = get_pending_payment_totals(db, customer_id)
+    query = _pending_sales_query(db, customer_id).options(joinedload(models.Sale.customer))
+    page = paginate_keyset(query, models.Sale.date, models.Sale.sale_id,
+                           limit=limit, cursor=cursor, direction=direction, total_estimate=totals['count'])
+    page.update(totals)
+    return page
 
+def get_pending_payment_totals(db: Session, customer_id: int = None):
+    """
+    Count and amounts of all the sales get_pending_payments pages through, from one aggregate query
+    """
+    count, partial_count, total_sales, total_paid, total_due = _pending_sales_query(db, customer_id).with_entities(
+        func.count(models.Sale.sale_id),
+        func.count(case((models.Sale.payment_status == 'partial', 1))),
+        func.coalesce(func.sum(models.Sale.total_price_with_tax), 0.0),
+        func.coalesce(func.sum(models.Sale.amount_paid), 0.0),
+        func.coalesce(func.sum(models.Sale.amount_due), 0.0)
+    ).one()
+    return {
+        'count': count,
+        'partial_count': partial_count,
+        'total_sales': round(total_sales, 2),
+        'total_paid': round(total_paid, 2),
+        'total_due': round(total_due, 2)
+    }
+
+@cached('customers', 'sales')
 def get_customer_credit_summary(db: Session, date_from: datetime = None, date_to: datetime = None):
     """
     Get summary of customers with outstanding credit
@@ -489,14 +1331,18 @@ def get_customer_credit_summary(db: Session, date_from: datetime = None, date_to
         'total_sales': round(float(r.total_sales or 0), 2)
     } for r in results]
 
-def get_payment_history(db: Session, customer_id: int = None, date_from: datetime = None, date_to: datetime = None):
+def get_payment_history(db: Session, customer_id: int = None, date_from: datetime = None, date_to: datetime = None,
+                        payment_method: str = None, limit: int = None, cursor: str = None, direction: str = 'next'):
     """
-    Get payment history with customer details
+    Get one page of payment history with customer details, plus totals over the whole filter
     """
-    query = db.query(models.Payment).join(models.Sale).join(models.Customer)
+    query = db.query(models.Payment)
     
     if customer_id:
-        query = query.filter(models.Customer.customer_id == customer_id)
+        query = query.join(models.Sale).filter(models.Sale.customer_id == customer_id)
+    
+    if payment_method:
+        query = query.filter(models.Payment.payment_method == payment_method)
     
     if date_from:
         query = query.filter(models.Payment.payment_date >= date_from)
@@ -506,7 +1352,14 @@ def get_payment_history(db: Session, customer_id: int = None, date_from: datetim
         date_to_end = date_to + timedelta(days=1)
         query = query.filter(models.Payment.payment_date < date_to_end)
     
-    return query.order_by(models.Payment.payment_date.desc()).all()
+    count, total_amount = query.with_entities(func.count(models.Payment.payment_id),
+                                              func.coalesce(func.sum(models.Payment.amount), 0)).one()
+    query = query.options(joinedload(models.Payment.sale).joinedload(models.Sale.customer))
+    page = paginate_keyset(query, models.Payment.payment_date, models.Payment.payment_id,
+                           limit=limit, cursor=cursor, direction=direction, total_estimate=count)
+    page['count'] = count
+    page['total_amount'] = round(float(total_amount), 2)
+    return page
 
 # Purchase Payment management functions
 def add_purchase_payment(db: Session, purchase_id: int, amount: float, payment_method: str = 'cash', 
@@ -556,17 +1409,57 @@ def get_payments_for_purchase(db: Session, purchase_id: int):
     """
     return db.query(models.PurchasePayment).filter(models.PurchasePayment.purchase_id == purchase_id).order_by(models.PurchasePayment.payment_date.desc()).all()
 
-def get_pending_purchase_payments(db: Session, supplier_id: int = None):
-    """
-    Get all purchases with pending or partial payments
-    """
+def _pending_purchases_query(db: Session, supplier_id: int = None, date_from: datetime = None, date_to: datetime = None):
     query = db.query(models.Purchase).filter(models.Purchase.payment_status.in_(['pending', 'partial']))
     
     if supplier_id:
         query = query.filter(models.Purchase.supplier_id == supplier_id)
     
-    return query.order_by(models.Purchase.date.desc()).all()
+    if date_from:
+        query = query.filter(models.Purchase.date >= date_from)
+    
+    if date_to:
+        from datetime import timedelta
+        date_to_end = date_to + timedelta(days=1)
+        query = query.filter(models.Purchase.date < date_to_end)
+    
+    return query
+
+def get_pending_purchase_payments(db: Session, supplier_id: int = None, date_from: datetime = None, date_to: datetime = None,
+                                  limit: int = None, cursor: str = None, direction: str = 'next'):
+    """
+    Get one page of purchases with pending or partial payments, plus totals over the whole filter
+    """
+    totals = get_pending_purchase_payment_totals(db, supplier_id, date_from, date_to)
+    query = _pending_purchases_query(db, supplier_id, date_from, date_to).options(joinedload(models.Purchase.supplier))
+    page = paginate_keyset(query, models.Purchase.date, models.Purchase.purchase_id,
+                           limit=limit, cursor=cursor, direction=direction, total_estimate=totals['count'])
+    page.update(totals)
+    return page
+
+def get_pending_purchase_payment_totals(db: Session, supplier_id: int = None, date_from: datetime = None,
+                                        date_to: datetime = None):
+    """
+    Count and amounts of all the purchases get_pending_purchase_payments pages through, from one aggregate query
+    """
+    count, partial_count, total_purchases, total_paid, total_due = _pending_purchases_query(
+        db, supplier_id, date_from, date_to
+    ).with_entities(
+        func.count(models.Purchase.purchase_id),
+        func.count(case((models.Purchase.payment_status == 'partial', 1))),
+        func.coalesce(func.sum(models.Purchase.total_cost), 0.0),
+        func.coalesce(func.sum(models.Purchase.amount_paid), 0.0),
+        func.coalesce(func.sum(models.Purchase.amount_due), 0.0)
+    ).one()
+    return {
+        'count': count,
+        'partial_count': partial_count,
+        'total_purchases': round(total_purchases, 2),
+        'total_paid': round(total_paid, 2),
+        'total_due': round(total_due, 2)
+    }
 
+@cached('suppliers', 'purchases')
 def get_supplier_credit_summary(db: Session, date_from: datetime = None, date_to: datetime = None):
     """
     Get summary of suppliers with outstanding credit (amounts we owe)
@@ -599,14 +1492,18 @@ def get_supplier_credit_summary(db: Session, date_from: datetime = None, date_to
         'total_purchases': round(float(r.total_purchases or 0), 2)
     } for r in results]
 
-def get_purchase_payment_history(db: Session, supplier_id: int = None, date_from: datetime = None, date_to: datetime = None):
+def get_purchase_payment_history(db: Session, supplier_id: int = None, date_from: datetime = None, date_to: datetime = None,
+                                 payment_method: str = None, limit: int = None, cursor: str = None, direction: str = 'next'):
     """
-    Get purchase payment history with supplier details
+    Get one page of purchase payment history with supplier details, plus totals over the whole filter
     """
-    query = db.query(models.PurchasePayment).join(models.Purchase).join(models.Supplier)
+    query = db.query(models.PurchasePayment)
     
     if supplier_id:
-        query = query.filter(models.Supplier.supplier_id == supplier_id)
+        query = query.join(models.Purchase).filter(models.Purchase.supplier_id == supplier_id)
+    
+    if payment_method:
+        query = query.filter(models.PurchasePayment.payment_method == payment_method)
     
     if date_from:
         query = query.filter(models.PurchasePayment.payment_date >= date_from)
@@ -616,7 +1513,14 @@ def get_purchase_payment_history(db: Session, supplier_id: int = None, date_from
         date_to_end = date_to + timedelta(days=1)
         query = query.filter(models.PurchasePayment.payment_date < date_to_end)
     
-    return query.order_by(models.PurchasePayment.payment_date.desc()).all()
+    count, total_amount = query.with_entities(func.count(models.PurchasePayment.payment_id),
+                                              func.coalesce(func.sum(models.PurchasePayment.amount), 0)).one()
+    query = query.options(joinedload(models.PurchasePayment.purchase).joinedload(models.Purchase.supplier))
+    page = paginate_keyset(query, models.PurchasePayment.payment_date, models.PurchasePayment.payment_id,
+                           limit=limit, cursor=cursor, direction=direction, total_estimate=count)
+    page['count'] = count
+    page['total_amount'] = round(float(total_amount), 2)
+    return page
 
 
 # ===================== BANK STATEMENT FUNCTIONS =====================
@@ -641,6 +1545,7 @@ def add_bank_statement(db: Session, transaction_type: str, amount: float, descri
         amount=amount,
         description=description,
         bank_account=bank_account,
+        bank_account_id=_bank_account_id(db, bank_account),
         reference_number=reference_number,
         related_sale_id=related_sale_id,
         related_purchase_id=related_purchase_id,
@@ -650,6 +1555,8 @@ def add_bank_statement(db: Session, transaction_type: str, amount: float, descri
         recorded_by=recorded_by
     )
     db.add(statement)
+    db.flush()
+    _apply_bank_flow(db, statement, 1)
     db.commit()
     db.refresh(statement)
     return statement
@@ -658,11 +1565,11 @@ def get_bank_statement(db: Session, statement_id: int):
     """Get a specific bank statement by ID"""
     return db.query(models.BankStatement).filter(models.BankStatement.statement_id == statement_id).first()
 
-def get_bank_statements(db: Session, transaction_type: str = None, status: str = None, 
-                        date_from: datetime = None, date_to: datetime = None,
-                        bank_account: str = None):
+def bank_statements_query(db: Session, transaction_type: str = None, status: str = None, 
+                          date_from: datetime = None, date_to: datetime = None,
+                          bank_account: str = None):
     """
-    Get bank statements with advanced filtering
+    Filtered bank statement query, newest first
     """
     query = db.query(models.BankStatement)
     
@@ -683,68 +1590,261 @@ def get_bank_statements(db: Session, transaction_type: str = None, status: str =
         date_to_end = date_to + timedelta(days=1)
         query = query.filter(models.BankStatement.transaction_date < date_to_end)
     
-    return query.order_by(models.BankStatement.transaction_date.desc()).all()
+    return query.order_by(models.BankStatement.transaction_date.desc())
+
+def get_bank_statements(db: Session, transaction_type: str = None, status: str = None, 
+                        date_from: datetime = None, date_to: datetime = None,
+                        bank_account: str = None):
+    """
+    Get bank statements with advanced filtering
+    """
+    return bank_statements_query(db, transaction_type=transaction_type, status=status, date_from=date_from,
+                                 date_to=date_to, bank_account=bank_account).all()
+
+def get_bank_statement_page(db: Session, transaction_type: str = None, status: str = None,
+                            date_from: datetime = None, date_to: datetime = None, bank_account: str = None,
+                            limit: int = None, cursor: str = None, direction: str = 'next'):
+    """
+    One keyset page of filtered bank statements
+    """
+    query = bank_statements_query(db, transaction_type=transaction_type, status=status, date_from=date_from,
+                                  date_to=date_to, bank_account=bank_account).order_by(None)
+    return paginate_keyset(query, models.BankStatement.transaction_date, models.BankStatement.statement_id,
+                           limit=limit, cursor=cursor, direction=direction)
+
+# Bank accounts
+def _bank_account_id(db: Session, name: str | None):
+    """bank_account_id for an account name, creating the bank_accounts row on first use"""
+    if not name:
+        return None
+    account = db.query(models.BankAccount).filter(models.BankAccount.name == name).first()
+    if account is None:
+        account = models.BankAccount(name=name, current_balance=0.0, transaction_count=0)
+        db.add(account)
+        db.flush()
+    return account.bank_account_id
+
+def _apply_account_flow(db: Session, statement, sign: int):
+    """
+    Add (sign=1) or remove (sign=-1) one statement from its account's cached balance, count and last date.
+    The figures are adjusted in SQL rather than written back from values loaded earlier, which a
+    concurrent statement write may have changed since.
+    """
+    if statement.bank_account_id is None:
+        return
+    A = models.BankAccount
+    signed_amount = statement.amount if statement.transaction_type == 'credit' else -statement.amount
+    date = statement.transaction_date
+    if sign > 0:
+        last = case((or_(A.last_transaction_date.is_(None), A.last_transaction_date < date), date),
+                    else_=A.last_transaction_date)
+    else:
+        # the newest statement is going away: take the next newest from the (account, date) index
+        next_newest = select(func.max(models.BankStatement.transaction_date)).where(
+            models.BankStatement.bank_account_id == statement.bank_account_id,
+            models.BankStatement.statement_id != statement.statement_id
+        ).scalar_subquery()
+        last = case((A.last_transaction_date == date, next_newest), else_=A.last_transaction_date)
+    db.query(A).filter(A.bank_account_id == statement.bank_account_id).update({
+        A.current_balance: A.current_balance + sign * signed_amount,
+        A.transaction_count: A.transaction_count + sign,
+        A.last_transaction_date: last,
+    }, synchronize_session='fetch')
+
+def get_bank_accounts(db: Session):
+    """All bank accounts with their cached balance, statement count and last transaction date"""
+    return db.query(models.BankAccount).order_by(models.BankAccount.name).all()
+
+def get_bank_account_names(db: Session):
+    """Account names for filter lists"""
+    return [name for (name,) in db.query(models.BankAccount.name).order_by(models.BankAccount.name)]
+
+# Bank balance checkpoints
+# bank_balance_checkpoints holds each account's credits/debits per calendar month, updated with every
+# statement write. A balance or period total reads whole months from the checkpoints and only sums
+# bank_statements (by index) for the partial months at either end of the range.
+def _month_start(value: datetime):
+    return datetime(value.year, value.month, 1)
+
+def _next_month(value: datetime):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+def _apply_bank_flow(db: Session, statement, sign: int):
+    """Add (sign=1) or remove (sign=-1) one statement from its month's checkpoint and its account"""
+    _apply_account_flow(db, statement, sign)
+    C = models.BankBalanceCheckpoint
+    period_start = _month_start(statement.transaction_date)
+    credit = sign * statement.amount if statement.transaction_type == 'credit' else 0.0
+    debit = 0.0 if statement.transaction_type == 'credit' else sign * statement.amount
+    # increments in SQL, like the account above; the UPDATE holds the write lock, so inserting a
+    # missing month can't race another writer
+    updated = db.query(C).filter(C.bank_account == statement.bank_account, C.period_start == period_start).update({
+        C.total_credit: C.total_credit + credit,
+        C.total_debit: C.total_debit + debit,
+        C.transaction_count: C.transaction_count + sign,
+    }, synchronize_session='fetch')
+    if not updated:
+        db.add(models.BankBalanceCheckpoint(bank_account=statement.bank_account, period_start=period_start,
+                                            total_credit=credit, total_debit=debit, transaction_count=sign))
+        db.flush()
+
+def _statement_flows(db: Session, start: datetime, end: datetime, bank_account: str = None):
+    """(credit, debit, count) summed from bank_statements with start <= transaction_date < end"""
+    statement = models.BankStatement
+    query = db.query(
+        func.coalesce(func.sum(case((statement.transaction_type == 'credit', statement.amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((statement.transaction_type == 'credit', 0.0), else_=statement.amount)), 0.0),
+        func.count(statement.statement_id)
+    )
+    if start:
+        query = query.filter(statement.transaction_date >= start)
+    if end:
+        query = query.filter(statement.transaction_date < end)
+    if bank_account:
+        query = query.filter(statement.bank_account == bank_account)
+    return query.one()
+
+def _checkpoint_flows(db: Session, start: datetime, end: datetime, bank_account: str = None):
+    """(credit, debit, count) of the whole months with start <= period_start < end"""
+    checkpoint = models.BankBalanceCheckpoint
+    query = db.query(
+        func.coalesce(func.sum(checkpoint.total_credit), 0.0),
+        func.coalesce(func.sum(checkpoint.total_debit), 0.0),
+        func.coalesce(func.sum(checkpoint.transaction_count), 0)
+    )
+    if start:
+        query = query.filter(checkpoint.period_start >= start)
+    if end:
+        query = query.filter(checkpoint.period_start < end)
+    if bank_account:
+        query = query.filter(checkpoint.bank_account == bank_account)
+    return query.one()
+
+def get_bank_flows(db: Session, start: datetime = None, end: datetime = None, bank_account: str = None):
+    """
+    Credits, debits and statement count with start <= transaction_date < end (either bound may be open),
+    for one account or all of them
+    """
+    months_from = start if start is None or start == _month_start(start) else _next_month(start)
+    months_to = end if end is None else _month_start(end)
+    if months_from is not None and months_to is not None and months_from >= months_to:
+        credit, debit, count = _statement_flows(db, start, end, bank_account)
+        return {'credit': credit, 'debit': debit, 'count': count}
+
+    credit, debit, count = _checkpoint_flows(db, months_from, months_to, bank_account)
+    for edge_start, edge_end in ((start, months_from), (months_to, end)):
+        if edge_start is not None and edge_end is not None and edge_start < edge_end:
+            edge = _statement_flows(db, edge_start, edge_end, bank_account)
+            credit, debit, count = credit + edge[0], debit + edge[1], count + edge[2]
+    return {'credit': credit, 'debit': debit, 'count': count}
+
+def get_bank_opening_balance(db: Session, date_from: datetime = None, bank_account: str = None):
+    """
+    Net balance (credits less debits) of everything before date_from; 0 without a start date
+    """
+    if not date_from:
+        return 0.0
+    flows = get_bank_flows(db, end=date_from, bank_account=bank_account)
+    return round(flows['credit'] - flows['debit'], 2)
 
 def get_bank_summary(db: Session, date_from: datetime = None, date_to: datetime = None, bank_account: str = None):
     """
     Get bank statement summary with opening balance, total credits, total debits, closing balance
     """
-    query = db.query(models.BankStatement)
+    from datetime import timedelta
+    date_to_end = date_to + timedelta(days=1) if date_to else None
     
-    if bank_account:
-        query = query.filter(models.BankStatement.bank_account == bank_account)
-    
-    all_statements = query.order_by(models.BankStatement.transaction_date.asc()).all()
-    
-    # Calculate opening balance (before date_from)
-    opening_balance = 0.0
-    period_statements = []
-    
-    if date_from or date_to:
-        for stmt in all_statements:
-            stmt_date = stmt.transaction_date.date() if hasattr(stmt.transaction_date, 'date') else stmt.transaction_date
-            
-            if date_from:
-                date_from_obj = date_from.date() if hasattr(date_from, 'date') else date_from
-                if stmt_date < date_from_obj:
-                    if stmt.transaction_type == 'credit':
-                        opening_balance += stmt.amount
-                    else:
-                        opening_balance -= stmt.amount
-                    continue
-            
-            if date_to:
-                date_to_obj = date_to.date() if hasattr(date_to, 'date') else date_to
-                if stmt_date > date_to_obj:
-                    continue
-            
-            period_statements.append(stmt)
-    else:
-        period_statements = all_statements
-    
-    # Calculate totals for period
-    total_credit = sum(s.amount for s in period_statements if s.transaction_type == 'credit')
-    total_debit = sum(s.amount for s in period_statements if s.transaction_type == 'debit')
-    closing_balance = opening_balance + total_credit - total_debit
+    opening_balance = get_bank_opening_balance(db, date_from=date_from, bank_account=bank_account)
+    period = get_bank_flows(db, start=date_from, end=date_to_end, bank_account=bank_account)
+    closing_balance = opening_balance + period['credit'] - period['debit']
     
     return {
         'opening_balance': round(opening_balance, 2),
-        'total_credit': round(total_credit, 2),
-        'total_debit': round(total_debit, 2),
+        'total_credit': round(period['credit'], 2),
+        'total_debit': round(period['debit'], 2),
         'closing_balance': round(closing_balance, 2),
-        'transaction_count': len(period_statements),
-        'statements': period_statements
+        'transaction_count': period['count']
     }
 
+def _monthly_bank_flows(db: Session):
+    """{(bank_account, period_start): (credit, debit, count)} grouped straight from bank_statements"""
+    statement = models.BankStatement
+    month = func.strftime('%Y-%m', statement.transaction_date)
+    rows = db.query(
+        statement.bank_account,
+        month,
+        func.coalesce(func.sum(case((statement.transaction_type == 'credit', statement.amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((statement.transaction_type == 'credit', 0.0), else_=statement.amount)), 0.0),
+        func.count(statement.statement_id)
+    ).group_by(statement.bank_account, month).all()
+    return {(account, datetime.strptime(month_key, '%Y-%m')): (credit, debit, count)
+            for account, month_key, credit, debit, count in rows}
+
+def rebuild_bank_checkpoints(db: Session):
+    """Recompute bank_balance_checkpoints from bank_statements; returns the number of checkpoints written"""
+    flows = _monthly_bank_flows(db)
+    db.query(models.BankBalanceCheckpoint).delete(synchronize_session='fetch')
+    for (bank_account, period_start), (credit, debit, count) in flows.items():
+        db.add(models.BankBalanceCheckpoint(
+            bank_account=bank_account,
+            period_start=period_start,
+            total_credit=credit,
+            total_debit=debit,
+            transaction_count=count
+        ))
+    db.commit()
+    return len(flows)
+
+def verify_bank_checkpoints(db: Session):
+    """Checkpoint months whose totals differ from bank_statements; empty when consistent"""
+    def rounded(flow):
+        return (round(flow[0], 2), round(flow[1], 2), flow[2])
+
+    actual = {key: rounded(flow) for key, flow in _monthly_bank_flows(db).items()}
+    stored = {
+        (c.bank_account, c.period_start): rounded((c.total_credit, c.total_debit, c.transaction_count))
+        for c in db.query(models.BankBalanceCheckpoint).filter(models.BankBalanceCheckpoint.transaction_count != 0)
+    }
+    return [
+        {'bank_account': key[0], 'period_start': key[1], 'stored': stored.get(key), 'actual': actual.get(key)}
+        for key in sorted(set(actual) | set(stored), key=lambda k: (k[0] or '', k[1]))
+        if stored.get(key) != actual.get(key)
+    ]
+
+def ensure_bank_checkpoints(db: Session):
+    """Build checkpoints on databases whose bank statements predate the table"""
+    if db.query(models.BankStatement.statement_id).first() is None:
+        return False
+    if db.query(models.BankBalanceCheckpoint.checkpoint_id).first() is not None:
+        return False
+    rebuild_bank_checkpoints(db)
+    return True
+
+def _locked_statement(db: Session, statement_id: int):
+    """
+    Load a statement for an edit or delete inside a write transaction: the no-op UPDATE takes SQLite's
+    write lock first, so the figures reversed out of its checkpoint and account are the stored ones and
+    not ones a concurrent edit has since replaced.
+    """
+    S = models.BankStatement
+    db.query(S).filter(S.statement_id == statement_id).update({S.statement_id: S.statement_id},
+                                                               synchronize_session=False)
+    return db.query(S).populate_existing().filter(S.statement_id == statement_id).first()
+
 def update_bank_statement(db: Session, statement_id: int, **kwargs):
     """Update a bank statement record"""
-    statement = db.query(models.BankStatement).filter(models.BankStatement.statement_id == statement_id).first()
+    statement = _locked_statement(db, statement_id)
     if not statement:
+        db.rollback()
         raise ValueError(f"Bank statement {statement_id} not found")
     
+    _apply_bank_flow(db, statement, -1)
     for key, value in kwargs.items():
         if hasattr(statement, key):
             setattr(statement, key, value)
+    if 'bank_account' in kwargs:
+        statement.bank_account_id = _bank_account_id(db, statement.bank_account)
+    _apply_bank_flow(db, statement, 1)
     
     db.commit()
     db.refresh(statement)
@@ -752,53 +1852,63 @@ def update_bank_statement(db: Session, statement_id: int, **kwargs):
 
 def delete_bank_statement(db: Session, statement_id: int):
     """Delete a bank statement record"""
-    statement = db.query(models.BankStatement).filter(models.BankStatement.statement_id == statement_id).first()
+    statement = _locked_statement(db, statement_id)
     if not statement:
+        db.rollback()
         raise ValueError(f"Bank statement {statement_id} not found")
     
+    _apply_bank_flow(db, statement, -1)
     db.delete(statement)
     db.commit()
     return True
 
+RECONCILIATION_STATUSES = ('pending', 'cleared', 'failed')
+
 def get_bank_reconciliation_status(db: Session, date_from: datetime = None, date_to: datetime = None):
     """
-    Get reconciliation status with pending vs cleared transactions
+    Counts and credit/debit sums per reconciliation status from one GROUP BY status, transaction_type.
+    The statements themselves come from get_reconciliation_statements, a page at a time.
     """
-    query = db.query(models.BankStatement)
-    
-    if date_from:
-        query = query.filter(models.BankStatement.transaction_date >= date_from)
-    
-    if date_to:
-        from datetime import timedelta
-        date_to_end = date_to + timedelta(days=1)
-        query = query.filter(models.BankStatement.transaction_date < date_to_end)
-    
-    statements = query.all()
-    
-    pending = [s for s in statements if s.status == 'pending']
-    cleared = [s for s in statements if s.status == 'cleared']
-    failed = [s for s in statements if s.status == 'failed']
-    
-    pending_credits = sum(s.amount for s in pending if s.transaction_type == 'credit')
-    pending_debits = sum(s.amount for s in pending if s.transaction_type == 'debit')
-    cleared_credits = sum(s.amount for s in cleared if s.transaction_type == 'credit')
-    cleared_debits = sum(s.amount for s in cleared if s.transaction_type == 'debit')
+    query = bank_statements_query(db, date_from=date_from, date_to=date_to).order_by(None).with_entities(
+        models.BankStatement.status,
+        models.BankStatement.transaction_type,
+        func.count(models.BankStatement.statement_id),
+        func.coalesce(func.sum(models.BankStatement.amount), 0.0)
+    ).group_by(models.BankStatement.status, models.BankStatement.transaction_type)
+    
+    counts = dict.fromkeys(RECONCILIATION_STATUSES, 0)
+    amounts = {}
+    for status, transaction_type, count, amount in query:
+        if status in counts:
+            counts[status] += count
+        amounts[(status, transaction_type)] = amount
+    
+    pending_credits = amounts.get(('pending', 'credit'), 0.0)
+    pending_debits = amounts.get(('pending', 'debit'), 0.0)
+    cleared_credits = amounts.get(('cleared', 'credit'), 0.0)
+    cleared_debits = amounts.get(('cleared', 'debit'), 0.0)
     
     return {
-        'pending_count': len(pending),
-        'cleared_count': len(cleared),
-        'failed_count': len(failed),
+        'pending_count': counts['pending'],
+        'cleared_count': counts['cleared'],
+        'failed_count': counts['failed'],
         'pending_credits': round(pending_credits, 2),
         'pending_debits': round(pending_debits, 2),
         'cleared_credits': round(cleared_credits, 2),
         'cleared_debits': round(cleared_debits, 2),
-        'total_pending': round(pending_credits - pending_debits, 2),
-        'pending_statements': pending,
-        'cleared_statements': cleared,
-        'failed_statements': failed
+        'total_pending': round(pending_credits - pending_debits, 2)
     }
 
+def get_reconciliation_statements(db: Session, status: str, date_from: datetime = None, date_to: datetime = None,
+                                  limit: int = None, cursor: str = None, direction: str = 'next'):
+    """
+    One keyset page of the statements with a given reconciliation status
+    """
+    if status not in RECONCILIATION_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(RECONCILIATION_STATUSES)}")
+    return get_bank_statement_page(db, status=status, date_from=date_from, date_to=date_to,
+                                   limit=limit, cursor=cursor, direction=direction)
+
 def link_payment_to_bank(db: Session, payment_id: int, payment_type: str, bank_statement_id: int):
     """
     Link a payment record to a bank statement
@@ -1,8 +1,16 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+import logging
 import os
+import time
 from urllib.parse import quote
 
+import portable_config
+
 # Get database path from environment or use default
 db_path = os.environ.get('DB_PATH', './fabric.db')
 
@@ -29,10 +37,137 @@ else:
 
 print(f"DATABASE URL: {SQLALCHEMY_DATABASE_URL}", flush=True)
 
+# ============== CONNECTION PROFILE ==============
+
+def sqlite_pragmas(config=portable_config):
+    """PRAGMA statements for the connection profile configured in portable_config.py"""
+    if not config.SQLITE_TUNING_ENABLED:
+        return []
+    return [
+        f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}",
+        f"PRAGMA cache_size=-{int(config.SQLITE_CACHE_SIZE_KB)}",  # negative = KiB instead of pages
+        f"PRAGMA temp_store={config.SQLITE_TEMP_STORE}",
+        f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}",
+    ]
+
+def apply_sqlite_profile(target_engine, pragmas):
+    """Run the given PRAGMAs on every new DBAPI connection of target_engine"""
+    @event.listens_for(target_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+_profile_problems = portable_config.check_sqlite_settings()
+if _profile_problems:
+    raise ValueError("Invalid SQLite settings in portable_config.py: " + "; ".join(_profile_problems))
+
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+apply_sqlite_profile(engine, sqlite_pragmas())
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+# ============== QUERY ACCOUNTING ==============
+# Counts and times statements executed while a track_queries() block is active in the current context.
+# FastAPI copies the context into its threadpool, so sync routes are counted too. Blocks nest: a
+# statement counts towards every enclosing block.
+
+class QueryStats:
+    def __init__(self, label: str = None, parent=None):
+        self.label = label
+        self.parent = parent
+        self.count = 0
+        self.db_time = 0.0  # seconds
+        self.slowest = None  # (seconds, statement)
+
+    def record(self, elapsed: float, statement: str):
+        stats = self
+        while stats is not None:
+            stats.db_time += elapsed
+            if stats.slowest is None or elapsed > stats.slowest[0]:
+                stats.slowest = (elapsed, statement)
+            stats = stats.parent
+
+_query_stats = ContextVar('query_stats', default=None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    stats = _query_stats.get()
+    while stats is not None:
+        stats.count += 1
+        stats = stats.parent
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _time_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.record(elapsed, statement)
+    if slow_query_ms is not None and elapsed * 1000 >= slow_query_ms:
+        _log_slow_query(cursor, statement, parameters, executemany, elapsed, stats)
+
+@event.listens_for(Engine, "handle_error")
+def _forget_failed_query(exception_context):
+    # after_cursor_execute doesn't run for a failed statement
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+@contextmanager
+def track_queries(label: str = None):
+    """Count and time SQL statements issued inside the block: with track_queries() as stats: ... stats.count"""
+    stats = QueryStats(label, parent=_query_stats.get())
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+# ============== SLOW QUERY LOG ==============
+# Statements taking slow_query_ms or longer are written with their query plan to a rotating log
+# (portable_config.SLOW_QUERY_LOG); None turns the log off.
+
+slow_query_ms = portable_config.SLOW_QUERY_MS if portable_config.QUERY_PROFILING else None
+slow_query_logger = logging.getLogger('fabric.slow_queries')
+slow_query_logger.setLevel(logging.INFO)
+slow_query_logger.propagate = False
+
+def _query_plan(cursor, statement, parameters):
+    """EXPLAIN QUERY PLAN lines for a statement, run on the raw DBAPI connection so it isn't counted itself"""
+    try:
+        rows = cursor.connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    except Exception:
+        return []
+    return [row[-1] for row in rows]
+
+def _log_slow_query(cursor, statement, parameters, executemany, elapsed, stats):
+    lines = [f"{elapsed * 1000:.1f} ms{f' in {stats.label}' if stats is not None and stats.label else ''}",
+             ' '.join(statement.split())]
+    if executemany:
+        lines.append(f"executemany: {len(parameters)} parameter sets")
+    else:
+        lines.append(f"parameters: {repr(parameters)[:500]}")
+        lines += [f"plan: {step}" for step in _query_plan(cursor, statement, parameters)]
+    slow_query_logger.warning('\n    '.join(lines))
+
+_slow_query_log_path = portable_config.get_slow_query_log_path()
+if _slow_query_log_path and slow_query_ms is not None:
+    _slow_query_handler = RotatingFileHandler(
+        _slow_query_log_path,
+        maxBytes=portable_config.SLOW_QUERY_LOG_MAX_KB * 1024,
+        backupCount=portable_config.SLOW_QUERY_LOG_BACKUPS,
+        encoding='utf-8',
+        delay=True,  # no file until the first slow query
+    )
+    _slow_query_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_query_logger.addHandler(_slow_query_handler)
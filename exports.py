@@ -0,0 +1,80 @@
+"""
+Streaming CSV exports
+Rows are read in batches (yield_per) and written out a chunk at a time, with summary
+totals accumulated as the rows go past, so memory stays flat however large the table is
+and the first bytes leave as soon as the first batch is read.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from database import SessionLocal
+
+CHUNK_ROWS = 500
+
+def _drain(buffer: io.StringIO):
+    data = buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate(0)
+    return data
+
+def iter_csv(build_query, header, format_row, totals=None, summary_rows=None, chunk_rows: int = CHUNK_ROWS,
+             session_factory=None):
+    """
+    Yield encoded CSV chunks.
+    build_query(db) returns the query to stream, format_row(row) one CSV row,
+    totals maps a name to row -> number (summed during the stream) and
+    summary_rows(db, totals) the rows written after a blank line at the end.
+    The generator owns its session: the request's session is already closed
+    by the time a streamed body is sent.
+    """
+    totals = totals or {}
+    db = (session_factory or SessionLocal)()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        sums = dict.fromkeys(totals, 0.0)
+        for count, row in enumerate(build_query(db).yield_per(chunk_rows), 1):
+            for name, value in totals.items():
+                sums[name] += value(row) or 0
+            writer.writerow(format_row(row))
+            if count % chunk_rows == 0:
+                yield _drain(buffer)
+        if summary_rows:
+            writer.writerow([])
+            writer.writerows(summary_rows(db, {name: round(total, 2) for name, total in sums.items()}))
+        yield _drain(buffer)
+    finally:
+        db.close()
+
+def gzip_chunks(chunks, level: int = 6):
+    """Compress a byte stream into one gzip member as it is produced"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def accepts_gzip(request: Request):
+    return 'gzip' in request.headers.get('accept-encoding', '').lower()
+
+def csv_response(request: Request, build_query, header, format_row, totals=None, summary_rows=None,
+                 filename: str = None):
+    """StreamingResponse for iter_csv, gzip-encoded when the client accepts it"""
+    body = iter_csv(build_query, header, format_row, totals=totals, summary_rows=summary_rows)
+    headers = {'Vary': 'Accept-Encoding'}
+    if filename:
+        headers['Content-Disposition'] = f'attachment; filename={filename}'
+    if accepts_gzip(request):
+        body = gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(body, media_type='text/csv', headers=headers)
+
+def timestamped(prefix: str):
+    return f'{prefix}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
@@ -0,0 +1,91 @@
+"""
+Bulk purchase and sale imports
+An upload (CSV with a header row, or JSON lines) is decoded, parsed and validated one record at a
+time and fed straight into crud's batched writers, so the file is never held in memory and a month
+of invoices is one request and one commit instead of thousands.
+"""
+import csv
+import io
+import json
+from datetime import timezone
+
+from pydantic import ValidationError
+
+import crud
+import schemas
+
+MAX_REPORTED_ERRORS = 200
+
+# kind -> (row schema, crud bulk writer)
+IMPORTS = {
+    'purchases': (schemas.PurchaseImport, crud.bulk_create_purchases),
+    'sales': (schemas.SaleImport, crud.bulk_create_sales),
+}
+
+def upload_format(filename: str | None, content_type: str | None):
+    name = (filename or '').lower()
+    if name.endswith('.csv') or content_type == 'text/csv':
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')) or content_type in ('application/x-ndjson', 'application/jsonl'):
+        return 'jsonl'
+    raise ValueError("Upload a .csv or .jsonl file")
+
+def _csv_records(text, schema):
+    """(line_number, dict) per CSV row; the header is checked up front"""
+    reader = csv.DictReader(text)
+    header = reader.fieldnames or []
+    missing = [name for name, field in schema.model_fields.items() if field.is_required() and name not in header]
+    if missing:
+        raise ValueError(f"CSV header is missing required columns: {', '.join(missing)}")
+
+    def records():
+        for record in reader:
+            # blank cells fall back to the schema defaults; cells beyond the header (key None) are ignored
+            yield reader.line_num, {k: v for k, v in record.items() if k is not None and v not in (None, '')}
+    return records()
+
+def _jsonl_records(text, errors: list):
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            errors.append((number, f"Invalid JSON: {e.msg}"))
+            continue
+        if not isinstance(record, dict):
+            errors.append((number, "Expected a JSON object"))
+            continue
+        yield number, record
+
+def _validated(records, schema, errors: list):
+    for number, record in records:
+        try:
+            data = schema.model_validate(record).model_dump()
+        except ValidationError as e:
+            errors.append((number, '; '.join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())))
+            continue
+        if data['date'] is not None and data['date'].tzinfo is not None:
+            # stored dates are naive UTC
+            data['date'] = data['date'].astimezone(timezone.utc).replace(tzinfo=None)
+        yield number, data
+
+def import_upload(db, kind: str, upload, filename: str | None, content_type: str | None,
+                  batch_size: int = crud.IMPORT_BATCH_ROWS):
+    """
+    Import purchases or sales from a binary file object.
+    Returns {'imported', 'rejected', 'errors': [{'row', 'error'}, ...]} with errors in row order
+    (capped at MAX_REPORTED_ERRORS); raises ValueError for an unreadable upload.
+    """
+    schema, write = IMPORTS[kind]
+    fmt = upload_format(filename, content_type)
+    text = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+    errors = []
+    records = _csv_records(text, schema) if fmt == 'csv' else _jsonl_records(text, errors)
+    imported = write(db, _validated(records, schema, errors), errors, batch_size=batch_size)
+    errors.sort()
+    return {
+        "imported": imported,
+        "rejected": len(errors),
+        "errors": [{"row": row, "error": message} for row, message in errors[:MAX_REPORTED_ERRORS]],
+    }
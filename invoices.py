@@ -0,0 +1,631 @@
+"""
+Invoice PDFs
+render_invoice() draws one invoice from a plain-dict snapshot (crud.get_invoice_snapshot), and
+InvoiceCache keeps the rendered bytes on disk keyed by sale_id plus a hash of that snapshot, so a
+reprint is a file read and any change to the sale, its customer, company or payments is a new key.
+start_batch() renders many invoices into a ZIP or one merged PDF on a process pool.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from starlette.concurrency import run_in_threadpool
+
+import portable_config
+
+# bump when the layout below changes so previously cached PDFs stop matching
+RENDERER_VERSION = 1
+
+def invoice_key(snapshot: dict):
+    """Cache key and ETag of an invoice: '<sale_id>-<sha1 of the snapshot>'"""
+    payload = json.dumps([RENDERER_VERSION, snapshot], sort_keys=True, default=str)
+    return f"{snapshot['sale']['sale_id']}-{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+def invoice_filename(snapshot: dict):
+    return f"Invoice_{snapshot['sale']['sale_id']:06d}_{snapshot['customer']['name'].replace(' ', '_')}.pdf"
+
+def _draw_invoice(c, snapshot: dict):
+    """Draw one invoice on the current page of canvas c"""
+    sale, customer, company = snapshot['sale'], snapshot['customer'], snapshot['company']
+    width, height = A4
+    
+    # Professional color scheme
+    primary_blue = colors.HexColor('#1e3a8a')     # Deep navy blue
+    accent_blue = colors.HexColor('#3b82f6')      # Medium blue
+    light_blue = colors.HexColor('#eff6ff')       # Very light blue
+    success_green = colors.HexColor('#059669')    # Success green
+    text_dark = colors.HexColor('#1f2937')        # Dark gray text
+    text_medium = colors.HexColor('#6b7280')      # Medium gray text
+    text_light = colors.HexColor('#9ca3af')       # Light gray text
+    
+    y_pos = height - 30
+    
+    # Top header with gradient effect (simulated with rectangles)
+    c.setFillColor(primary_blue)
+    c.rect(0, height-100, width, 100, fill=1, stroke=0)
+    
+    # Add subtle shadow effect
+    c.setFillColor(colors.HexColor('#1e40af'))
+    c.rect(0, height-105, width, 5, fill=1, stroke=0)
+    
+    # Company Header
+    if company:
+        c.setFont('Helvetica-Bold', 26)
+        c.setFillColor(colors.white)
+        c.drawCentredString(width/2, y_pos-35, company['company_name'].upper())
+        
+        # Company tagline or business type
+        c.setFont('Helvetica-Oblique', 12)
+        c.setFillColor(colors.HexColor('#bfdbfe'))
+        c.drawCentredString(width/2, y_pos-55, "Professional Business Solutions")
+        
+        # Company details in elegant layout
+        c.setFont('Helvetica', 10)
+        c.setFillColor(colors.white)
+        
+        details_y = y_pos - 75
+        if company['address']:
+            c.drawString(60, details_y, f"📍 {company['address']}")
+        if company['phone']:
+            c.drawRightString(width-60, details_y, f"📞 {company['phone']}")
+        
+        details_y -= 15
+        if company['email']:
+            c.drawString(60, details_y, f"✉️ {company['email']}")
+        if company['website']:
+            c.drawRightString(width-60, details_y, f"🌐 {company['website']}")
+            
+        if company['tax_number']:
+            details_y -= 15
+            c.drawCentredString(width/2, details_y, f"Tax Registration: {company['tax_number']}")
+    else:
+        c.setFont('Helvetica-Bold', 26)
+        c.setFillColor(colors.white)
+        c.drawCentredString(width/2, y_pos-35, "PROFESSIONAL INVOICE")
+        
+        c.setFont('Helvetica-Oblique', 12)
+        c.setFillColor(colors.HexColor('#bfdbfe'))
+        c.drawCentredString(width/2, y_pos-55, "Quality Business Solutions")
+    
+    # Reset position after header
+    y_pos = height - 130
+    
+    # INVOICE banner with modern design
+    c.setFillColor(accent_blue)
+    c.rect(40, y_pos-35, width-80, 35, fill=1, stroke=0)
+    
+    # Add subtle border
+    c.setStrokeColor(primary_blue)
+    c.setLineWidth(2)
+    c.rect(40, y_pos-35, width-80, 35, fill=0, stroke=1)
+    
+    c.setFont('Helvetica-Bold', 18)
+    c.setFillColor(colors.white)
+    c.drawCentredString(width/2, y_pos-22, "I N V O I C E")
+    
+    y_pos -= 60
+    
+    # Main content area with subtle background
+    content_height = y_pos - 180
+    c.setFillColor(colors.HexColor('#fafafa'))
+    c.rect(40, 180, width-80, content_height, fill=1, stroke=0)
+    
+    # Invoice details card
+    card_width = 220
+    card_height = 85
+    
+    # Left card - Invoice details
+    c.setFillColor(light_blue)
+    c.setStrokeColor(accent_blue)
+    c.setLineWidth(1)
+    c.rect(60, y_pos-card_height, card_width, card_height, fill=1, stroke=1)
+    
+    c.setFont('Helvetica-Bold', 11)
+    c.setFillColor(primary_blue)
+    c.drawString(75, y_pos-20, "INVOICE DETAILS")
+    
+    c.setFont('Helvetica', 10)
+    c.setFillColor(text_dark)
+    c.drawString(75, y_pos-35, f"Invoice #: #{sale['sale_id']:06d}")
+    c.drawString(75, y_pos-50, f"Date: {sale['date'].strftime('%B %d, %Y')}")
+    c.drawString(75, y_pos-65, f"Time: {sale['date'].strftime('%I:%M %p')}")
+    
+    # Right card - Bill To
+    c.setFillColor(light_blue)
+    c.rect(width-280, y_pos-card_height, card_width, card_height, fill=1, stroke=1)
+    
+    c.setFont('Helvetica-Bold', 11)
+    c.setFillColor(primary_blue)
+    c.drawString(width-265, y_pos-20, "BILL TO")
+    
+    c.setFont('Helvetica-Bold', 11)
+    c.setFillColor(text_dark)
+    c.drawString(width-265, y_pos-38, customer['name'])
+    
+    c.setFont('Helvetica', 9)
+    c.setFillColor(text_medium)
+    c.drawString(width-265, y_pos-52, f"Contact: {customer['contact'] or 'N/A'}")
+    c.drawString(width-265, y_pos-65, f"Customer ID: {customer['customer_id']}")
+    
+    y_pos -= 110
+    
+    # Items section with modern table design
+    table_y = y_pos
+    table_width = width - 120
+    header_height = 35
+    row_height = 45
+    
+    # Table header with gradient
+    c.setFillColor(primary_blue)
+    c.rect(60, table_y-header_height, table_width, header_height, fill=1, stroke=0)
+    
+    # Header shadow
+    c.setFillColor(colors.HexColor('#1e40af'))
+    c.rect(60, table_y-header_height-2, table_width, 2, fill=1, stroke=0)
+    
+    c.setFont('Helvetica-Bold', 11)
+    c.setFillColor(colors.white)
+    c.drawCentredString(160, table_y-22, "ITEM DESCRIPTION")
+    c.drawCentredString(320, table_y-22, "QTY")
+    c.drawCentredString(420, table_y-22, "RATE")
+    c.drawCentredString(500, table_y-22, "AMOUNT")
+    
+    # Table row with alternating background
+    row_y = table_y - header_height
+    c.setFillColor(colors.white)
+    c.setStrokeColor(colors.HexColor('#e5e7eb'))
+    c.setLineWidth(0.5)
+    c.rect(60, row_y-row_height, table_width, row_height, fill=1, stroke=1)
+    
+    # Item details with better formatting
+    c.setFont('Helvetica-Bold', 11)
+    c.setFillColor(text_dark)
+    item_y = row_y - 15
+    c.drawString(70, item_y, sale['fabric_type'])
+    
+    c.setFont('Helvetica', 9)
+    c.setFillColor(text_medium)
+    if sale['fabric_code']:
+        c.drawString(70, item_y-12, f"Code: {sale['fabric_code']}")
+    if sale['composition']:
+        c.drawString(70, item_y-24, f"Material: {sale['composition']}")
+    
+    # Quantity, Rate, Amount
+    c.setFont('Helvetica', 10)
+    c.setFillColor(text_dark)
+    c.drawCentredString(320, row_y-20, f"{sale['quantity_meters']}")
+    c.setFont('Helvetica', 8)
+    c.setFillColor(text_medium)
+    c.drawCentredString(320, row_y-32, "meters")
+    
+    c.setFont('Helvetica', 10)
+    c.setFillColor(text_dark)
+    c.drawCentredString(420, row_y-25, f"Rs. {sale['price_per_meter']:.2f}")
+    
+    subtotal = sale['quantity_meters'] * sale['price_per_meter']
+    c.setFont('Helvetica-Bold', 12)
+    c.setFillColor(success_green)
+    c.drawCentredString(500, row_y-25, f"Rs. {subtotal:.2f}")
+    
+    y_pos = row_y - row_height - 30
+    
+    # Summary section with cards
+    summary_width = 280
+    summary_x = width - summary_width - 60
+    
+    # Summary background
+    c.setFillColor(colors.HexColor('#f9fafb'))
+    c.setStrokeColor(colors.HexColor('#e5e7eb'))
+    c.rect(summary_x, y_pos-90, summary_width, 90, fill=1, stroke=1)
+    
+    # Summary items
+    c.setFont('Helvetica', 11)
+    c.setFillColor(text_dark)
+    
+    summary_y = y_pos - 20
+    c.drawString(summary_x + 20, summary_y, "Subtotal:")
+    c.drawRightString(summary_x + summary_width - 20, summary_y, f"Rs. {subtotal:.2f}")
+    
+    summary_y -= 20
+    if sale['apply_tax']:
+        # Calculate the tax percentage from the tax amount
+        tax_percentage = (sale['tax'] / subtotal) * 100
+        c.drawString(summary_x + 20, summary_y, f"Tax ({tax_percentage:.0f}%):")
+        c.drawRightString(summary_x + summary_width - 20, summary_y, f"Rs. {sale['tax']:.2f}")
+    else:
+        c.setFillColor(text_medium)
+        c.drawString(summary_x + 20, summary_y, "Tax:")
+        c.drawRightString(summary_x + summary_width - 20, summary_y, "Not Applied")
+    
+    # Total section with highlight
+    summary_y -= 30
+    c.setFillColor(success_green)
+    c.rect(summary_x + 10, summary_y-5, summary_width-20, 25, fill=1, stroke=0)
+    
+    c.setFont('Helvetica-Bold', 12)
+    c.setFillColor(colors.white)
+    c.drawString(summary_x + 20, summary_y+5, "TOTAL:")
+    c.drawRightString(summary_x + summary_width - 20, summary_y+5, f"Rs. {sale['total_price_with_tax']:.2f}")
+    
+    y_pos -= 120
+    
+    # Footer section with modern styling
+    footer_height = 70
+    c.setFillColor(primary_blue)
+    c.rect(40, y_pos-footer_height, width-80, footer_height, fill=1, stroke=0)
+    
+    # Footer content
+    c.setFont('Helvetica-Bold', 14)
+    c.setFillColor(colors.white)
+    c.drawCentredString(width/2, y_pos-25, "Thank you for your business!")
+    
+    c.setFont('Helvetica', 10)
+    c.setFillColor(colors.HexColor('#bfdbfe'))
+    c.drawCentredString(width/2, y_pos-40, "For support & inquiries: WhatsApp 03362793950")
+    
+    c.setFont('Helvetica-Oblique', 8)
+    c.setFillColor(colors.HexColor('#93c5fd'))
+    c.drawCentredString(width/2, y_pos-55, f"Generated on {sale['date'].strftime('%B %d, %Y at %I:%M %p')} • Secure Digital Invoice")
+    
+    # Bottom branding strip
+    c.setFillColor(colors.HexColor('#f8fafc'))
+    c.rect(0, 0, width, 35, fill=1, stroke=0)
+    
+    c.setFont('Helvetica-Bold', 9)
+    c.setFillColor(primary_blue)
+    c.drawCentredString(width/2, 20, "Powered by TzkSolution")
+    
+    c.setFont('Helvetica', 8)
+    c.setFillColor(text_medium)
+    c.drawCentredString(width/2, 10, "Professional Invoice Management System • WhatsApp: 03362793950")
+
+def render_invoices(snapshots: list, path: str = None):
+    """
+    One page per invoice snapshot: PDF bytes, or written to path (returning None) so a large document
+    never travels back through the caller's memory
+    """
+    buffer = io.BytesIO()
+    # invariant: identical input gives identical bytes (no timestamps or random document id);
+    # compressing page streams keeps the pages reportlab holds until save() small
+    c = canvas.Canvas(path or buffer, pagesize=A4, invariant=1, pageCompression=1 if path else None)
+    for snapshot in snapshots:
+        _draw_invoice(c, snapshot)
+        c.showPage()
+    c.save()
+    return None if path else buffer.getvalue()
+
+def render_invoice(snapshot: dict):
+    """PDF bytes for one invoice snapshot"""
+    return render_invoices([snapshot])
+
+
+class InvoiceCache:
+    """
+    Rendered invoices as <key>.pdf files in one directory, evicted least recently used once their
+    total size passes max_bytes. File mtimes carry the LRU order across restarts.
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = None  # key -> size, least recently used first; read from disk on first use
+        self._total = 0
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, f'{key}.pdf')
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = sorted((entry.stat().st_mtime, entry.name[:-4], entry.stat().st_size)
+                       for entry in os.scandir(self.directory) if entry.name.endswith('.pdf'))
+        self._entries = OrderedDict((key, size) for _, key, size in files)
+        self._total = sum(self._entries.values())
+
+    def _discard(self, key: str):
+        self._total -= self._entries.pop(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str):
+        """Cached PDF bytes, or None"""
+        with self._lock:
+            self._load()
+            if key in self._entries:
+                try:
+                    with open(self._path(key), 'rb') as f:
+                        data = f.read()
+                    os.utime(self._path(key))
+                except FileNotFoundError:
+                    self._discard(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+            self.misses += 1
+            return None
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._load()
+            # a new version of an invoice makes the older ones unreachable
+            sale_prefix = key.split('-', 1)[0] + '-'
+            for stale in [k for k in self._entries if k.startswith(sale_prefix) and k != key]:
+                self._discard(stale)
+            tmp_path = self._path(key) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            if key in self._entries:
+                self._total -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total += len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                self._discard(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._load()
+            for key in list(self._entries):
+                self._discard(key)
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {"entries": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+invoice_cache = InvoiceCache(portable_config.get_invoice_cache_dir(), portable_config.INVOICE_CACHE_MAX_MB * 1024 * 1024)
+
+
+# Render executors
+# reportlab is pure Python, so rendering in a thread would hold the GIL against every other request.
+# Renders run in worker processes instead, behind a bounded queue: at most max_queued renders may be
+# waiting or running, so a burst of printing queues up (or is refused) rather than piling onto the server.
+class RenderQueueFull(Exception):
+    pass
+
+def _timed_call(fn, *args):
+    # runs in the worker process; wall-clock times are comparable with the parent's on the same machine
+    started = time.time()
+    value = fn(*args)
+    return value, started, time.time()
+
+def _summary(samples):
+    if not samples:
+        return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    return {"avg": round(sum(ordered) / len(ordered), 2), "p95": round(ordered[int(len(ordered) * 0.95) - 1 if len(ordered) >= 20 else -1], 2),
+            "max": round(ordered[-1], 2)}
+
+class RenderExecutor:
+    """Process pool with a bounded queue plus queue-wait and render-time metrics (recent samples, in ms)"""
+    SAMPLES = 500
+
+    def __init__(self, workers: int | None, max_queued: int):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_flight = 0  # submitted and not yet finished
+        self._slots = threading.BoundedSemaphore(max_queued)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._queue_wait_ms = deque(maxlen=self.SAMPLES)
+        self._render_ms = deque(maxlen=self.SAMPLES)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn, not Linux's default fork: forking a threaded server can copy a lock some other
+                # thread holds into the child, which then deadlocks on it
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def submit(self, fn, *args, block: bool = False):
+        """
+        Run fn(*args) in a worker process; returns a Future of its result.
+        When max_queued renders are already pending, waits for a slot if block, else raises RenderQueueFull.
+        """
+        if not self._slots.acquire(blocking=block):
+            with self._lock:
+                self.rejected += 1
+            raise RenderQueueFull(f"{self.max_queued} renders already queued")
+        with self._lock:
+            self.in_flight += 1
+        submitted = time.time()
+        result = Future()
+
+        def finished_one():
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+        def done(inner):
+            finished_one()
+            try:
+                value, started, finished = inner.result()
+            except BaseException as e:
+                with self._lock:
+                    self.failed += 1
+                result.set_exception(e)
+                return
+            with self._lock:
+                self.completed += 1
+                self._queue_wait_ms.append(max(0.0, started - submitted) * 1000)
+                self._render_ms.append((finished - started) * 1000)
+            result.set_result(value)
+
+        try:
+            self._executor().submit(_timed_call, fn, *args).add_done_callback(done)
+        except BaseException:
+            finished_one()
+            raise
+        return result
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "queue_wait_ms": _summary(self._queue_wait_ms),
+                "render_ms": _summary(self._render_ms),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+# single invoices requested from the browser; batches get their own pool so they can't starve these
+render_executor = RenderExecutor(portable_config.INVOICE_RENDER_WORKERS, portable_config.INVOICE_RENDER_QUEUE)
+batch_executor = RenderExecutor(portable_config.INVOICE_RENDER_PROCESSES, (portable_config.INVOICE_RENDER_PROCESSES or os.cpu_count() or 1) * 4)
+
+async def get_invoice_pdf(snapshot: dict, cache: InvoiceCache = None, executor: RenderExecutor = None):
+    """
+    PDF bytes for a snapshot, rendered on the executor only when the cache has no copy of this exact
+    version. Raises RenderQueueFull when the executor's queue is full.
+    """
+    cache = cache or invoice_cache
+    key = invoice_key(snapshot)
+    # the cache reads, writes and evicts files under a lock: keep all of that off the event loop
+    pdf = await run_in_threadpool(cache.get, key)
+    if pdf is None:
+        pdf = await asyncio.wrap_future((executor or render_executor).submit(render_invoice, snapshot))
+        await run_in_threadpool(cache.put, key, pdf)
+    return pdf
+
+
+# Batch rendering
+# A batch renders many invoices in a background thread that feeds batch_executor (blocking for a queue
+# slot, so at most its max_queued renders are outstanding); progress is polled and the finished file is
+# downloaded once.
+MAX_BATCH_INVOICES = 5000
+BATCH_RESULT_TTL = 3600  # seconds a finished batch stays downloadable
+BATCH_FORMATS = {'zip': 'application/zip', 'pdf': 'application/pdf'}
+
+_batches = {}
+_batches_lock = threading.Lock()
+
+class InvoiceBatch:
+    def __init__(self, fmt: str, total: int):
+        self.batch_id = uuid.uuid4().hex
+        self.format = fmt
+        self.total = total
+        self.done = 0
+        self.status = 'queued'  # queued -> rendering -> done | failed
+        self.error = None
+        self.path = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {"batch_id": self.batch_id, "format": self.format, "status": self.status, "total": self.total,
+                "done": self.done, "error": self.error}
+
+def _write_zip(batch: InvoiceBatch, snapshots: list, path: str, cache: InvoiceCache, executor):
+    # at most executor.max_queued renders are outstanding, and each PDF goes into the archive (and is
+    # released) as soon as it arrives, so memory doesn't grow with the size of the batch
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        pending = {}
+
+        def collect(return_when):
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                snapshot, key = pending.pop(future)
+                pdf = future.result()
+                cache.put(key, pdf)
+                archive.writestr(invoice_filename(snapshot), pdf)
+                batch.done += 1
+
+        for snapshot in snapshots:
+            key = invoice_key(snapshot)
+            pdf = cache.get(key)
+            if pdf is not None:
+                archive.writestr(invoice_filename(snapshot), pdf)
+                batch.done += 1
+                continue
+            if len(pending) >= executor.max_queued:
+                collect(FIRST_COMPLETED)
+            pending[executor.submit(render_invoice, snapshot, block=True)] = (snapshot, key)
+        if pending:
+            collect(ALL_COMPLETED)
+
+def _write_merged(batch: InvoiceBatch, snapshots: list, path: str, executor):
+    # reportlab can't append existing PDFs and there is no merge library in requirements, so one worker
+    # draws the whole document; it writes the file itself rather than sending the bytes back
+    executor.submit(render_invoices, snapshots, path, block=True).result()
+    batch.done = batch.total
+
+def _run_batch(batch: InvoiceBatch, snapshots: list, cache: InvoiceCache, executor):
+    fd, path = tempfile.mkstemp(prefix='invoices_', suffix=f'.{batch.format}')
+    os.close(fd)
+    batch.status = 'rendering'
+    try:
+        if batch.format == 'zip':
+            _write_zip(batch, snapshots, path, cache, executor)
+        else:
+            _write_merged(batch, snapshots, path, executor)
+    except Exception as e:
+        os.remove(path)
+        batch.error = str(e)
+        batch.status = 'failed'
+        print(f"⚠ Invoice batch {batch.batch_id} failed: {e}")
+    else:
+        batch.path = path
+        batch.status = 'done'
+    batch.finished_at = time.time()
+
+def _expire_batches():
+    cutoff = time.time() - BATCH_RESULT_TTL
+    with _batches_lock:
+        for batch_id in [b.batch_id for b in _batches.values() if b.finished_at and b.finished_at < cutoff]:
+            batch = _batches.pop(batch_id)
+            if batch.path and os.path.exists(batch.path):
+                os.remove(batch.path)
+
+def start_batch(snapshots: list, fmt: str = 'zip', cache: InvoiceCache = None, executor=None):
+    """Render snapshots into one ZIP of PDFs or one merged PDF in the background; returns the InvoiceBatch.
+
+    ZIP batches render one invoice per task across the executor and count progress per invoice. A merged
+    PDF is drawn by a single worker, so it doesn't run in parallel and its progress goes from 0 to the
+    total in one step.
+    """
+    if fmt not in BATCH_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(BATCH_FORMATS)}")
+    _expire_batches()
+    batch = InvoiceBatch(fmt, len(snapshots))
+    with _batches_lock:
+        _batches[batch.batch_id] = batch
+    threading.Thread(target=_run_batch, args=(batch, snapshots, cache or invoice_cache, executor or batch_executor),
+                     daemon=True).start()
+    return batch
+
+def get_batch(batch_id: str):
+    with _batches_lock:
+        return _batches.get(batch_id)
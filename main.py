@@ -1,31 +1,91 @@
 from fastapi import FastAPI, Request, Form, Depends, HTTPException, File, UploadFile, BackgroundTasks
-from fastapi.responses import HTMLResponse, StreamingResponse, Response, FileResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, FileResponse, RedirectResponse, JSONResponse
 from pydantic import BaseModel
 import schemas
 import shutil
+import sqlite3
+import hashlib
 import os
 from pathlib import Path
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 import io
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.colors import HexColor, black, white
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
+import time
 from datetime import datetime
+from urllib.parse import urlencode
 
-import database, models, crud
+import database, models, crud, migrations, exports, imports, invoices, backups, changelog, query_cache
+import portable_config
 from database import SessionLocal, engine
 
-models.Base.metadata.create_all(bind=engine)
+def prepare_database(bind):
+    """Bring a database up to the current schema; run at startup and after a database import"""
+    models.Base.metadata.create_all(bind=bind)
+    migrations.run_all(bind)
+
+    # Populate materialized stock positions for databases created before the table existed
+    db = SessionLocal(bind=bind)
+    try:
+        crud.ensure_stock_positions(db)
+        crud.ensure_bank_checkpoints(db)
+    finally:
+        db.close()
+    prune_change_log(bind)
+
+def prune_change_log(bind):
+    """Drop change log entries past the retention period; runs at startup and after each scheduled backup"""
+    db = SessionLocal(bind=bind)
+    try:
+        changelog.prune_changes(db, portable_config.CHANGE_LOG_RETENTION_DAYS)
+    finally:
+        db.close()
+
+prepare_database(engine)
+
+backup_scheduler = backups.BackupScheduler(
+    engine,
+    portable_config.get_backup_dir(),
+    interval=portable_config.BACKUP_INTERVAL_HOURS * 3600,
+    history=portable_config.BACKUP_HISTORY,
+    pause=portable_config.BACKUP_THROTTLE_MS / 1000,
+    on_startup=portable_config.AUTO_BACKUP_ON_STARTUP,
+    after_backup=prune_change_log,
+)
 
 app = FastAPI()
 
+def server_timing(stats: database.QueryStats, total: float):
+    """Server-Timing header value: request total, DB time and query count, slowest statement"""
+    timings = [f"total;dur={total * 1000:.1f}", f'db;dur={stats.db_time * 1000:.1f};desc="{stats.count} queries"']
+    if stats.slowest:
+        statement = ' '.join(stats.slowest[1].split())[:80].replace('\\', '').replace('"', "'")
+        timings.append(f'slowest;dur={stats.slowest[0] * 1000:.1f};desc="{statement}"')
+    return ', '.join(timings)
+
+@app.middleware('http')
+async def profile_queries(request: Request, call_next):
+    if not portable_config.QUERY_PROFILING:
+        return await call_next(request)
+    started = time.perf_counter()
+    # statements run while a streamed body is sent come after the headers and aren't included
+    with database.track_queries(f"{request.method} {request.url.path}") as stats:
+        response = await call_next(request)
+    response.headers['Server-Timing'] = server_timing(stats, time.perf_counter() - started)
+    return response
+
+@app.on_event('startup')
+def start_backup_scheduler():
+    backup_scheduler.start()
+
+@app.on_event('shutdown')
+def stop_background_work():
+    backup_scheduler.stop()
+    invoices.render_executor.shutdown()
+    invoices.batch_executor.shutdown()
+
 # Resolve templates directory for both portable and development environments
 def get_templates_dir():
     """Get templates directory path, handling PyInstaller environment"""
@@ -46,10 +106,32 @@ def get_templates_dir():
 
 templates = Jinja2Templates(directory=get_templates_dir())
 app.mount("/static", StaticFiles(directory="static", html=True), name="static")
-import time
 # provide a callable to templates for cache-busting
 templates.env.globals['now'] = lambda: int(time.time())
 
+def page_url(request: Request, **params):
+    """Current URL with some query parameters replaced (None drops a parameter)"""
+    query = dict(request.query_params)
+    query.update(params)
+    return f"{request.url.path}?{urlencode({k: v for k, v in query.items() if v not in (None, '')})}"
+
+templates.env.globals['page_url'] = page_url
+
+def _page_args(request: Request):
+    """limit/cursor/direction query parameters shared by the keyset-paginated listings"""
+    limit = request.query_params.get('limit')
+    cursor = request.query_params.get('cursor') or None
+    try:
+        if cursor:
+            crud.decode_cursor(cursor)
+        return {
+            'limit': int(limit) if limit else None,
+            'cursor': cursor,
+            'direction': request.query_params.get('direction', 'next'),
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # dependency
 def get_db():
     db = SessionLocal()
@@ -188,12 +270,16 @@ async def add_purchase_post(
     return templates.TemplateResponse('add_purchase.html', {"request": request, "message": f"Purchase recorded (id={p.purchase_id}).", "suppliers": suppliers})
 
 # Sale
-@app.get('/add_sale', response_class=HTMLResponse)
-def add_sale_get(request: Request, db: Session = Depends(get_db)):
+def _render_add_sale(request: Request, db: Session, **context):
     companies = crud.get_companies(db)
     customers = db.query(models.Customer).all()
+    # one indexed read of the incrementally maintained stock positions
     fabrics = crud.get_available_fabrics(db)
-    return templates.TemplateResponse('add_sale.html', {"request": request, "companies": companies, "customers": customers, "fabrics": fabrics})
+    return templates.TemplateResponse('add_sale.html', {"request": request, "companies": companies, "customers": customers, "fabrics": fabrics, **context})
+
+@app.get('/add_sale', response_class=HTMLResponse)
+def add_sale_get(request: Request, db: Session = Depends(get_db)):
+    return _render_add_sale(request, db)
 
 
 @app.post('/supplier/delete')
@@ -236,7 +322,8 @@ async def add_sale_post(
     request: Request,
     company_id: int = Form(...),
     customer_id: int = Form(...),
-    fabric_type: str = Form(...),
+    fabric_id: int | None = Form(None),
+    fabric_type: str | None = Form(None),
     quantity_meters: float = Form(...),
     price_per_meter: float = Form(...),
     fabric_code: str | None = Form(None),
@@ -248,53 +335,33 @@ async def add_sale_post(
     amount_paid: float = Form(None),
     db: Session = Depends(get_db),
 ):
-    # If fabric_type field contains encoded value from select (type||code||composition), parse it
-    if '||' in fabric_type:
-        parts = fabric_type.split('||')
-        fabric_type = parts[0]
-        fabric_code = parts[1] if len(parts) > 1 and parts[1] != '' else None
-        composition = parts[2] if len(parts) > 2 and parts[2] != '' else None
-
-    # Basic stock check (respect fabric_code when present)
-    stock = crud.get_stock_summary(db)
-    bal = 0
-    for s in stock:
-        if s['fabric_type'] == fabric_type and (fabric_code is None or s['fabric_code'] == fabric_code):
-            bal = s['balance_in_meters']
-    if quantity_meters > bal:
-        raise HTTPException(status_code=400, detail=f"Insufficient stock for {fabric_type}. Available: {bal}")
-    try:
-        # Convert tax_rate from percentage to decimal
-        tax_rate_decimal = tax_rate / 100 if apply_tax else 0
-        s = crud.create_sale(db, company_id=company_id, customer_id=customer_id, fabric_type=fabric_type, 
-                            quantity_meters=quantity_meters, price_per_meter=price_per_meter, 
-                            fabric_code=fabric_code, composition=composition, apply_tax=apply_tax, 
-                            tax_rate=tax_rate_decimal, payment_method=payment_method, 
-                            payment_status=payment_status, amount_paid=amount_paid)
-    except ValueError as e:
-        companies = crud.get_companies(db)
-        customers = db.query(models.Customer).all()
-        fabrics = crud.get_available_fabrics(db)
-        return templates.TemplateResponse('add_sale.html', {"request": request, "error": str(e), "companies": companies, "customers": customers, "fabrics": fabrics})
-    if fabric_code or composition:
-        s.fabric_code = fabric_code
-        s.composition = composition
-        db.add(s); db.commit(); db.refresh(s)
-    companies = crud.get_companies(db)
-    customers = db.query(models.Customer).all()
-    fabrics = crud.get_available_fabrics(db)
-    return templates.TemplateResponse('add_sale.html', {"request": request, "message": f"Sale recorded (id={s.sale_id}). Payment status: {s.payment_status}", "companies": companies, "customers": customers, "fabrics": fabrics})
+    with database.track_queries() as query_stats:
+        try:
+            # Convert tax_rate from percentage to decimal
+            tax_rate_decimal = tax_rate / 100 if apply_tax else 0
+            # create_sale checks availability with a single keyed stock_positions lookup
+            s = crud.create_sale(db, company_id=company_id, customer_id=customer_id, fabric_type=fabric_type, 
+                                quantity_meters=quantity_meters, price_per_meter=price_per_meter, 
+                                fabric_code=fabric_code, composition=composition, apply_tax=apply_tax, 
+                                tax_rate=tax_rate_decimal, payment_method=payment_method, 
+                                payment_status=payment_status, amount_paid=amount_paid, fabric_id=fabric_id)
+        except ValueError as e:
+            response = _render_add_sale(request, db, error=str(e))
+        else:
+            response = _render_add_sale(request, db, message=f"Sale recorded (id={s.sale_id}). Payment status: {s.payment_status}")
+    response.headers['X-Query-Count'] = str(query_stats.count)
+    return response
 
 # Listings / reports
 @app.get('/purchases', response_class=HTMLResponse)
 def purchases_list(request: Request, db: Session = Depends(get_db)):
-    purchases = db.query(models.Purchase).order_by(models.Purchase.date.desc()).all()
-    return templates.TemplateResponse('purchases.html', {"request": request, "purchases": purchases})
+    page = crud.get_purchases(db, **_page_args(request))
+    return templates.TemplateResponse('purchases.html', {"request": request, "purchases": page['rows'], "page": page})
 
 @app.get('/sales', response_class=HTMLResponse)
 def sales_list(request: Request, db: Session = Depends(get_db)):
-    sales = db.query(models.Sale).order_by(models.Sale.date.desc()).all()
-    return templates.TemplateResponse('sales.html', {"request": request, "sales": sales})
+    page = crud.get_sales(db, **_page_args(request))
+    return templates.TemplateResponse('sales.html', {"request": request, "sales": page['rows'], "page": page})
 
 @app.get('/stock', response_class=HTMLResponse)
 def stock_summary(request: Request, db: Session = Depends(get_db)):
@@ -305,23 +372,20 @@ def stock_summary(request: Request, db: Session = Depends(get_db)):
 
 @app.get('/fabrics', response_class=HTMLResponse)
 def fabrics_list(request: Request, db: Session = Depends(get_db)):
-    fabrics = []
-    # gather distinct fabric_type/code/composition
-    rows = db.query(models.Purchase.fabric_type, models.Purchase.fabric_code, models.Purchase.composition).distinct().all()
-    for r in rows:
-        fabrics.append({"fabric_type": r[0], "fabric_code": r[1], "composition": r[2]})
+    fabrics = crud.get_fabrics(db)
     return templates.TemplateResponse('fabrics.html', {"request": request, "fabrics": fabrics})
 
 
 @app.get('/api/fabrics')
-def api_fabrics(q: str | None = None, db: Session = Depends(get_db)):
-    rows = db.query(models.Purchase.fabric_type, models.Purchase.fabric_code, models.Purchase.composition).distinct()
-    out = []
-    for r in rows:
-        text = (str(r[0] or '') + ' ' + str(r[1] or '') + ' ' + str(r[2] or '')).lower()
-        if not q or q.lower() in text:
-            out.append({"fabric_type": r[0], "fabric_code": r[1], "composition": r[2]})
-    return out
+def api_fabrics(request: Request, q: str | None = None, limit: int | None = None, db: Session = Depends(get_db)):
+    # The answer only changes when a new fabric appears, so browsers may reuse it briefly and
+    # then revalidate with If-None-Match instead of re-running the search.
+    version = crud.get_fabric_catalog_version(db)
+    etag = '"' + hashlib.sha1(f"{version}|{(q or '').strip().lower()}|{limit}".encode()).hexdigest()[:20] + '"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, max-age=60'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(crud.search_fabrics(db, q=q, limit=limit), headers=headers)
 
 
 @app.get('/profit', response_class=HTMLResponse)
@@ -359,12 +423,14 @@ def purchase_ledger(request: Request, db: Session = Depends(get_db)):
         fabric_code=fabric_code if fabric_code else None,
         date_from=date_from_obj,
         date_to=date_to_obj,
-        search_query=search_query if search_query else None
+        search_query=search_query if search_query else None,
+        **_page_args(request)
     )
     
     return templates.TemplateResponse('ledger_purchases.html', {
         "request": request, 
         "ledger": ledger_data,
+        "page": ledger_data['page'],
         "suppliers": suppliers,
         "companies": companies,
         "filters": {
@@ -418,12 +484,14 @@ def sale_ledger(request: Request, db: Session = Depends(get_db)):
         date_from=date_from_obj,
         date_to=date_to_obj,
         search_query=search_query if search_query else None,
-        apply_tax_filter=tax_filter
+        apply_tax_filter=tax_filter,
+        **_page_args(request)
     )
     
     return templates.TemplateResponse('ledger_sales.html', {
         "request": request,
         "ledger": ledger_data,
+        "page": ledger_data['page'],
         "customers": customers,
         "companies": companies,
         "filters": {
@@ -479,57 +547,55 @@ def supplier_ledger_summary(request: Request, db: Session = Depends(get_db)):
 # Export ledger routes
 @app.get('/export/ledger/purchases.csv')
 def export_purchase_ledger(
+    request: Request,
     supplier_id: int = None,
     fabric_type: str = None,
     fabric_code: str = None,
     date_from: str = None,
     date_to: str = None,
-    search: str = None,
-    db: Session = Depends(get_db)
+    search: str = None
 ):
-    import csv, io
-    from datetime import datetime
-    
     date_from_obj = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
     date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
     
-    ledger_data = crud.get_purchase_ledger(
-        db,
-        supplier_id=supplier_id,
-        fabric_type=fabric_type,
-        fabric_code=fabric_code,
-        date_from=date_from_obj,
-        date_to=date_to_obj,
-        search_query=search
-    )
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Purchase ID', 'Date', 'Supplier', 'Fabric Type', 'Fabric Code', 'Composition', 'Quantity (m)', 'Price/Meter', 'Total Cost'])
+    def build_query(db):
+        return crud.purchase_ledger_query(
+            db,
+            supplier_id=supplier_id,
+            fabric_type=fabric_type,
+            fabric_code=fabric_code,
+            date_from=date_from_obj,
+            date_to=date_to_obj,
+            search_query=search
+        ).with_entities(
+            models.Purchase.purchase_id, models.Purchase.date, models.Supplier.name.label('supplier'),
+            models.Purchase.fabric_type, models.Purchase.fabric_code, models.Purchase.composition,
+            models.Purchase.quantity_meters, models.Purchase.price_per_meter, models.Purchase.total_cost
+        )
     
-    for p in ledger_data['purchases']:
-        writer.writerow([
+    return exports.csv_response(
+        request,
+        build_query,
+        ['Purchase ID', 'Date', 'Supplier', 'Fabric Type', 'Fabric Code', 'Composition', 'Quantity (m)', 'Price/Meter', 'Total Cost'],
+        lambda p: [
             p.purchase_id,
             p.date.strftime('%Y-%m-%d %H:%M'),
-            p.supplier.name,
+            p.supplier,
             p.fabric_type,
             p.fabric_code or '',
             p.composition or '',
             p.quantity_meters,
             p.price_per_meter,
             p.total_cost
-        ])
-    
-    # Add summary row
-    writer.writerow([])
-    writer.writerow(['TOTAL', '', '', '', '', '', ledger_data['total_quantity'], '', ledger_data['total_amount']])
-    
-    return Response(content=output.getvalue(), media_type='text/csv', headers={
-        'Content-Disposition': f'attachment; filename=purchase_ledger_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-    })
+        ],
+        totals={'quantity': lambda p: p.quantity_meters, 'amount': lambda p: p.total_cost},
+        summary_rows=lambda db, t: [['TOTAL', '', '', '', '', '', t['quantity'], '', t['amount']]],
+        filename=exports.timestamped('purchase_ledger')
+    )
 
 @app.get('/export/ledger/sales.csv')
 def export_sale_ledger(
+    request: Request,
     customer_id: int = None,
     company_id: int = None,
     fabric_type: str = None,
@@ -537,12 +603,8 @@ def export_sale_ledger(
     date_from: str = None,
     date_to: str = None,
     search: str = None,
-    apply_tax: str = None,
-    db: Session = Depends(get_db)
+    apply_tax: str = None
 ):
-    import csv, io
-    from datetime import datetime
-    
     date_from_obj = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
     date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
     
@@ -552,29 +614,33 @@ def export_sale_ledger(
     elif apply_tax == 'no':
         tax_filter = False
     
-    ledger_data = crud.get_sale_ledger(
-        db,
-        customer_id=customer_id,
-        company_id=company_id,
-        fabric_type=fabric_type,
-        fabric_code=fabric_code,
-        date_from=date_from_obj,
-        date_to=date_to_obj,
-        search_query=search,
-        apply_tax_filter=tax_filter
-    )
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Sale ID', 'Date', 'Customer', 'Company', 'Fabric Type', 'Fabric Code', 'Composition', 'Quantity (m)', 'Price/Meter', 'Tax Applied', 'Tax Amount', 'Total'])
+    def build_query(db):
+        return crud.sale_ledger_query(
+            db,
+            customer_id=customer_id,
+            company_id=company_id,
+            fabric_type=fabric_type,
+            fabric_code=fabric_code,
+            date_from=date_from_obj,
+            date_to=date_to_obj,
+            search_query=search,
+            apply_tax_filter=tax_filter
+        ).outerjoin(models.Company, models.Sale.company_id == models.Company.company_id).with_entities(
+            models.Sale.sale_id, models.Sale.date, models.Customer.name.label('customer'),
+            models.Company.company_name, models.Sale.fabric_type, models.Sale.fabric_code, models.Sale.composition,
+            models.Sale.quantity_meters, models.Sale.price_per_meter, models.Sale.apply_tax, models.Sale.tax,
+            models.Sale.total_price_with_tax
+        )
     
-    for s in ledger_data['sales']:
-        company_name = s.company.company_name if s.company else 'N/A'
-        writer.writerow([
+    return exports.csv_response(
+        request,
+        build_query,
+        ['Sale ID', 'Date', 'Customer', 'Company', 'Fabric Type', 'Fabric Code', 'Composition', 'Quantity (m)', 'Price/Meter', 'Tax Applied', 'Tax Amount', 'Total'],
+        lambda s: [
             s.sale_id,
             s.date.strftime('%Y-%m-%d %H:%M'),
-            s.customer.name,
-            company_name,
+            s.customer,
+            s.company_name or 'N/A',
             s.fabric_type,
             s.fabric_code or '',
             s.composition or '',
@@ -583,16 +649,19 @@ def export_sale_ledger(
             'Yes' if s.apply_tax else 'No',
             s.tax,
             s.total_price_with_tax
-        ])
-    
-    # Add summary rows
-    writer.writerow([])
-    writer.writerow(['SUMMARY', '', '', '', '', '', '', ledger_data['total_quantity'], '', '', ledger_data['total_tax'], ledger_data['total_amount']])
-    writer.writerow(['Subtotal', '', '', '', '', '', '', '', '', '', '', ledger_data['subtotal']])
-    
-    return Response(content=output.getvalue(), media_type='text/csv', headers={
-        'Content-Disposition': f'attachment; filename=sale_ledger_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-    })
+        ],
+        totals={
+            'quantity': lambda s: s.quantity_meters,
+            'subtotal': lambda s: s.quantity_meters * s.price_per_meter,
+            'tax': lambda s: s.tax,
+            'amount': lambda s: s.total_price_with_tax
+        },
+        summary_rows=lambda db, t: [
+            ['SUMMARY', '', '', '', '', '', '', t['quantity'], '', '', t['tax'], t['amount']],
+            ['Subtotal', '', '', '', '', '', '', '', '', '', '', t['subtotal']]
+        ],
+        filename=exports.timestamped('sale_ledger')
+    )
 
 # Payment Management Routes
 @app.get('/payments/pending', response_class=HTMLResponse)
@@ -601,22 +670,21 @@ def pending_payments(request: Request, db: Session = Depends(get_db)):
     customer_id = request.query_params.get('customer_id')
     customer_id_int = int(customer_id) if customer_id else None
     
-    pending_sales = crud.get_pending_payments(db, customer_id=customer_id_int)
+    # Totals cover the whole filter, not just this page
+    page = crud.get_pending_payments(db, customer_id=customer_id_int, **_page_args(request))
     customers = db.query(models.Customer).all()
     
-    # Calculate totals
-    total_due = sum(s.amount_due for s in pending_sales)
-    total_sales = sum(s.total_price_with_tax for s in pending_sales)
-    total_paid = sum(s.amount_paid for s in pending_sales)
-    
     return templates.TemplateResponse('payments_pending.html', {
         "request": request,
-        "pending_sales": pending_sales,
+        "pending_sales": page['rows'],
+        "page": page,
         "customers": customers,
         "selected_customer": customer_id_int,
-        "total_due": round(total_due, 2),
-        "total_sales": round(total_sales, 2),
-        "total_paid": round(total_paid, 2)
+        "pending_count": page['count'],
+        "partial_count": page['partial_count'],
+        "total_due": page['total_due'],
+        "total_sales": page['total_sales'],
+        "total_paid": page['total_paid']
     })
 
 @app.get('/payments/record/{sale_id}', response_class=HTMLResponse)
@@ -678,26 +746,31 @@ async def record_payment_post(
 def payment_history(request: Request, db: Session = Depends(get_db)):
     """View payment history"""
     customer_id = request.query_params.get('customer_id')
-    date_from = request.query_params.get('date_from')
-    date_to = request.query_params.get('date_to')
+    payment_method = request.query_params.get('payment_method')
+    date_from = request.query_params.get('start_date')
+    date_to = request.query_params.get('end_date')
     
     customer_id_int = int(customer_id) if customer_id else None
     date_from_obj = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
     date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
     
-    payments = crud.get_payment_history(db, customer_id=customer_id_int, date_from=date_from_obj, date_to=date_to_obj)
+    page = crud.get_payment_history(db, customer_id=customer_id_int, date_from=date_from_obj, date_to=date_to_obj,
+                                    payment_method=payment_method or None, **_page_args(request))
     customers = db.query(models.Customer).all()
     
-    # Calculate totals
-    total_payments = sum(p.amount for p in payments)
+    # Totals cover the whole filter, not just this page
+    average_payment = page['total_amount'] / page['count'] if page['count'] else 0
     
     return templates.TemplateResponse('payment_history.html', {
         "request": request,
-        "payments": payments,
+        "payments": page['rows'],
+        "page": page,
         "customers": customers,
-        "total_payments": round(total_payments, 2),
+        "total_amount": page['total_amount'],
+        "average_payment": round(average_payment, 2),
         "filters": {
             'customer_id': customer_id,
+            'payment_method': payment_method,
             'date_from': date_from,
             'date_to': date_to
         }
@@ -741,35 +814,23 @@ def pending_purchase_payments(request: Request, db: Session = Depends(get_db)):
     
     supplier_id_int = int(supplier_id) if supplier_id else None
     
-    pending_purchases = crud.get_pending_purchase_payments(db, supplier_id=supplier_id_int)
+    date_from_obj = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+    date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
     
-    # Filter by date if provided
-    if date_from or date_to:
-        date_from_obj = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
-        date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
-        
-        filtered = []
-        for purchase in pending_purchases:
-            purchase_date = purchase.date.date() if hasattr(purchase.date, 'date') else purchase.date
-            if date_from_obj and purchase_date < date_from_obj.date():
-                continue
-            if date_to_obj and purchase_date > date_to_obj.date():
-                continue
-            filtered.append(purchase)
-        pending_purchases = filtered
-    
-    # Calculate summary stats
-    total_due = sum(p.amount_due for p in pending_purchases)
-    partial_count = sum(1 for p in pending_purchases if p.payment_status == 'partial')
+    # Totals cover the whole filter, not just this page
+    page = crud.get_pending_purchase_payments(db, supplier_id=supplier_id_int, date_from=date_from_obj,
+                                              date_to=date_to_obj, **_page_args(request))
     
     suppliers = db.query(models.Supplier).all()
     
     return templates.TemplateResponse('purchase_payments_pending.html', {
         "request": request,
-        "pending_purchases": pending_purchases,
+        "pending_purchases": page['rows'],
+        "page": page,
         "suppliers": suppliers,
-        "total_due": round(total_due, 2),
-        "partial_count": partial_count
+        "pending_count": page['count'],
+        "total_due": page['total_due'],
+        "partial_count": page['partial_count']
     })
 
 @app.get('/purchase-payments/record/{purchase_id}', response_class=HTMLResponse)
@@ -855,23 +916,20 @@ def purchase_payment_history(request: Request, db: Session = Depends(get_db)):
     date_from_obj = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
     date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
     
-    payments = crud.get_purchase_payment_history(db, supplier_id=supplier_id_int, date_from=date_from_obj, date_to=date_to_obj)
+    page = crud.get_purchase_payment_history(db, supplier_id=supplier_id_int, date_from=date_from_obj, date_to=date_to_obj,
+                                             payment_method=payment_method or None, **_page_args(request))
     
-    # Filter by payment method if provided
-    if payment_method:
-        payments = [p for p in payments if p.payment_method == payment_method]
-    
-    # Calculate summary stats
-    total_amount = sum(p.amount for p in payments)
-    average_payment = total_amount / len(payments) if payments else 0
+    # Totals cover the whole filter, not just this page
+    average_payment = page['total_amount'] / page['count'] if page['count'] else 0
     
     suppliers = db.query(models.Supplier).all()
     
     return templates.TemplateResponse('purchase_payment_history.html', {
         "request": request,
-        "payments": payments,
+        "payments": page['rows'],
+        "page": page,
         "suppliers": suppliers,
-        "total_amount": round(total_amount, 2),
+        "total_amount": page['total_amount'],
         "average_payment": round(average_payment, 2),
         "filters": {
             'supplier_id': supplier_id,
@@ -921,93 +979,54 @@ def supplier_credit_summary(request: Request, db: Session = Depends(get_db)):
 
 @app.get('/valuation', response_class=HTMLResponse)
 def valuation_report(request: Request, db: Session = Depends(get_db)):
-    # prepare FIFO lot-level details
-    stock = crud.get_stock_summary(db)
-    data = []
-    for s in stock:
-        # get lots and remaining per purchase
-        lots = []
-        total_sold = db.query(func.coalesce(func.sum(models.Sale.quantity_meters), 0)).filter(models.Sale.fabric_type==s['fabric_type'], models.Sale.fabric_code==s['fabric_code']).scalar() or 0
-        purchases = db.query(models.Purchase).filter(models.Purchase.fabric_type==s['fabric_type'], models.Purchase.fabric_code==s['fabric_code']).order_by(models.Purchase.date.asc()).all()
-        t_sold = float(total_sold)
-        total_valuation = 0.0
-        for p in purchases:
-            lot_qty = float(p.quantity_meters)
-            if t_sold >= lot_qty:
-                t_sold -= lot_qty
-                rem = 0.0
-            else:
-                rem = lot_qty - t_sold
-                t_sold = 0.0
-            val = round(rem * float(p.price_per_meter), 2)
-            if rem > 0:
-                lots.append({"date": p.date, "remaining": rem, "price_per_meter": p.price_per_meter, "value": val})
-                total_valuation += val
-        data.append({"fabric_type": s['fabric_type'], "fabric_code": s['fabric_code'], "composition": s['composition'], "lots": lots, "total_valuation": round(total_valuation,2)})
+    # FIFO lot-level details, read from the open lots maintained at write time
+    data = crud.get_fifo_valuation(db)
     return templates.TemplateResponse('valuation.html', {"request": request, "data": data})
 
 
 @app.get('/export/purchases.csv')
-def export_purchases(db: Session = Depends(get_db)):
-    import csv, io
-    purchases = db.query(models.Purchase).order_by(models.Purchase.date.desc()).all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['purchase_id','date','supplier','fabric_type','quantity_meters','price_per_meter','total_cost'])
-    for p in purchases:
-        writer.writerow([p.purchase_id, p.date, p.supplier.name if p.supplier else '', p.fabric_type, p.quantity_meters, p.price_per_meter, p.total_cost])
-    return Response(content=output.getvalue(), media_type='text/csv')
+def export_purchases(request: Request):
+    return exports.csv_response(
+        request,
+        lambda db: db.query(
+            models.Purchase.purchase_id, models.Purchase.date, models.Supplier.name.label('supplier'),
+            models.Purchase.fabric_type, models.Purchase.quantity_meters, models.Purchase.price_per_meter,
+            models.Purchase.total_cost
+        ).outerjoin(models.Supplier).order_by(models.Purchase.date.desc()),
+        ['purchase_id','date','supplier','fabric_type','quantity_meters','price_per_meter','total_cost'],
+        lambda p: [p.purchase_id, p.date, p.supplier or '', p.fabric_type, p.quantity_meters, p.price_per_meter, p.total_cost]
+    )
 
 @app.get('/database/export')
-async def export_database(db: Session = Depends(get_db)):
-    import shutil
-    from datetime import datetime
-    import os
-    import sqlite3
-    
-    # Close the current database connection
-    db.close()
-    
-    # Create a backup filename with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_filename = f"fabric_backup_{timestamp}.db"
-    
+def export_database(check: str = 'quick', compress: bool = False, db: Session = Depends(get_db)):
+    """Stream an online backup of the live database; check=quick|full|none, compress=true for .db.gz"""
+    if check not in backups.CHECKS:
+        raise HTTPException(status_code=400, detail=f"check must be one of: {', '.join(backups.CHECKS)}")
     try:
-        # Verify database exists and is valid
-        if not os.path.exists("fabric.db"):
-            raise ValueError("Database file not found")
-        
-        # Validate database integrity before export
-        try:
-            conn = sqlite3.connect("fabric.db")
-            cursor = conn.cursor()
-            integrity_result = cursor.execute("PRAGMA integrity_check").fetchone()
-            if integrity_result[0] != 'ok':
-                raise ValueError(f"Database integrity check failed: {integrity_result[0]}")
-            conn.close()
-        except Exception as e:
-            raise ValueError(f"Database integrity check failed: {str(e)}")
-        
-        # Create a copy of the database file
-        shutil.copy2("fabric.db", backup_filename)
-        
-        # Verify the backup was created successfully
-        if not os.path.exists(backup_filename):
-            raise ValueError("Backup file creation failed")
-        
-        # Return the backup file
-        # Create background tasks
-        background_tasks = BackgroundTasks()
-        background_tasks.add_task(os.remove, backup_filename)
-        
-        return FileResponse(
-            backup_filename,
-            media_type='application/octet-stream',
-            filename=backup_filename,
-            background=background_tasks
-        )
-    except Exception as e:
+        path = backups.snapshot(db.get_bind(), check=check)
+    except (ValueError, sqlite3.Error) as e:
         raise HTTPException(status_code=500, detail=f"Database export failed: {str(e)}")
+    db.close()
+
+    body = backups.iter_snapshot(path)
+    media_type = 'application/octet-stream'
+    if compress:
+        body = exports.gzip_chunks(body)
+        media_type = 'application/gzip'
+    filename = backups.backup_filename(compress=compress)
+    return StreamingResponse(body, media_type=media_type, headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.get('/api/backups/status')
+def backup_status():
+    return backup_scheduler.status()
+
+@app.post('/api/backups')
+def run_backup():
+    """Write a scheduled-style backup now (throttled like the timer's)"""
+    run = backup_scheduler.run_now()
+    if 'error' in run:
+        raise HTTPException(status_code=500, detail=f"Backup failed: {run['error']}")
+    return run
 
 @app.post('/database/import')
 async def import_database(
@@ -1015,115 +1034,62 @@ async def import_database(
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
-    import sqlite3
-    import os
-    from tempfile import NamedTemporaryFile
-    from datetime import datetime
-    import shutil
-    
-    # Close the current database connection
+    """Replace the live database with an uploaded one, keeping a backup of the current data"""
+    bind = db.get_bind()
     db.close()
-    
+    staged = None
     try:
-        # Save uploaded file to a temporary location
-        with NamedTemporaryFile(delete=False) as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_path = temp_file.name
-        
-        # Validate that this is a valid SQLite database
-        try:
-            conn = sqlite3.connect(temp_path)
-            
-            # Check integrity
-            cursor = conn.cursor()
-            integrity_result = cursor.execute("PRAGMA integrity_check").fetchone()
-            if integrity_result[0] != 'ok':
-                raise ValueError(f"Database integrity check failed: {integrity_result[0]}")
-            
-            # Check if this is our database schema by verifying all required tables
-            required_tables = {'companies', 'suppliers', 'customers', 'purchases', 'sales', 'payments', 'purchase_payments'}
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            existing_tables = {row[0] for row in cursor.fetchall()}
-            conn.close()
-            
-            # Check if minimum required tables exist
-            core_tables = {'companies', 'suppliers', 'customers', 'purchases', 'sales'}
-            if not core_tables.issubset(existing_tables):
-                missing = core_tables - existing_tables
-                raise ValueError(f"Invalid database schema: missing required tables: {', '.join(missing)}")
-            
-            # Warn if payment tables are missing but allow import
-            missing_optional = required_tables - existing_tables
-            if missing_optional:
-                pass  # Silently allow - may be older version
-                
-        except sqlite3.Error as e:
-            raise ValueError(f"Invalid SQLite database file: {str(e)}")
-        
-        # Create a backup of current database
-        backup_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"fabric_backup_before_import_{backup_timestamp}.db"
-        
-        if os.path.exists("fabric.db"):
-            shutil.copy2("fabric.db", backup_filename)
-        
-        # Replace the current database with the uploaded one
-        shutil.copy2(temp_path, "fabric.db")
-        
-        # Verify the import was successful
-        try:
-            verify_conn = sqlite3.connect("fabric.db")
-            verify_cursor = verify_conn.cursor()
-            verify_result = verify_cursor.execute("PRAGMA integrity_check").fetchone()
-            if verify_result[0] != 'ok':
-                raise ValueError(f"Database verification failed after import: {verify_result[0]}")
-            verify_conn.close()
-        except Exception as e:
-            # Restore from backup if verification fails
-            if os.path.exists(backup_filename):
-                shutil.copy2(backup_filename, "fabric.db")
-            raise ValueError(f"Database verification after import failed: {str(e)}. Restored from backup.")
-        
-        # Clean up
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
-        
-        return templates.TemplateResponse(
-            "database_operations.html",
-            {
-                "request": request,
-                "message": "✅ Database imported successfully! All data has been restored. Previous database backed up as: " + backup_filename,
-                "backup_file": backup_filename
-            }
-        )
-        
+        staged = await backups.receive_upload(file)
+        backup_dir = os.path.dirname(os.path.abspath(bind.url.database))
+        backup_path = await run_in_threadpool(backups.restore_database, bind, staged, backup_dir)
+        query_cache.cache.clear()
+        # an export from an older version is migrated like any database found at startup
+        await run_in_threadpool(prepare_database, bind)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Database import failed: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database import failed: {str(e)}")
+    finally:
+        if staged and os.path.exists(staged):
+            os.unlink(staged)
+
+    backup_filename = os.path.basename(backup_path)
+    return templates.TemplateResponse(
+        "database_operations.html",
+        {
+            "request": request,
+            "message": "✅ Database imported successfully! All data has been restored. Previous database backed up as: " + backup_filename,
+            "backup_file": backup_filename
+        }
+    )
 
 
 @app.get('/export/sales.csv')
-def export_sales(db: Session = Depends(get_db)):
-    import csv, io
-    sales = db.query(models.Sale).order_by(models.Sale.date.desc()).all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['sale_id','date','customer','fabric_type','quantity_meters','price_per_meter','apply_tax','tax','total_price_with_tax'])
-    for s in sales:
-        writer.writerow([s.sale_id, s.date, s.customer.name if s.customer else '', s.fabric_type, s.quantity_meters, s.price_per_meter, s.apply_tax, s.tax, s.total_price_with_tax])
-    return Response(content=output.getvalue(), media_type='text/csv')
+def export_sales(request: Request):
+    return exports.csv_response(
+        request,
+        lambda db: db.query(
+            models.Sale.sale_id, models.Sale.date, models.Customer.name.label('customer'), models.Sale.fabric_type,
+            models.Sale.quantity_meters, models.Sale.price_per_meter, models.Sale.apply_tax, models.Sale.tax,
+            models.Sale.total_price_with_tax
+        ).outerjoin(models.Customer).order_by(models.Sale.date.desc()),
+        ['sale_id','date','customer','fabric_type','quantity_meters','price_per_meter','apply_tax','tax','total_price_with_tax'],
+        lambda s: [s.sale_id, s.date, s.customer or '', s.fabric_type, s.quantity_meters, s.price_per_meter, s.apply_tax, s.tax, s.total_price_with_tax]
+    )
 
 
 @app.get('/export/stock.csv')
-def export_stock(db: Session = Depends(get_db)):
-    import csv, io
-    stock = crud.get_stock_summary(db)
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['fabric_type','total_purchased','total_sold','balance_in_meters','avg_cost_per_meter','stock_valuation'])
-    for s in stock:
-        writer.writerow([s['fabric_type'], s['total_purchased'], s['total_sold'], s['balance_in_meters'], s['avg_cost_per_meter'], s['stock_valuation']])
-    return Response(content=output.getvalue(), media_type='text/csv')
+def export_stock(request: Request):
+    def format_row(position):
+        s = crud.stock_position_dict(position)
+        return [s['fabric_type'], s['total_purchased'], s['total_sold'], s['balance_in_meters'], s['avg_cost_per_meter'], s['stock_valuation']]
+    
+    return exports.csv_response(
+        request,
+        crud.stock_positions_query,
+        ['fabric_type','total_purchased','total_sold','balance_in_meters','avg_cost_per_meter','stock_valuation'],
+        format_row
+    )
 
 # API endpoints
 @app.post('/api/add_purchase')
@@ -1143,297 +1109,146 @@ def api_add_sale(sale: schemas.APISale, db: Session = Depends(get_db)):
     except ValueError as e:
         return Response(status_code=400, content=str(e))
 
+def _bulk_import(kind: str, file: UploadFile, batch_size: int, db: Session):
+    batch_size = max(1, min(batch_size, crud.MAX_IMPORT_BATCH_ROWS))
+    try:
+        return imports.import_upload(db, kind, file.file, file.filename, file.content_type, batch_size=batch_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post('/api/import/purchases')
+def api_import_purchases(file: UploadFile = File(...), batch_size: int = crud.IMPORT_BATCH_ROWS,
+                         db: Session = Depends(get_db)):
+    # CSV (header row) or JSON lines; valid rows are committed together, invalid ones reported per row
+    return _bulk_import('purchases', file, batch_size, db)
+
+@app.post('/api/import/sales')
+def api_import_sales(file: UploadFile = File(...), batch_size: int = crud.IMPORT_BATCH_ROWS,
+                     db: Session = Depends(get_db)):
+    return _bulk_import('sales', file, batch_size, db)
+
 @app.get('/api/stock')
 def api_stock(db: Session = Depends(get_db)):
     return crud.get_stock_summary(db)
 
+def _api_page(request: Request, response: Response, page):
+    """
+    Rows of a page as the plain JSON list these endpoints have always returned; the cursors go in a
+    Link header (rel="next"/"prev") and the total in X-Total-Estimate
+    """
+    links = [f'<{page_url(request, cursor=page[key], direction=rel)}>; rel="{rel}"'
+             for key, rel in (('next_cursor', 'next'), ('prev_cursor', 'prev')) if page[key]]
+    if links:
+        response.headers['Link'] = ', '.join(links)
+    response.headers['X-Total-Estimate'] = str(page['total_estimate'])
+    return page['rows']
+
 @app.get('/api/purchases')
-def api_purchases(db: Session = Depends(get_db)):
-    return crud.get_purchases(db)
+def api_purchases(request: Request, response: Response, db: Session = Depends(get_db)):
+    return _api_page(request, response, crud.get_purchases(db, **_page_args(request)))
 
 @app.get('/api/sales')
-def api_sales(db: Session = Depends(get_db)):
-    return crud.get_sales(db)
+def api_sales(request: Request, response: Response, db: Session = Depends(get_db)):
+    return _api_page(request, response, crud.get_sales(db, **_page_args(request)))
+
+# Change log: consumers pass the last_seq they saw back as since
+@app.get('/api/changes')
+def api_changes(since: int = 0, limit: int = 1000, table: str = None, db: Session = Depends(get_db)):
+    try:
+        return changelog.get_changes(db, since=since, limit=limit, table_name=table)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get('/api/cache/stats')
+def api_cache_stats():
+    return query_cache.cache.stats()
 
-# Invoice PDF with optional company name parameter
 # Invoice PDF
 @app.get('/invoice/{sale_id}')
-def invoice_pdf(sale_id: int, db: Session = Depends(get_db)):
-    s = db.query(models.Sale).filter(models.Sale.sale_id==sale_id).first()
-    if not s:
+async def invoice_pdf(sale_id: int, request: Request, db: Session = Depends(get_db)):
+    snapshot = await run_in_threadpool(crud.get_invoice_snapshot, db, sale_id)
+    if snapshot is None:
         raise HTTPException(status_code=404, detail='Sale not found')
 
-    # Get company information
-    company = None
-    if s.company_id:
-        company = crud.get_company_by_id(db, s.company_id)
-
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    
-    # Professional color scheme
-    primary_blue = colors.HexColor('#1e3a8a')     # Deep navy blue
-    accent_blue = colors.HexColor('#3b82f6')      # Medium blue
-    light_blue = colors.HexColor('#eff6ff')       # Very light blue
-    success_green = colors.HexColor('#059669')    # Success green
-    text_dark = colors.HexColor('#1f2937')        # Dark gray text
-    text_medium = colors.HexColor('#6b7280')      # Medium gray text
-    text_light = colors.HexColor('#9ca3af')       # Light gray text
-    
-    y_pos = height - 30
-    
-    # Top header with gradient effect (simulated with rectangles)
-    c.setFillColor(primary_blue)
-    c.rect(0, height-100, width, 100, fill=1, stroke=0)
-    
-    # Add subtle shadow effect
-    c.setFillColor(colors.HexColor('#1e40af'))
-    c.rect(0, height-105, width, 5, fill=1, stroke=0)
-    
-    # Company Header
-    if company:
-        c.setFont('Helvetica-Bold', 26)
-        c.setFillColor(colors.white)
-        c.drawCentredString(width/2, y_pos-35, company.company_name.upper())
-        
-        # Company tagline or business type
-        c.setFont('Helvetica-Oblique', 12)
-        c.setFillColor(colors.HexColor('#bfdbfe'))
-        c.drawCentredString(width/2, y_pos-55, "Professional Business Solutions")
-        
-        # Company details in elegant layout
-        c.setFont('Helvetica', 10)
-        c.setFillColor(colors.white)
-        
-        details_y = y_pos - 75
-        if company.address:
-            c.drawString(60, details_y, f"📍 {company.address}")
-        if company.phone:
-            c.drawRightString(width-60, details_y, f"📞 {company.phone}")
-        
-        details_y -= 15
-        if company.email:
-            c.drawString(60, details_y, f"✉️ {company.email}")
-        if company.website:
-            c.drawRightString(width-60, details_y, f"🌐 {company.website}")
-            
-        if company.tax_number:
-            details_y -= 15
-            c.drawCentredString(width/2, details_y, f"Tax Registration: {company.tax_number}")
-    else:
-        c.setFont('Helvetica-Bold', 26)
-        c.setFillColor(colors.white)
-        c.drawCentredString(width/2, y_pos-35, "PROFESSIONAL INVOICE")
-        
-        c.setFont('Helvetica-Oblique', 12)
-        c.setFillColor(colors.HexColor('#bfdbfe'))
-        c.drawCentredString(width/2, y_pos-55, "Quality Business Solutions")
-    
-    # Reset position after header
-    y_pos = height - 130
-    
-    # INVOICE banner with modern design
-    c.setFillColor(accent_blue)
-    c.rect(40, y_pos-35, width-80, 35, fill=1, stroke=0)
-    
-    # Add subtle border
-    c.setStrokeColor(primary_blue)
-    c.setLineWidth(2)
-    c.rect(40, y_pos-35, width-80, 35, fill=0, stroke=1)
-    
-    c.setFont('Helvetica-Bold', 18)
-    c.setFillColor(colors.white)
-    c.drawCentredString(width/2, y_pos-22, "I N V O I C E")
-    
-    y_pos -= 60
-    
-    # Main content area with subtle background
-    content_height = y_pos - 180
-    c.setFillColor(colors.HexColor('#fafafa'))
-    c.rect(40, 180, width-80, content_height, fill=1, stroke=0)
-    
-    # Invoice details card
-    card_width = 220
-    card_height = 85
-    
-    # Left card - Invoice details
-    c.setFillColor(light_blue)
-    c.setStrokeColor(accent_blue)
-    c.setLineWidth(1)
-    c.rect(60, y_pos-card_height, card_width, card_height, fill=1, stroke=1)
-    
-    c.setFont('Helvetica-Bold', 11)
-    c.setFillColor(primary_blue)
-    c.drawString(75, y_pos-20, "INVOICE DETAILS")
-    
-    c.setFont('Helvetica', 10)
-    c.setFillColor(text_dark)
-    c.drawString(75, y_pos-35, f"Invoice #: #{s.sale_id:06d}")
-    c.drawString(75, y_pos-50, f"Date: {s.date.strftime('%B %d, %Y')}")
-    c.drawString(75, y_pos-65, f"Time: {s.date.strftime('%I:%M %p')}")
-    
-    # Right card - Bill To
-    c.setFillColor(light_blue)
-    c.rect(width-280, y_pos-card_height, card_width, card_height, fill=1, stroke=1)
-    
-    c.setFont('Helvetica-Bold', 11)
-    c.setFillColor(primary_blue)
-    c.drawString(width-265, y_pos-20, "BILL TO")
-    
-    c.setFont('Helvetica-Bold', 11)
-    c.setFillColor(text_dark)
-    c.drawString(width-265, y_pos-38, s.customer.name)
-    
-    c.setFont('Helvetica', 9)
-    c.setFillColor(text_medium)
-    c.drawString(width-265, y_pos-52, f"Contact: {s.customer.contact or 'N/A'}")
-    c.drawString(width-265, y_pos-65, f"Customer ID: {s.customer.customer_id}")
-    
-    y_pos -= 110
-    
-    # Items section with modern table design
-    table_y = y_pos
-    table_width = width - 120
-    header_height = 35
-    row_height = 45
-    
-    # Table header with gradient
-    c.setFillColor(primary_blue)
-    c.rect(60, table_y-header_height, table_width, header_height, fill=1, stroke=0)
-    
-    # Header shadow
-    c.setFillColor(colors.HexColor('#1e40af'))
-    c.rect(60, table_y-header_height-2, table_width, 2, fill=1, stroke=0)
-    
-    c.setFont('Helvetica-Bold', 11)
-    c.setFillColor(colors.white)
-    c.drawCentredString(160, table_y-22, "ITEM DESCRIPTION")
-    c.drawCentredString(320, table_y-22, "QTY")
-    c.drawCentredString(420, table_y-22, "RATE")
-    c.drawCentredString(500, table_y-22, "AMOUNT")
-    
-    # Table row with alternating background
-    row_y = table_y - header_height
-    c.setFillColor(colors.white)
-    c.setStrokeColor(colors.HexColor('#e5e7eb'))
-    c.setLineWidth(0.5)
-    c.rect(60, row_y-row_height, table_width, row_height, fill=1, stroke=1)
-    
-    # Item details with better formatting
-    c.setFont('Helvetica-Bold', 11)
-    c.setFillColor(text_dark)
-    item_y = row_y - 15
-    c.drawString(70, item_y, s.fabric_type)
-    
-    c.setFont('Helvetica', 9)
-    c.setFillColor(text_medium)
-    if s.fabric_code:
-        c.drawString(70, item_y-12, f"Code: {s.fabric_code}")
-    if s.composition:
-        c.drawString(70, item_y-24, f"Material: {s.composition}")
-    
-    # Quantity, Rate, Amount
-    c.setFont('Helvetica', 10)
-    c.setFillColor(text_dark)
-    c.drawCentredString(320, row_y-20, f"{s.quantity_meters}")
-    c.setFont('Helvetica', 8)
-    c.setFillColor(text_medium)
-    c.drawCentredString(320, row_y-32, "meters")
-    
-    c.setFont('Helvetica', 10)
-    c.setFillColor(text_dark)
-    c.drawCentredString(420, row_y-25, f"Rs. {s.price_per_meter:.2f}")
-    
-    subtotal = s.quantity_meters * s.price_per_meter
-    c.setFont('Helvetica-Bold', 12)
-    c.setFillColor(success_green)
-    c.drawCentredString(500, row_y-25, f"Rs. {subtotal:.2f}")
-    
-    y_pos = row_y - row_height - 30
-    
-    # Summary section with cards
-    summary_width = 280
-    summary_x = width - summary_width - 60
-    
-    # Summary background
-    c.setFillColor(colors.HexColor('#f9fafb'))
-    c.setStrokeColor(colors.HexColor('#e5e7eb'))
-    c.rect(summary_x, y_pos-90, summary_width, 90, fill=1, stroke=1)
-    
-    # Summary items
-    c.setFont('Helvetica', 11)
-    c.setFillColor(text_dark)
-    
-    summary_y = y_pos - 20
-    c.drawString(summary_x + 20, summary_y, "Subtotal:")
-    c.drawRightString(summary_x + summary_width - 20, summary_y, f"Rs. {subtotal:.2f}")
-    
-    summary_y -= 20
-    if s.apply_tax:
-        # Calculate the tax percentage from the tax amount
-        tax_percentage = (s.tax / subtotal) * 100
-        c.drawString(summary_x + 20, summary_y, f"Tax ({tax_percentage:.0f}%):")
-        c.drawRightString(summary_x + summary_width - 20, summary_y, f"Rs. {s.tax:.2f}")
-    else:
-        c.setFillColor(text_medium)
-        c.drawString(summary_x + 20, summary_y, "Tax:")
-        c.drawRightString(summary_x + summary_width - 20, summary_y, "Not Applied")
-    
-    # Total section with highlight
-    summary_y -= 30
-    c.setFillColor(success_green)
-    c.rect(summary_x + 10, summary_y-5, summary_width-20, 25, fill=1, stroke=0)
-    
-    c.setFont('Helvetica-Bold', 12)
-    c.setFillColor(colors.white)
-    c.drawString(summary_x + 20, summary_y+5, "TOTAL:")
-    c.drawRightString(summary_x + summary_width - 20, summary_y+5, f"Rs. {s.total_price_with_tax:.2f}")
-    
-    y_pos -= 120
-    
-    # Footer section with modern styling
-    footer_height = 70
-    c.setFillColor(primary_blue)
-    c.rect(40, y_pos-footer_height, width-80, footer_height, fill=1, stroke=0)
-    
-    # Footer content
-    c.setFont('Helvetica-Bold', 14)
-    c.setFillColor(colors.white)
-    c.drawCentredString(width/2, y_pos-25, "Thank you for your business!")
-    
-    c.setFont('Helvetica', 10)
-    c.setFillColor(colors.HexColor('#bfdbfe'))
-    c.drawCentredString(width/2, y_pos-40, "For support & inquiries: WhatsApp 03362793950")
-    
-    c.setFont('Helvetica-Oblique', 8)
-    c.setFillColor(colors.HexColor('#93c5fd'))
-    c.drawCentredString(width/2, y_pos-55, f"Generated on {s.date.strftime('%B %d, %Y at %I:%M %p')} • Secure Digital Invoice")
-    
-    # Bottom branding strip
-    c.setFillColor(colors.HexColor('#f8fafc'))
-    c.rect(0, 0, width, 35, fill=1, stroke=0)
-    
-    c.setFont('Helvetica-Bold', 9)
-    c.setFillColor(primary_blue)
-    c.drawCentredString(width/2, 20, "Powered by TzkSolution")
-    
-    c.setFont('Helvetica', 8)
-    c.setFillColor(text_medium)
-    c.drawCentredString(width/2, 10, "Professional Invoice Management System • WhatsApp: 03362793950")
-
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    
-    # Set proper filename for download
-    filename = f"Invoice_{s.sale_id:06d}_{s.customer.name.replace(' ', '_')}.pdf"
-    
-    return StreamingResponse(
-        buffer, 
-        media_type='application/pdf',
-        headers={"Content-Disposition": f"inline; filename={filename}"}
-    )
+    # the ETag is the cache key: it changes whenever anything printed on the invoice does
+    etag = f'"{invoices.invoice_key(snapshot)}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    headers['Content-Disposition'] = f"inline; filename={invoices.invoice_filename(snapshot)}"
+    try:
+        pdf = await invoices.get_invoice_pdf(snapshot)
+    except invoices.RenderQueueFull:
+        raise HTTPException(status_code=503, detail='Too many invoices are being printed, try again shortly',
+                            headers={'Retry-After': '1'})
+    return Response(pdf, media_type='application/pdf', headers=headers)
+
+@app.get('/api/invoices/metrics')
+def invoice_metrics():
+    return {
+        "render": invoices.render_executor.metrics(),
+        "batch": invoices.batch_executor.metrics(),
+        "cache": invoices.invoice_cache.stats(),
+    }
+
+# Batch invoices: same filters as the sale ledger; poll the batch, then download it once it is done.
+# format=zip renders the invoices in parallel and reports progress per invoice; format=pdf is drawn
+# by one worker, so its progress stays at 0 until the whole merged document is written
+@app.post('/invoices/batch', status_code=202)
+def start_invoice_batch(
+    customer_id: int = None,
+    company_id: int = None,
+    fabric_type: str = None,
+    fabric_code: str = None,
+    date_from: str = None,
+    date_to: str = None,
+    search: str = None,
+    apply_tax: str = None,
+    format: str = 'zip',
+    db: Session = Depends(get_db)
+):
+    tax_filter = None
+    if apply_tax == 'yes':
+        tax_filter = True
+    elif apply_tax == 'no':
+        tax_filter = False
+    try:
+        snapshots = crud.get_invoice_snapshots(
+            db,
+            limit=invoices.MAX_BATCH_INVOICES,
+            customer_id=customer_id,
+            company_id=company_id,
+            fabric_type=fabric_type,
+            fabric_code=fabric_code,
+            date_from=datetime.strptime(date_from, '%Y-%m-%d') if date_from else None,
+            date_to=datetime.strptime(date_to, '%Y-%m-%d') if date_to else None,
+            search_query=search,
+            apply_tax_filter=tax_filter
+        )
+        if not snapshots:
+            raise ValueError("No sales match the filter")
+        batch = invoices.start_batch(snapshots, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**batch.to_dict(), "status_url": f"/invoices/batch/{batch.batch_id}",
+            "download_url": f"/invoices/batch/{batch.batch_id}/download"}
+
+@app.get('/invoices/batch/{batch_id}')
+def invoice_batch_status(batch_id: str):
+    batch = invoices.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail='Batch not found')
+    return batch.to_dict()
+
+@app.get('/invoices/batch/{batch_id}/download')
+def invoice_batch_download(batch_id: str):
+    batch = invoices.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail='Batch not found')
+    if batch.status != 'done':
+        raise HTTPException(status_code=409, detail=f'Batch is {batch.status}')
+    return FileResponse(batch.path, media_type=invoices.BATCH_FORMATS[batch.format],
+                        filename=f'invoices_{batch.batch_id[:8]}.{batch.format}')
 
 
 # ===================== BANK STATEMENT ROUTES =====================
@@ -1455,24 +1270,25 @@ def bank_statement_view(request: Request, db: Session = Depends(get_db)):
     date_from_obj = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
     date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
     
-    statements = crud.get_bank_statements(
+    page = crud.get_bank_statement_page(
         db,
         transaction_type=transaction_type,
         status=status,
         date_from=date_from_obj,
         date_to=date_to_obj,
-        bank_account=bank_account
+        bank_account=bank_account,
+        **_page_args(request)
     )
     
     summary = crud.get_bank_summary(db, date_from=date_from_obj, date_to=date_to_obj, bank_account=bank_account)
     
     # Get unique bank accounts for filter
-    all_statements = db.query(models.BankStatement).all()
-    bank_accounts = list(set([s.bank_account for s in all_statements if s.bank_account]))
+    bank_accounts = crud.get_bank_account_names(db)
     
     return templates.TemplateResponse('bank_statement.html', {
         "request": request,
-        "statements": summary['statements'],
+        "statements": page['rows'],
+        "page": page,
         "summary": summary,
         "bank_accounts": bank_accounts,
         "filters": {
@@ -1515,11 +1331,21 @@ def bank_reconciliation(request: Request, db: Session = Depends(get_db)):
     date_from_obj = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
     date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
     
+    tab = request.query_params.get('tab', 'cleared')
+    
     reconciliation = crud.get_bank_reconciliation_status(db, date_from=date_from_obj, date_to=date_to_obj)
+    try:
+        page = crud.get_reconciliation_statements(db, status=tab, date_from=date_from_obj, date_to=date_to_obj,
+                                                  **_page_args(request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return templates.TemplateResponse('bank_reconciliation.html', {
         "request": request,
         "reconciliation": reconciliation,
+        "tab": tab,
+        "statements": page['rows'],
+        "page": page,
         "filters": {
             'date_from': date_from,
             'date_to': date_to
@@ -1579,36 +1405,40 @@ def add_manual_bank_entry(
 
 @app.get('/bank/export.csv')
 def export_bank_statement(
+    request: Request,
     type: str = None,
     status: str = None,
     date_from: str = None,
     date_to: str = None,
-    bank_account: str = None,
-    db: Session = Depends(get_db)
+    bank_account: str = None
 ):
     """Export bank statement as CSV"""
-    import csv, io
-    
     date_from_obj = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
     date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
     
-    statements = crud.get_bank_statements(
-        db,
-        transaction_type=type,
-        status=status,
-        date_from=date_from_obj,
-        date_to=date_to_obj,
-        bank_account=bank_account
-    )
-    
-    summary = crud.get_bank_summary(db, date_from=date_from_obj, date_to=date_to_obj, bank_account=bank_account)
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Date', 'Type', 'Description', 'Amount', 'Account', 'Reference', 'Status', 'Payment Method'])
-    
-    for s in statements:
-        writer.writerow([
+    def summary_rows(db, totals):
+        opening_balance = crud.get_bank_opening_balance(db, date_from=date_from_obj, bank_account=bank_account)
+        closing_balance = round(opening_balance + totals['credit'] - totals['debit'], 2)
+        return [
+            ['SUMMARY', '', '', '', '', '', '', ''],
+            ['Opening Balance', '', '', opening_balance, '', '', '', ''],
+            ['Total Credits', '', '', totals['credit'], '', '', '', ''],
+            ['Total Debits', '', '', totals['debit'], '', '', '', ''],
+            ['Closing Balance', '', '', closing_balance, '', '', '', '']
+        ]
+    
+    return exports.csv_response(
+        request,
+        lambda db: crud.bank_statements_query(
+            db,
+            transaction_type=type,
+            status=status,
+            date_from=date_from_obj,
+            date_to=date_to_obj,
+            bank_account=bank_account
+        ),
+        ['Date', 'Type', 'Description', 'Amount', 'Account', 'Reference', 'Status', 'Payment Method'],
+        lambda s: [
             s.transaction_date.strftime('%Y-%m-%d %H:%M'),
             s.transaction_type.upper(),
             s.description,
@@ -1617,20 +1447,13 @@ def export_bank_statement(
             s.reference_number or '',
             s.status,
             s.payment_method or ''
-        ])
-    
-    # Add summary
-    writer.writerow([])
-    writer.writerow(['SUMMARY', '', '', '', '', '', '', ''])
-    writer.writerow(['Opening Balance', '', '', summary['opening_balance'], '', '', '', ''])
-    writer.writerow(['Total Credits', '', '', summary['total_credit'], '', '', '', ''])
-    writer.writerow(['Total Debits', '', '', summary['total_debit'], '', '', '', ''])
-    writer.writerow(['Closing Balance', '', '', summary['closing_balance'], '', '', '', ''])
-    
-    return Response(
-        content=output.getvalue(),
-        media_type='text/csv',
-        headers={'Content-Disposition': f'attachment; filename=bank_statement_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
+        ],
+        totals={
+            'credit': lambda s: s.amount if s.transaction_type == 'credit' else 0,
+            'debit': lambda s: s.amount if s.transaction_type == 'debit' else 0
+        },
+        summary_rows=summary_rows,
+        filename=exports.timestamped('bank_statement')
     )
 
 # Bank API endpoints
@@ -1641,6 +1464,17 @@ def api_bank_summary(date_from: str = None, date_to: str = None, db: Session = D
     date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
     return crud.get_bank_summary(db, date_from=date_from_obj, date_to=date_to_obj)
 
+@app.get('/api/bank/accounts')
+def api_bank_accounts(db: Session = Depends(get_db)):
+    """Bank accounts with cached balance and last transaction date"""
+    return [{
+        'bank_account_id': a.bank_account_id,
+        'name': a.name,
+        'current_balance': round(a.current_balance, 2),
+        'transaction_count': a.transaction_count,
+        'last_transaction_date': a.last_transaction_date
+    } for a in crud.get_bank_accounts(db)]
+
 @app.get('/api/bank/reconciliation')
 def api_bank_reconciliation(date_from: str = None, date_to: str = None, db: Session = Depends(get_db)):
     """Get reconciliation status via API"""
@@ -0,0 +1,206 @@
+"""
+Idempotent schema upgrades for existing fabric.db files.
+Runs on application startup after create_all, or manually: python migrations.py
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import crud, models
+from database import engine
+
+
+def ensure_indexes(bind=engine):
+    """
+    Create any index declared in models.py that is missing from the database.
+    create_all only builds indexes together with new tables, so older databases need this.
+    Returns the names of the indexes created.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    with bind.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn, checkfirst=True)
+                    created.append(index.name)
+    return created
+
+
+def ensure_columns(bind=engine):
+    """
+    Add nullable columns declared in models.py that existing tables lack (SQLite ALTER TABLE ADD COLUMN).
+    Returns 'table.column' for each column added.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with bind.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=bind.dialect)}'
+                for fk in column.foreign_keys:
+                    ddl += f' REFERENCES {fk.column.table.name}({fk.column.name})'
+                conn.execute(text(ddl))
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def backfill_bank_accounts(bind=engine):
+    """
+    Create a bank_accounts row for every account name used on statements, link the statements
+    to it and recompute the cached balance/count/last date of the accounts touched.
+    Returns the number of statements linked.
+    """
+    with bind.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO bank_accounts (name, current_balance, transaction_count, created_at)
+            SELECT DISTINCT bank_account, 0.0, 0, CURRENT_TIMESTAMP FROM bank_statements
+            WHERE bank_account IS NOT NULL AND bank_account != ''
+              AND bank_account NOT IN (SELECT name FROM bank_accounts)
+        """))
+        linked = conn.execute(text("""
+            UPDATE bank_statements
+            SET bank_account_id = (SELECT bank_account_id FROM bank_accounts WHERE name = bank_statements.bank_account)
+            WHERE bank_account_id IS NULL AND bank_account IS NOT NULL AND bank_account != ''
+        """)).rowcount
+        if linked:
+            conn.execute(text("""
+                UPDATE bank_accounts SET
+                    current_balance = COALESCE((
+                        SELECT SUM(CASE WHEN s.transaction_type = 'credit' THEN s.amount ELSE -s.amount END)
+                        FROM bank_statements s WHERE s.bank_account_id = bank_accounts.bank_account_id), 0.0),
+                    transaction_count = (
+                        SELECT COUNT(*) FROM bank_statements s WHERE s.bank_account_id = bank_accounts.bank_account_id),
+                    last_transaction_date = (
+                        SELECT MAX(s.transaction_date) FROM bank_statements s
+                        WHERE s.bank_account_id = bank_accounts.bank_account_id)
+            """))
+    return linked
+
+
+def backfill_fabrics(bind=engine):
+    """
+    Fill the fabrics catalog from the distinct fabric keys on purchases and sales (deduplicated
+    ignoring case and surrounding whitespace, as crud.get_fabric matches them) and set fabric_id
+    on the rows that lack it. Returns the number of purchases and sales linked.
+    """
+    linked = 0
+    with bind.begin() as conn:
+        # the NOCASE columns of fabrics make every comparison against them case-insensitive; with
+        # MIN(k_date) SQLite takes the bare key columns from the earliest row, so the first spelling wins
+        conn.execute(text("""
+            INSERT INTO fabrics (fabric_type, fabric_code, composition, created_at)
+            SELECT k_type, k_code, k_comp, MIN(k_date) FROM (
+                SELECT TRIM(fabric_type) AS k_type, NULLIF(TRIM(fabric_code), '') AS k_code,
+                       NULLIF(TRIM(composition), '') AS k_comp, COALESCE(date, CURRENT_TIMESTAMP) AS k_date
+                FROM purchases WHERE fabric_id IS NULL
+                UNION ALL
+                SELECT TRIM(fabric_type), NULLIF(TRIM(fabric_code), ''), NULLIF(TRIM(composition), ''),
+                       COALESCE(date, CURRENT_TIMESTAMP)
+                FROM sales WHERE fabric_id IS NULL
+            ) AS k
+            WHERE NOT EXISTS (
+                SELECT 1 FROM fabrics f
+                WHERE f.fabric_type = k.k_type AND f.fabric_code IS k.k_code AND f.composition IS k.k_comp
+            )
+            GROUP BY k_type COLLATE NOCASE, k_code COLLATE NOCASE, k_comp COLLATE NOCASE
+        """))
+        for table in ('purchases', 'sales'):
+            linked += conn.execute(text(f"""
+                UPDATE {table} SET fabric_id = (
+                    SELECT f.fabric_id FROM fabrics f
+                    WHERE f.fabric_type = TRIM({table}.fabric_type)
+                      AND f.fabric_code IS NULLIF(TRIM({table}.fabric_code), '')
+                      AND f.composition IS NULLIF(TRIM({table}.composition), '')
+                )
+                WHERE fabric_id IS NULL
+            """)).rowcount
+    return linked
+
+
+# Fabric typeahead index: an FTS5 trigram table over the fabric key columns of stock_positions (one row
+# per distinct fabric), kept in step by triggers. Balance updates don't touch the key columns, so only
+# a new fabric, a rebuild or a deletion writes to the index.
+FABRIC_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE fabric_search USING fts5(
+        fabric_type, fabric_code, composition,
+        content='stock_positions', content_rowid='position_id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER fabric_search_ai AFTER INSERT ON stock_positions BEGIN
+        INSERT INTO fabric_search(rowid, fabric_type, fabric_code, composition)
+        VALUES (new.position_id, new.fabric_type, new.fabric_code, new.composition);
+    END""",
+    """CREATE TRIGGER fabric_search_ad AFTER DELETE ON stock_positions BEGIN
+        INSERT INTO fabric_search(fabric_search, rowid, fabric_type, fabric_code, composition)
+        VALUES ('delete', old.position_id, old.fabric_type, old.fabric_code, old.composition);
+    END""",
+    """CREATE TRIGGER fabric_search_au AFTER UPDATE OF fabric_type, fabric_code, composition ON stock_positions BEGIN
+        INSERT INTO fabric_search(fabric_search, rowid, fabric_type, fabric_code, composition)
+        VALUES ('delete', old.position_id, old.fabric_type, old.fabric_code, old.composition);
+        INSERT INTO fabric_search(rowid, fabric_type, fabric_code, composition)
+        VALUES (new.position_id, new.fabric_type, new.fabric_code, new.composition);
+    END""",
+    "INSERT INTO fabric_search(fabric_search) VALUES ('rebuild')",
+]
+
+
+def ensure_fabric_search(bind=engine):
+    """
+    Create and fill the fabric_search index if it is missing.
+    Returns False when it already exists or this SQLite build lacks FTS5 trigram support
+    (crud.search_fabrics then falls back to a LIKE scan).
+    """
+    # the answer is cached for crud.search_fabrics, which would otherwise look on every keystroke
+    if 'fabric_search' in inspect(bind).get_table_names():
+        crud.set_fabric_search(bind, True)
+        return False
+    try:
+        with bind.begin() as conn:
+            for ddl in FABRIC_SEARCH_DDL:
+                conn.execute(text(ddl))
+    except OperationalError as e:
+        print(f"⚠ Fabric search index unavailable: {e}")
+        crud.set_fabric_search(bind, False)
+        return False
+    crud.set_fabric_search(bind, True)
+    return True
+
+
+def run_all(bind=engine):
+    """Apply every upgrade step; returns a list of human-readable changes"""
+    changes = []
+    changes += [f"added column {name}" for name in ensure_columns(bind)]
+    changes += [f"created index {name}" for name in ensure_indexes(bind)]
+    linked = backfill_bank_accounts(bind)
+    if linked:
+        changes.append(f"linked {linked} bank statements to bank_accounts")
+    linked = backfill_fabrics(bind)
+    if linked:
+        changes.append(f"linked {linked} purchases and sales to fabrics")
+        # positions and lots are keyed on fabric_id: rebuild them from the linked ledgers
+        db = Session(bind=bind)
+        try:
+            changes.append(f"rebuilt {crud.rebuild_stock_positions(db)} stock positions")
+        finally:
+            db.close()
+    if ensure_fabric_search(bind):
+        changes.append("created fabric_search index")
+    return changes
+
+
+if __name__ == '__main__':
+    models.Base.metadata.create_all(bind=engine)
+    changes = run_all(engine)
+    for change in changes:
+        print(f'✓ {change}')
+    print('✓ Schema up to date' if not changes else f'✓ Applied {len(changes)} changes')
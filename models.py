@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -31,10 +31,24 @@ class Customer(Base):
 
     sales = relationship("Sale", back_populates="customer")
 
+class Fabric(Base):
+    """Fabric catalog: one row per distinct (fabric_type, fabric_code, composition), matched case-insensitively"""
+    __tablename__ = "fabrics"
+    fabric_id = Column(Integer, primary_key=True, index=True)
+    fabric_type = Column(String(collation='NOCASE'), nullable=False)
+    fabric_code = Column(String(collation='NOCASE'), nullable=True)
+    composition = Column(String(collation='NOCASE'), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_fabrics_key', 'fabric_type', 'fabric_code', 'composition', unique=True),
+    )
+
 class Purchase(Base):
     __tablename__ = "purchases"
     purchase_id = Column(Integer, primary_key=True, index=True)
     supplier_id = Column(Integer, ForeignKey("suppliers.supplier_id"), nullable=False)
+    fabric_id = Column(Integer, ForeignKey("fabrics.fabric_id"), nullable=True)  # set by crud; backfilled by migrations
     date = Column(DateTime, default=datetime.utcnow)
     fabric_type = Column(String, nullable=False)
     fabric_code = Column(String, nullable=True)
@@ -51,13 +65,23 @@ class Purchase(Base):
     payment_notes = Column(String, nullable=True)
 
     supplier = relationship("Supplier", back_populates="purchases")
+    fabric = relationship("Fabric")
     payments = relationship("PurchasePayment", back_populates="purchase", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # stock totals and the FIFO window (covering: no table access needed)
+        Index('ix_purchases_fabric_id', 'fabric_id', 'date', 'purchase_id', 'quantity_meters', 'price_per_meter'),
+        Index('ix_purchases_date', 'date'),
+        Index('ix_purchases_supplier_date', 'supplier_id', 'date'),
+        Index('ix_purchases_payment_status', 'payment_status', 'date'),
+    )
+
 class Sale(Base):
     __tablename__ = "sales"
     sale_id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.company_id"), nullable=True)  # Optional for backward compatibility
     customer_id = Column(Integer, ForeignKey("customers.customer_id"), nullable=False)
+    fabric_id = Column(Integer, ForeignKey("fabrics.fabric_id"), nullable=True)  # set by crud; backfilled by migrations
     date = Column(DateTime, default=datetime.utcnow)
     fabric_type = Column(String, nullable=False)
     fabric_code = Column(String, nullable=True)
@@ -78,8 +102,18 @@ class Sale(Base):
 
     company = relationship("Company")
     customer = relationship("Customer", back_populates="sales")
+    fabric = relationship("Fabric")
     payments = relationship("Payment", back_populates="sale", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # stock totals and the running FIFO windows per fabric, in date order (covering)
+        Index('ix_sales_fabric_date', 'fabric_id', 'date', 'quantity_meters'),
+        Index('ix_sales_date', 'date'),
+        Index('ix_sales_customer_date', 'customer_id', 'date'),
+        Index('ix_sales_company_date', 'company_id', 'date'),
+        Index('ix_sales_payment_status', 'payment_status', 'date'),
+    )
+
 class Payment(Base):
     __tablename__ = "payments"
     payment_id = Column(Integer, primary_key=True, index=True)
@@ -93,6 +127,11 @@ class Payment(Base):
     
     sale = relationship("Sale", back_populates="payments")
 
+    __table_args__ = (
+        Index('ix_payments_sale', 'sale_id', 'payment_date'),
+        Index('ix_payments_date', 'payment_date'),
+    )
+
 class PurchasePayment(Base):
     __tablename__ = "purchase_payments"
     payment_id = Column(Integer, primary_key=True, index=True)
@@ -106,6 +145,21 @@ class PurchasePayment(Base):
     
     purchase = relationship("Purchase", back_populates="payments")
 
+    __table_args__ = (
+        Index('ix_purchase_payments_purchase', 'purchase_id', 'payment_date'),
+        Index('ix_purchase_payments_date', 'payment_date'),
+    )
+
+class BankAccount(Base):
+    """One bank account named on statements, with cached running figures maintained by crud"""
+    __tablename__ = "bank_accounts"
+    bank_account_id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False, unique=True)
+    current_balance = Column(Float, nullable=False, default=0.0)  # credits less debits, all statuses
+    transaction_count = Column(Integer, nullable=False, default=0)
+    last_transaction_date = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class BankStatement(Base):
     __tablename__ = "bank_statements"
     statement_id = Column(Integer, primary_key=True, index=True)
@@ -114,6 +168,7 @@ class BankStatement(Base):
     amount = Column(Float, nullable=False)
     description = Column(String, nullable=False)  # e.g., "Sale Payment from Customer X", "Payment to Supplier Y"
     bank_account = Column(String, nullable=True)  # Account number or name
+    bank_account_id = Column(Integer, ForeignKey("bank_accounts.bank_account_id"), nullable=True)
     reference_number = Column(String, nullable=True)  # Cheque number, transaction ID, transfer reference
     related_sale_id = Column(Integer, ForeignKey("sales.sale_id"), nullable=True)  # Link to sale payment
     related_purchase_id = Column(Integer, ForeignKey("purchases.purchase_id"), nullable=True)  # Link to purchase payment
@@ -125,4 +180,98 @@ class BankStatement(Base):
     
     sale = relationship("Sale")
     purchase = relationship("Purchase")
+    account = relationship("BankAccount")
+
+    __table_args__ = (
+        Index('ix_bank_statements_date', 'transaction_date'),
+        Index('ix_bank_statements_account_id_date', 'bank_account_id', 'transaction_date'),
+        Index('ix_bank_statements_account_date', 'bank_account', 'transaction_date'),
+        Index('ix_bank_statements_status_date', 'status', 'transaction_date'),
+    )
+
+class StockPosition(Base):
+    """Materialized stock balance per fabric, maintained by crud on every purchase/sale write"""
+    __tablename__ = "stock_positions"
+    position_id = Column(Integer, primary_key=True, index=True)
+    fabric_id = Column(Integer, ForeignKey("fabrics.fabric_id"), nullable=True)
+    fabric_type = Column(String, nullable=False)
+    fabric_code = Column(String, nullable=True)
+    composition = Column(String, nullable=True)
+    total_purchased = Column(Float, nullable=False, default=0.0)
+    total_sold = Column(Float, nullable=False, default=0.0)
+    balance_in_meters = Column(Float, nullable=False, default=0.0)
+    stock_valuation = Column(Float, nullable=False, default=0.0)  # FIFO value of remaining meters
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_stock_positions_fabric', 'fabric_type', 'fabric_code', 'composition', unique=True),
+        Index('ix_stock_positions_fabric_id', 'fabric_id', unique=True),
+    )
+
+class StockLot(Base):
+    """Remaining FIFO quantity of one purchase lot, consumed by sales at write time"""
+    __tablename__ = "stock_lots"
+    purchase_id = Column(Integer, ForeignKey("purchases.purchase_id"), primary_key=True)
+    fabric_id = Column(Integer, ForeignKey("fabrics.fabric_id"), nullable=True)
+    fabric_type = Column(String, nullable=False)
+    fabric_code = Column(String, nullable=True)
+    composition = Column(String, nullable=True)
+    date = Column(DateTime, nullable=False)
+    quantity_meters = Column(Float, nullable=False)
+    price_per_meter = Column(Float, nullable=False)
+    remaining_meters = Column(Float, nullable=False)
+
+    purchase = relationship("Purchase")
+
+    __table_args__ = (
+        # partial index: consuming/valuing stock only ever touches open lots
+        Index('ix_stock_lots_open_fabric_id', 'fabric_id', 'date', 'purchase_id',
+              sqlite_where=text('remaining_meters > 0')),
+    )
+
+class SaleAllocation(Base):
+    """Meters of a sale taken from one purchase lot"""
+    __tablename__ = "sale_allocations"
+    allocation_id = Column(Integer, primary_key=True, index=True)
+    sale_id = Column(Integer, ForeignKey("sales.sale_id"), nullable=False, index=True)
+    purchase_id = Column(Integer, ForeignKey("purchases.purchase_id"), nullable=False, index=True)
+    quantity_meters = Column(Float, nullable=False)
+    price_per_meter = Column(Float, nullable=False)  # cost of the lot the meters came from
+
+    sale = relationship("Sale")
+    purchase = relationship("Purchase")
+
+class BankBalanceCheckpoint(Base):
+    """Credits, debits and statement count of one bank account for one calendar month, maintained by crud"""
+    __tablename__ = "bank_balance_checkpoints"
+    checkpoint_id = Column(Integer, primary_key=True, index=True)
+    bank_account = Column(String, nullable=True)
+    period_start = Column(DateTime, nullable=False)  # first day of the month
+    total_credit = Column(Float, nullable=False, default=0.0)
+    total_debit = Column(Float, nullable=False, default=0.0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_bank_checkpoints_account_period', 'bank_account', 'period_start', unique=True),
+        Index('ix_bank_checkpoints_period', 'period_start'),
+    )
+
+class ChangeLog(Base):
+    """
+    One inserted, updated or deleted row, appended by changelog.py in the transaction that made the change.
+    seq is AUTOINCREMENT, so it is never reused and only grows; SQLite's single writer makes rows become
+    visible in seq order.
+    """
+    __tablename__ = "change_log"
+    seq = Column(Integer, primary_key=True)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)  # insert, update, delete
+    columns = Column(String, nullable=True)  # comma-separated columns an update changed
 
+    __table_args__ = (
+        # newest change per table is one index probe (query_cache checks it on every read)
+        Index('ix_change_log_table_seq', 'table_name', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
@@ -24,6 +24,15 @@ DB_RELATIVE_PATH = "data/fabric.db"
 # Auto-create database if missing
 AUTO_CREATE_DB = True
 
+# SQLite connection profile, applied to every new connection (see database.py)
+SQLITE_TUNING_ENABLED = True
+SQLITE_JOURNAL_MODE = "WAL"          # WAL lets readers run while a write is in progress
+SQLITE_SYNCHRONOUS = "NORMAL"        # safe with WAL; FULL fsyncs on every commit
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024 # bytes of the database file to memory-map (0 = off)
+SQLITE_CACHE_SIZE_KB = 64 * 1024     # page cache per connection
+SQLITE_TEMP_STORE = "MEMORY"         # temp tables/indexes for sorts and GROUP BY
+SQLITE_BUSY_TIMEOUT_MS = 5000        # wait this long for a lock instead of "database is locked"
+
 # ============== LOGGING SETTINGS ==============
 
 LOG_LEVEL = "INFO"  # DEBUG, INFO, WARNING, ERROR
@@ -32,6 +41,14 @@ LOG_LEVEL = "INFO"  # DEBUG, INFO, WARNING, ERROR
 SAVE_LOGS = True
 LOG_FILE = "data/app.log"
 
+# SQL profiling: every response carries a Server-Timing header with its query count and DB time, and
+# statements slower than SLOW_QUERY_MS are logged with their query plan (log rotated at SLOW_QUERY_LOG_MAX_KB)
+QUERY_PROFILING = True
+SLOW_QUERY_MS = 200
+SLOW_QUERY_LOG = "data/slow_queries.log"
+SLOW_QUERY_LOG_MAX_KB = 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+
 # ============== SECURITY SETTINGS ==============
 
 # Restrict to localhost only (no network access)
@@ -67,6 +84,28 @@ AUTO_BACKUP_ON_STARTUP = False
 # Keep backup history (number of backups)
 BACKUP_HISTORY = 5
 
+# Scheduled backups: a compressed snapshot every BACKUP_INTERVAL_HOURS (0 = only the startup backup)
+BACKUP_DIR = "data/backups"
+BACKUP_INTERVAL_HOURS = 24
+BACKUP_THROTTLE_MS = 10  # pause between 1 MiB backup steps so requests keep the disk
+
+# Change log entries older than this are deleted at startup and after each scheduled backup
+# (each table's newest entry is kept for the report cache; 0 = keep everything)
+CHANGE_LOG_RETENTION_DAYS = 90
+
+# Rendered invoice PDFs are kept here and reused until the sale, customer, company or payments change
+INVOICE_CACHE_DIR = "data/invoice_cache"
+INVOICE_CACHE_MAX_MB = 64  # least recently used PDFs are evicted above this total
+INVOICE_RENDER_PROCESSES = 0  # worker processes for batch invoice rendering (0 = one per CPU)
+INVOICE_RENDER_WORKERS = 2  # worker processes for invoices opened one at a time
+INVOICE_RENDER_QUEUE = 16  # invoices waiting or rendering before /invoice answers 503
+
+# Report aggregates (profit & loss, ledger and credit summaries) are cached in memory and checked
+# against the change log on every read, so a save by any worker drops them; the TTL covers changes
+# that bypass the change log (0 = off)
+SUMMARY_CACHE_TTL = 300
+SUMMARY_CACHE_MAX_ENTRIES = 256
+
 # ============== FEATURES ==============
 
 # Enable payment tracking
@@ -105,6 +144,37 @@ def get_log_path():
     os.makedirs(os.path.dirname(log_path), exist_ok=True)
     return log_path
 
+def get_slow_query_log_path():
+    """Get full slow query log path"""
+    if not SAVE_LOGS:
+        return None
+    log_path = os.path.join(get_app_root(), SLOW_QUERY_LOG)
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    return log_path
+
+def get_backup_dir():
+    """Get full scheduled backup directory path (created on first backup)"""
+    return os.path.join(get_app_root(), BACKUP_DIR)
+
+def get_invoice_cache_dir():
+    """Get full invoice cache directory path (created on first use)"""
+    return os.path.join(get_app_root(), INVOICE_CACHE_DIR)
+
+def check_sqlite_settings():
+    """Validate the SQLite connection profile; returns a list of problems (empty if OK)"""
+    problems = []
+    if SQLITE_JOURNAL_MODE.upper() not in ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'):
+        problems.append(f"SQLITE_JOURNAL_MODE '{SQLITE_JOURNAL_MODE}' is not a SQLite journal mode")
+    if SQLITE_SYNCHRONOUS.upper() not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        problems.append(f"SQLITE_SYNCHRONOUS '{SQLITE_SYNCHRONOUS}' must be OFF, NORMAL, FULL or EXTRA")
+    if SQLITE_TEMP_STORE.upper() not in ('DEFAULT', 'FILE', 'MEMORY'):
+        problems.append(f"SQLITE_TEMP_STORE '{SQLITE_TEMP_STORE}' must be DEFAULT, FILE or MEMORY")
+    for name in ('SQLITE_MMAP_SIZE', 'SQLITE_CACHE_SIZE_KB', 'SQLITE_BUSY_TIMEOUT_MS'):
+        value = globals()[name]
+        if not isinstance(value, int) or value < 0:
+            problems.append(f"{name} must be a non-negative integer")
+    return problems
+
 # ============== RUNTIME CONFIGURATION ==============
 
 RUNTIME_CONFIG = {
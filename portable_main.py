@@ -7,6 +7,7 @@ import os
 import sys
 import time
 import threading
+import multiprocessing
 import webbrowser
 import logging
 from pathlib import Path
@@ -132,4 +133,6 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # the invoice batch process pool re-launches this executable when frozen
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,106 @@
+"""
+Query-result cache for report aggregates
+crud functions decorated with @cached(tables...) keep their results in memory per database, keyed by
+function name and arguments. Each entry remembers the newest change_log seq of every table it depends
+on, and every read compares that with the database (one index probe per table): a write committed by
+any process, worker or script that goes through the ORM bumps the seq and makes the entry a miss.
+SUMMARY_CACHE_TTL still bounds how long a result can live, covering writes that bypass the change log.
+"""
+import copy
+import threading
+import time
+import weakref
+from collections import OrderedDict, defaultdict
+from functools import wraps
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+import models
+import portable_config
+
+def table_versions(db: Session, tables):
+    """Newest change_log seq of each table (sorted by name; 0 for a table never changed)"""
+    log = models.ChangeLog
+    newest = [select(func.coalesce(func.max(log.seq), 0)).where(log.table_name == table).scalar_subquery()
+              for table in sorted(tables)]
+    return tuple(db.query(*newest).one())
+
+class QueryCache:
+    """LRU of (bind, function, args) -> result, valid while its tables' change_log seqs are unchanged"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._entries = OrderedDict()  # key -> (expires_at, table versions, value)
+        # binds get a small id so entries don't keep engines alive and a new engine never matches an old one
+        self._bind_ids = weakref.WeakKeyDictionary()
+        self._next_bind_id = 0
+        self._lock = threading.Lock()
+
+    def _bind_id(self, bind):
+        with self._lock:
+            if bind not in self._bind_ids:
+                self._next_bind_id += 1
+                self._bind_ids[bind] = self._next_bind_id
+            return self._bind_ids[bind]
+
+    def get_or_compute(self, db: Session, name: str, tables, args: tuple, compute):
+        if self.ttl <= 0 or db.info.get('changed_tables'):
+            # disabled, or the session has uncommitted writes of its own to see
+            return compute()
+        key = (self._bind_id(db.get_bind()), name, args)
+        # read in the same transaction as compute(), so the versions describe the data it sees
+        versions = table_versions(db, tables)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] == versions:
+                self._entries.move_to_end(key)
+                self.hits[name] += 1
+                return copy.deepcopy(entry[2])
+            self.misses[name] += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, versions, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            names = sorted(set(self.hits) | set(self.misses))
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": sum(self.hits.values()),
+                "misses": sum(self.misses.values()),
+                "functions": {name: {"hits": self.hits[name], "misses": self.misses[name]} for name in names},
+            }
+
+cache = QueryCache(portable_config.SUMMARY_CACHE_MAX_ENTRIES, portable_config.SUMMARY_CACHE_TTL)
+
+def cached(*tables):
+    """Cache a crud function f(db, *args, **kwargs) until one of tables changes"""
+    tables = frozenset(tables)
+
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(db: Session, *args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            return cache.get_or_compute(db, fn.__name__, tables, key, lambda: fn(db, *args, **kwargs))
+        return wrapper
+    return decorate
+
+# changelog.py collects the tables a transaction writes in session.info; forget them when it ends
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _transaction_ended(session):
+    session.info.pop('changed_tables', None)
@@ -0,0 +1,106 @@
+"""
+Index advisor: runs the read queries in crud.py, captures the SQL they issue and reports every
+statement whose EXPLAIN QUERY PLAN contains a full-table scan.
+Run from the application root: python query_plans.py
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy import event
+
+import crud, migrations, models
+from database import SessionLocal, engine
+
+# bare "SCAN <table>" means no index is used; "SCAN t USING [COVERING] INDEX" is an ordered index walk
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+SINCE = datetime(2000, 1, 1)
+UNTIL = datetime(2100, 1, 1)
+
+# (name, callable) pairs covering the filtered/ordered read paths in crud.py
+CRUD_QUERIES = [
+    ('get_fabric', lambda db: crud.get_fabric(db, 'type', 'code', 'composition')),
+    ('get_stock_summary', lambda db: crud.get_stock_summary(db)),
+    ('get_available_fabrics', lambda db: crud.get_available_fabrics(db)),
+    ('stock position lookup', lambda db: crud._get_stock_position(db, 1)),
+    ('open FIFO lots', lambda db: crud._open_lots(db, 1).all()),
+    ('compute_stock_summary', lambda db: crud.compute_stock_summary(db)),
+    ('get_fifo_valuation', lambda db: crud.get_fifo_valuation(db)),
+    ('search_fabrics', lambda db: crud.search_fabrics(db, 'cotton lawn')),
+    ('get_purchases', lambda db: crud.get_purchases(db)),
+    ('get_sales', lambda db: crud.get_sales(db)),
+    ('get_purchase_ledger', lambda db: crud.get_purchase_ledger(db, supplier_id=1, date_from=SINCE, date_to=UNTIL)),
+    ('get_sale_ledger', lambda db: crud.get_sale_ledger(db, customer_id=1, date_from=SINCE, date_to=UNTIL)),
+    ('get_customer_ledger_summary', lambda db: crud.get_customer_ledger_summary(db, date_from=SINCE, date_to=UNTIL)),
+    ('get_supplier_ledger_summary', lambda db: crud.get_supplier_ledger_summary(db, date_from=SINCE, date_to=UNTIL)),
+    ('get_payments_for_sale', lambda db: crud.get_payments_for_sale(db, 1)),
+    ('get_pending_payments', lambda db: crud.get_pending_payments(db, customer_id=1)),
+    ('get_pending_payment_totals', lambda db: crud.get_pending_payment_totals(db, customer_id=1)),
+    ('get_customer_credit_summary', lambda db: crud.get_customer_credit_summary(db)),
+    ('get_payment_history', lambda db: crud.get_payment_history(db, date_from=SINCE, date_to=UNTIL)),
+    ('get_payments_for_purchase', lambda db: crud.get_payments_for_purchase(db, 1)),
+    ('get_pending_purchase_payments', lambda db: crud.get_pending_purchase_payments(db, supplier_id=1)),
+    ('get_pending_purchase_payment_totals', lambda db: crud.get_pending_purchase_payment_totals(db, supplier_id=1)),
+    ('get_supplier_credit_summary', lambda db: crud.get_supplier_credit_summary(db)),
+    ('get_purchase_payment_history', lambda db: crud.get_purchase_payment_history(db, date_from=SINCE, date_to=UNTIL)),
+    ('get_bank_statements', lambda db: crud.get_bank_statements(db, bank_account='acct', date_from=SINCE, date_to=UNTIL)),
+    ('get_bank_summary', lambda db: crud.get_bank_summary(db, date_from=SINCE, date_to=UNTIL, bank_account='acct')),
+    ('get_bank_summary (all accounts)', lambda db: crud.get_bank_summary(db, date_from=SINCE, date_to=UNTIL)),
+    ('get_bank_statement_page', lambda db: crud.get_bank_statement_page(db, bank_account='acct')),
+    ('get_bank_reconciliation_status', lambda db: crud.get_bank_reconciliation_status(db, date_from=SINCE, date_to=UNTIL)),
+    ('get_reconciliation_statements', lambda db: crud.get_reconciliation_statements(db, 'pending', date_from=SINCE, date_to=UNTIL)),
+]
+
+
+def audit_query_plans(db, queries=None):
+    """
+    Execute each crud read, then EXPLAIN QUERY PLAN every SELECT it issued.
+    Returns a list of {'name', 'statement', 'plan', 'full_scans'} dicts, one per statement.
+    """
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.append((statement, parameters))
+
+    bind = db.get_bind()
+    results = []
+    for name, fn in (queries or CRUD_QUERIES):
+        captured.clear()
+        event.listen(bind, 'before_cursor_execute', capture)
+        try:
+            fn(db)
+        finally:
+            event.remove(bind, 'before_cursor_execute', capture)
+            db.rollback()
+        raw = db.connection().connection.driver_connection
+        tables = {row[0] for row in raw.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        for statement, parameters in captured:
+            plan = [row[3] for row in raw.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())]
+            scans = [m.group(1) for m in (FULL_SCAN.match(step) for step in plan) if m and m.group(1) in tables]
+            results.append({'name': name, 'statement': statement, 'plan': plan, 'full_scans': scans})
+        db.rollback()
+    return results
+
+
+def main():
+    # audit the schema the app would run with
+    models.Base.metadata.create_all(bind=engine)
+    migrations.run_all(engine)
+    db = SessionLocal()
+    try:
+        results = audit_query_plans(db)
+    finally:
+        db.close()
+    flagged = [r for r in results if r['full_scans']]
+    for r in flagged:
+        print(f"✗ {r['name']}: full scan of {', '.join(r['full_scans'])}")
+        print('    ' + ' '.join(r['statement'].split())[:200])
+        for step in r['plan']:
+            print(f'      {step}')
+    print(f"\nChecked {len(results)} statements from {len(CRUD_QUERIES)} crud queries: {len(flagged)} with full-table scans")
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime
 
@@ -34,6 +34,26 @@ class APIPurchase(PurchaseCreate):
 class APISale(SaleCreate):
     pass
 
+# Bulk import rows (one CSV row or JSON line each)
+class PurchaseImport(PurchaseCreate):
+    quantity_meters: float = Field(gt=0)
+    price_per_meter: float = Field(ge=0)
+    payment_method: str = 'cash'
+    payment_status: str = 'paid'
+    amount_paid: Optional[float] = None
+    date: Optional[datetime] = None
+
+class SaleImport(SaleCreate):
+    company_id: Optional[int] = None
+    quantity_meters: float = Field(gt=0)
+    price_per_meter: float = Field(ge=0)
+    apply_tax: bool = True
+    tax_rate: float = 0.18  # fraction, as stored on the sale
+    payment_method: str = 'cash'
+    payment_status: str = 'paid'
+    amount_paid: Optional[float] = None
+    date: Optional[datetime] = None
+
 # Response schemas (simple)
 class SupplierOut(SupplierCreate):
     supplier_id: int
@@ -0,0 +1,86 @@
+"""
+Benchmark: concurrent read/write throughput with and without the SQLite connection profile
+from portable_config.py (WAL, synchronous, mmap, cache size, temp store, busy timeout).
+One writer thread records purchases through crud while reader threads load the stock page query.
+Run from the application root: python scripts/bench_sqlite_profile.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+import database, models, crud
+
+DURATION = 3.0
+READERS = 4
+
+
+def run(pragmas):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", connect_args={"check_same_thread": False})
+        database.apply_sqlite_profile(engine, pragmas)
+        models.Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        db = Session()
+        supplier = crud.create_supplier(db, 'bench')
+        supplier_id = supplier.supplier_id
+        db.close()
+
+        stop = time.perf_counter() + DURATION
+        counts = {'writes': 0, 'reads': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def bump(key):
+            with lock:
+                counts[key] += 1
+
+        def writer():
+            db = Session()
+            i = 0
+            while time.perf_counter() < stop:
+                try:
+                    crud.create_purchase(db, supplier_id=supplier_id, fabric_type=f'Type{i % 200}',
+                                         quantity_meters=10, price_per_meter=5)
+                    bump('writes')
+                except OperationalError:
+                    db.rollback()
+                    bump('errors')
+                i += 1
+            db.close()
+
+        def reader():
+            db = Session()
+            while time.perf_counter() < stop:
+                try:
+                    crud.get_stock_summary(db)
+                    db.rollback()
+                    bump('reads')
+                except OperationalError:
+                    db.rollback()
+                    bump('errors')
+            db.close()
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(READERS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        engine.dispose()
+        return counts
+
+
+def main():
+    for label, pragmas in (('default (rollback journal)', []), ('portable_config profile', database.sqlite_pragmas())):
+        counts = run(pragmas)
+        print(f"{label:<28} writes/s {counts['writes'] / DURATION:>8.1f}   reads/s {counts['reads'] / DURATION:>8.1f}"
+              f"   lock errors {counts['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: stock summary query count and latency as the number of SKUs grows.
+Compares the per-fabric query loop the app used to run against crud.compute_stock_summary
+(set-based SQL) and crud.get_stock_summary (materialized stock_positions).
+Run from the application root: python scripts/bench_stock_summary.py
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.orm import sessionmaker
+import models, crud, migrations
+
+LOTS_PER_SKU = 3
+
+
+def _fabric_filter(model, fabric_type, fabric_code, composition):
+    """String-key filter the legacy loop used (None matches NULL code/composition)"""
+    return [model.fabric_type == fabric_type, model.fabric_code == fabric_code, model.composition == composition]
+
+
+def legacy_stock_summary(db):
+    """Per-fabric loop: 3 queries per SKU plus 2 DISTINCT scans"""
+    keys = set(db.query(models.Purchase.fabric_type, models.Purchase.fabric_code, models.Purchase.composition).distinct()) | \
+        set(db.query(models.Sale.fabric_type, models.Sale.fabric_code, models.Sale.composition).distinct())
+    result = []
+    for t_type, t_code, t_comp in keys:
+        key = _fabric_filter(models.Purchase, t_type, t_code, t_comp)
+        tp = db.query(func.coalesce(func.sum(models.Purchase.quantity_meters), 0)).filter(*key).scalar()
+        ts = db.query(func.coalesce(func.sum(models.Sale.quantity_meters), 0)).filter(
+            *_fabric_filter(models.Sale, t_type, t_code, t_comp)).scalar()
+        lots = db.query(models.Purchase).filter(*key).order_by(models.Purchase.date.asc()).all()
+        result.append((t_type, tp, ts, len(lots)))
+    return result
+
+
+def seed(db, skus):
+    start = datetime(2024, 1, 1)
+    purchases, sales = [], []
+    for i in range(skus):
+        for lot in range(LOTS_PER_SKU):
+            purchases.append(dict(supplier_id=1, date=start + timedelta(days=lot), fabric_type=f'Type{i % 50}',
+                                  fabric_code=f'C{i}', composition='Cotton', quantity_meters=100.0,
+                                  price_per_meter=10.0 + lot, total_cost=100.0 * (10.0 + lot)))
+        sales.append(dict(customer_id=1, date=start + timedelta(days=LOTS_PER_SKU), fabric_type=f'Type{i % 50}',
+                          fabric_code=f'C{i}', composition='Cotton', quantity_meters=150.0, price_per_meter=20.0,
+                          apply_tax=False, tax=0.0, total_price_with_tax=3000.0))
+    db.add(models.Supplier(name='bench'))
+    db.add(models.Customer(name='bench'))
+    db.bulk_insert_mappings(models.Purchase, purchases)
+    db.bulk_insert_mappings(models.Sale, sales)
+    db.commit()
+    migrations.backfill_fabrics(db.get_bind())
+    crud.rebuild_stock_positions(db)
+
+
+def measure(engine, fn):
+    count = [0]
+
+    def on_execute(*args):
+        count[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    return count[0], elapsed
+
+
+def main():
+    print(f"{'SKUs':>6} | {'legacy loop':>22} | {'set-based SQL':>22} | {'stock_positions':>22}")
+    for skus in (100, 500, 2000):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            models.Base.metadata.create_all(bind=engine)
+            db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+            seed(db, skus)
+            cells = []
+            for fn in (legacy_stock_summary, crud.compute_stock_summary, crud.get_stock_summary):
+                queries, elapsed = measure(engine, lambda: fn(db))
+                cells.append(f"{queries:>6} q {elapsed * 1000:>9.1f} ms")
+            print(f"{skus:>6} | " + ' | '.join(cells))
+            db.close()
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""
+Rebuild the materialized stock_positions, stock_lots and sale_allocations tables from the raw
+purchase and sale ledgers.
+Run from the application root:
+    python scripts/rebuild_stock_positions.py            # rebuild
+    python scripts/rebuild_stock_positions.py --verify   # replay history and report differences only
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import SessionLocal, engine
+import models, crud
+
+models.Base.metadata.create_all(bind=engine)
+
+db = SessionLocal()
+try:
+    if '--verify' in sys.argv[1:]:
+        problems = crud.verify_stock_positions(db) + crud.verify_fifo_allocations(db)
+        for problem in problems:
+            print(f'✗ {problem}')
+        print('✓ Stock positions and FIFO allocations consistent' if not problems else f'✗ {len(problems)} mismatches found')
+        sys.exit(1 if problems else 0)
+    count = crud.rebuild_stock_positions(db)
+    print(f'✓ Rebuilt {count} stock positions')
+finally:
+    db.close()
@@ -10,13 +10,19 @@ async function attachTypeahead(inputSelector, hiddenFields){
   input.parentNode.appendChild(list);
 
   let timer;
+  const seen = new Map();  // query -> results, so retyping or backspacing doesn't refetch
   input.addEventListener('input', (e)=>{
     clearTimeout(timer);
-    const q = e.target.value;
+    const q = e.target.value.trim().toLowerCase();
     timer = setTimeout(async ()=>{
       if(!q) { list.style.display='none'; return; }
-      const res = await fetch('/api/fabrics?q='+encodeURIComponent(q));
-      const items = await res.json();
+      let items = seen.get(q);
+      if(!items){
+        const res = await fetch('/api/fabrics?limit=20&q='+encodeURIComponent(q));
+        items = await res.json();
+        seen.set(q, items);
+      }
+      if(q !== input.value.trim().toLowerCase()) return;  // a newer keystroke owns the list
       list.innerHTML = '';
       if(items.length===0){ list.style.display='none'; return; }
       items.forEach(item=>{
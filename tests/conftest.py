@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+
+
+@pytest.fixture
+def engine():
+    """Fresh in-memory database with the full schema"""
+    engine = create_engine('sqlite://', connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    """Session on the engine fixture's database"""
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def fabric_search(engine):
+    """Set up the fabric search index on the engine fixture's database"""
+    import migrations
+
+    assert migrations.ensure_fabric_search(engine)
+
+
+@pytest.fixture
+def app_db(monkeypatch):
+    """
+    Point main.app (requests and streamed exports) at a fresh in-memory database.
+    Yields (client, session, engine).
+    """
+    from fastapi.testclient import TestClient
+    import main, exports
+
+    # one shared connection: TestClient serves requests from another thread
+    engine = create_engine('sqlite://', connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_db] = get_db
+    monkeypatch.setattr(exports, 'SessionLocal', Session)
+    db = Session()
+    try:
+        yield TestClient(main.app), db, engine
+    finally:
+        db.close()
+        main.app.dependency_overrides.pop(main.get_db, None)
+
+
+@pytest.fixture
+def max_queries():
+    """with max_queries(engine, n): ... fails if the block runs more than n statements on engine"""
+    @contextmanager
+    def check(engine, limit):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        assert len(statements) <= limit, f"{len(statements)} queries (limit {limit}):\n" + "\n".join(statements)
+
+    return check
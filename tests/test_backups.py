@@ -0,0 +1,150 @@
+import gzip
+import os
+import sqlite3
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import backups, crud, database, main, models
+
+
+def load(image, tmp_path):
+    path = tmp_path / 'export.db'
+    path.write_bytes(image)
+    return sqlite3.connect(path)
+
+
+def test_export_streams_an_online_backup(app_db, tmp_path, monkeypatch):
+    client, db, engine = app_db
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    monkeypatch.setattr(backups, '_database_dir', lambda engine: str(staging))
+    crud.create_customer(db, 'Cust One')
+
+    r = client.get('/database/export')
+    assert r.status_code == 200
+    assert 'fabric_backup_' in r.headers['content-disposition']
+    copy = load(r.content, tmp_path)
+    assert copy.execute('SELECT name FROM customers').fetchall() == [('Cust One',)]
+    assert copy.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    copy.close()
+
+    packed = client.get('/database/export?compress=true&check=full')
+    assert packed.headers['content-type'] == 'application/gzip'
+    assert gzip.decompress(packed.content) == r.content
+    assert client.get('/database/export?check=slow').status_code == 400
+    # snapshots are staged on disk and removed once streamed
+    assert list(staging.iterdir()) == []
+
+
+def file_engine(path):
+    engine = create_engine(f'sqlite:///{path}', connect_args={"check_same_thread": False})
+    database.apply_sqlite_profile(engine, database.sqlite_pragmas())
+    models.Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def test_import_replaces_the_live_database_and_keeps_a_backup(tmp_path):
+    upload = file_engine(tmp_path / 'upload.db')
+    with sessionmaker(bind=upload)() as db:
+        crud.create_customer(db, 'Imported')
+    upload.dispose()
+
+    live = file_engine(tmp_path / 'live.db')
+    Session = sessionmaker(bind=live)
+    with Session() as db:
+        crud.create_customer(db, 'Old')
+
+    def get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_db] = get_db
+    try:
+        client = TestClient(main.app)
+        image = (tmp_path / 'upload.db').read_bytes()
+        r = client.post('/database/import', files={'file': ('upload.db', image, 'application/octet-stream')})
+        assert r.status_code == 200
+        with Session() as db:
+            assert [c.name for c in db.query(models.Customer)] == ['Imported']
+        (backup,) = tmp_path.glob('fabric_backup_before_import_*.db')
+        with sqlite3.connect(backup) as conn:
+            assert conn.execute('SELECT name FROM customers').fetchall() == [('Old',)]
+
+        assert client.post('/database/import', files={'file': ('x.db', b'not a database', 'application/octet-stream')}).status_code == 400
+        bare = sqlite3.connect(tmp_path / 'bare.db')
+        bare.execute('CREATE TABLE customers (id INTEGER)')
+        bare.close()
+        r = client.post('/database/import', files={'file': ('bare.db', (tmp_path / 'bare.db').read_bytes(), 'application/octet-stream')})
+        assert r.status_code == 400
+        assert 'missing required tables' in r.json()['detail']
+        with Session() as db:
+            assert db.query(models.Customer).count() == 1
+    finally:
+        main.app.dependency_overrides.pop(main.get_db, None)
+        live.dispose()
+
+
+def test_scheduler_writes_compressed_backups_and_keeps_history(tmp_path, monkeypatch):
+    live = file_engine(tmp_path / 'live.db')
+    with sessionmaker(bind=live)() as db:
+        crud.create_customer(db, 'Cust One')
+    directory = str(tmp_path / 'backups')
+    scheduler = backups.BackupScheduler(live, directory, interval=3600, history=2, on_startup=True)
+    scheduler.start()
+    for _ in range(100):
+        if scheduler.last:
+            break
+        time.sleep(0.05)
+    scheduler.stop()
+    assert 'error' not in scheduler.last
+    # the next timed run is counted from the backup just written
+    assert scheduler.status()['next_run_at'] is None
+    assert scheduler._seconds_until_due() > 3500
+
+    for _ in range(2):
+        scheduler.run_now()
+    status = scheduler.status()
+    assert len(status['backups']) == 2
+    assert status['last']['pruned'] == 1
+    assert status['last']['bytes'] == status['backups'][0]['bytes']
+    newest = tmp_path / 'backups' / status['backups'][0]['file']
+    (tmp_path / 'restored.db').write_bytes(gzip.decompress(newest.read_bytes()))
+    with sqlite3.connect(tmp_path / 'restored.db') as conn:
+        assert conn.execute('SELECT name FROM customers').fetchall() == [('Cust One',)]
+    live.dispose()
+
+
+def test_only_one_process_runs_the_scheduler_and_pruning_tolerates_races(tmp_path, monkeypatch):
+    live = file_engine(tmp_path / 'live.db')
+    directory = str(tmp_path / 'backups')
+    # each worker process has its own scheduler; flock is per open file, so two here stand in for two workers
+    first, second = (backups.BackupScheduler(live, directory, interval=3600, history=1) for _ in range(2))
+    first.start()
+    second.start()
+    try:
+        assert first._thread is not None and second._thread is None
+        first.stop()
+        second.start()
+        assert second._thread is not None
+    finally:
+        first.stop()
+        second.stop()
+
+    written = [backups.write_backup(live, directory) for _ in range(2)]
+    gone = written[0] + '.gone'
+    monkeypatch.setattr(backups, 'scheduled_backups', lambda directory: [gone] + written)
+    assert backups.prune_backups(directory, 1) == [written[0]]
+    assert [entry['file'] for entry in first.status()['backups']] == [os.path.basename(written[1])]
+    live.dispose()
+
+
+def test_backup_status_endpoint(app_db):
+    client, db, engine = app_db
+    status = client.get('/api/backups/status').json()
+    assert {'enabled', 'running', 'history', 'last', 'backups'} <= status.keys()
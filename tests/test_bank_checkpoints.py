@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models, crud
+
+
+def naive_summary(db, date_from, date_to, bank_account=None):
+    rows = [s for s in crud.get_bank_statements(db, bank_account=bank_account)]
+    opening = sum(s.amount if s.transaction_type == 'credit' else -s.amount
+                  for s in rows if s.transaction_date.date() < date_from.date())
+    period = [s for s in rows if date_from.date() <= s.transaction_date.date() <= date_to.date()]
+    credit = sum(s.amount for s in period if s.transaction_type == 'credit')
+    debit = sum(s.amount for s in period if s.transaction_type == 'debit')
+    return round(opening, 2), round(credit, 2), round(debit, 2), len(period)
+
+
+def test_checkpoints_track_statement_writes(db):
+    entries = [
+        ('credit', 100, 'A', datetime(2024, 1, 5)),
+        ('debit', 30, 'A', datetime(2024, 1, 31, 23, 0)),
+        ('credit', 50, 'B', datetime(2024, 2, 10)),
+        ('debit', 20, 'A', datetime(2024, 3, 1)),
+        ('credit', 70, 'A', datetime(2024, 3, 15)),
+        ('credit', 5, None, datetime(2024, 4, 2)),
+    ]
+    ids = []
+    for kind, amount, account, when in entries:
+        s = crud.add_bank_statement(db, transaction_type=kind, amount=amount, description='x', bank_account=account)
+        crud.update_bank_statement(db, s.statement_id, transaction_date=when)
+        ids.append(s.statement_id)
+    crud.update_bank_statement(db, ids[4], amount=75)
+    crud.delete_bank_statement(db, ids[2])
+    assert crud.verify_bank_checkpoints(db) == []
+
+    for date_from, date_to, account in [
+        (datetime(2024, 1, 10), datetime(2024, 3, 10), None),
+        (datetime(2024, 2, 1), datetime(2024, 3, 31), 'A'),
+        (datetime(2024, 3, 1), datetime(2024, 3, 1), 'A'),
+    ]:
+        summary = crud.get_bank_summary(db, date_from=date_from, date_to=date_to, bank_account=account)
+        opening, credit, debit, count = naive_summary(db, date_from, date_to, account)
+        assert (summary['opening_balance'], summary['total_credit'], summary['total_debit'],
+                summary['transaction_count']) == (opening, credit, debit, count)
+        assert summary['closing_balance'] == round(opening + credit - debit, 2)
+
+    before = crud.get_bank_summary(db, date_from=datetime(2024, 2, 15), date_to=datetime(2024, 4, 30))
+    crud.rebuild_bank_checkpoints(db)
+    assert crud.get_bank_summary(db, date_from=datetime(2024, 2, 15), date_to=datetime(2024, 4, 30)) == before
+
+
+def test_reconciliation_groups_by_status_and_pages_one_status(db, max_queries):
+    for kind, amount, status in [('credit', 10, 'pending'), ('debit', 4, 'pending'), ('credit', 7, 'cleared'),
+                                 ('debit', 2, 'cleared'), ('credit', 1, 'failed'), ('credit', 3, 'pending')]:
+        crud.add_bank_statement(db, transaction_type=kind, amount=amount, description='x', status=status)
+
+    with max_queries(db.get_bind(), 1):
+        status = crud.get_bank_reconciliation_status(db)
+    assert (status['pending_count'], status['cleared_count'], status['failed_count']) == (3, 2, 1)
+    assert (status['pending_credits'], status['pending_debits'], status['total_pending']) == (13, 4, 9)
+    assert (status['cleared_credits'], status['cleared_debits']) == (7, 2)
+
+    page = crud.get_reconciliation_statements(db, 'pending', limit=2)
+    assert [s.amount for s in page['rows']] == [3, 4] and page['next_cursor']
+
+
+def test_bank_accounts_cache_balance_and_last_date(db):
+    first = crud.add_bank_statement(db, transaction_type='credit', amount=100, description='x', bank_account='A')
+    crud.update_bank_statement(db, first.statement_id, transaction_date=datetime(2024, 1, 1))
+    second = crud.add_bank_statement(db, transaction_type='debit', amount=40, description='x', bank_account='A')
+    crud.update_bank_statement(db, second.statement_id, transaction_date=datetime(2024, 2, 1))
+    crud.add_bank_statement(db, transaction_type='credit', amount=5, description='x', bank_account='B')
+    assert crud.get_bank_account_names(db) == ['A', 'B']
+
+    account = crud.get_bank_accounts(db)[0]
+    assert (account.current_balance, account.transaction_count) == (60, 2)
+    assert account.last_transaction_date == datetime(2024, 2, 1)
+
+    crud.delete_bank_statement(db, second.statement_id)
+    crud.update_bank_statement(db, first.statement_id, bank_account='B')
+    a, b = crud.get_bank_accounts(db)
+    assert (a.current_balance, a.transaction_count, a.last_transaction_date) == (0, 0, None)
+    assert (b.current_balance, b.transaction_count) == (105, 2)
+    assert crud.verify_bank_checkpoints(db) == []
+
+
+def test_concurrent_statement_writes_keep_checkpoints_and_accounts(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fabric.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    first, second = Session(), Session()
+    statement_id = crud.add_bank_statement(first, transaction_type='credit', amount=100, description='x',
+                                           bank_account='A').statement_id
+
+    # the first session has read the statement, its account and checkpoint; the second then edits
+    # that statement and adds another before the first one writes
+    stale = (first.get(models.BankStatement, statement_id), crud.get_bank_accounts(first),
+             first.query(models.BankBalanceCheckpoint).all())
+    crud.update_bank_statement(second, statement_id, amount=150)
+    crud.add_bank_statement(second, transaction_type='credit', amount=20, description='x', bank_account='A')
+    crud.add_bank_statement(first, transaction_type='debit', amount=30, description='x', bank_account='A')
+    crud.update_bank_statement(first, statement_id, amount=200)
+
+    account = crud.get_bank_accounts(second)[0]
+    assert (account.current_balance, account.transaction_count) == (190, 3)
+    assert crud.verify_bank_checkpoints(second) == []
+    assert stale[1][0].current_balance == 190
+    first.close()
+    second.close()
+    engine.dispose()
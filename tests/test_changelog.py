@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import changelog, crud, models, query_cache
+
+
+def test_writes_are_logged_in_order_and_paged_by_seq(app_db):
+    client, db, engine = app_db
+    s = crud.create_supplier(db, 'sup')
+    c = crud.create_customer(db, 'cust')
+    p = crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Lawn', quantity_meters=10, price_per_meter=2)
+    sale = crud.create_sale(db, company_id=None, customer_id=c.customer_id, fabric_type='Lawn',
+                            quantity_meters=4, price_per_meter=5, payment_status='pending')
+    first = client.get('/api/changes').json()
+    seen = [(ch['table'], ch['operation']) for ch in first['changes']]
+    assert seen[:2] == [('suppliers', 'insert'), ('customers', 'insert')]
+    assert ('purchases', 'insert') in seen and ('sales', 'insert') in seen
+    # derived tables are left out
+    assert not {'stock_positions', 'stock_lots', 'sale_allocations'} & {table for table, _ in seen}
+
+    crud.add_payment(db, sale.sale_id, 5)
+    db.query(models.Customer).filter_by(customer_id=c.customer_id).one().contact = 'x'
+    db.rollback()
+    later = client.get(f"/api/changes?since={first['last_seq']}").json()
+    assert [(ch['table'], ch['operation']) for ch in later['changes']] == [('payments', 'insert'), ('sales', 'update')]
+    assert 'amount_paid' in later['changes'][1]['columns']
+    assert later['changes'][1]['row_id'] == sale.sale_id
+
+    page = client.get('/api/changes?limit=2').json()
+    assert page['has_more'] and page['last_seq'] == first['changes'][1]['seq']
+    assert client.get('/api/changes?table=purchases').json()['changes'][0]['row_id'] == p.purchase_id
+    assert client.get('/api/changes?limit=0').status_code == 400
+
+
+def test_batched_imports_are_logged(app_db):
+    client, db, engine = app_db
+    s = crud.create_supplier(db, 'sup')
+    csv_text = 'supplier_id,fabric_type,quantity_meters,price_per_meter\n' + f'{s.supplier_id},Silk,5,2\n' * 3
+    client.post('/api/import/purchases', files={'file': ('p.csv', csv_text, 'text/csv')})
+    logged = client.get('/api/changes?table=purchases').json()['changes']
+    assert [ch['row_id'] for ch in logged] == [p.purchase_id for p in db.query(models.Purchase).order_by(models.Purchase.purchase_id)]
+
+
+def test_old_changes_are_pruned_but_each_tables_newest_is_kept(db):
+    s = crud.create_supplier(db, 'sup')
+    crud.create_customer(db, 'one')
+    crud.create_customer(db, 'two')
+    versions = query_cache.table_versions(db, ['customers', 'suppliers'])
+    db.query(models.ChangeLog).update({models.ChangeLog.changed_at: datetime.utcnow() - timedelta(days=100)})
+    three = crud.create_customer(db, 'three')
+    db.commit()
+
+    assert changelog.prune_changes(db, 0) == 0
+    assert changelog.prune_changes(db, 90) == 2
+    kept = [(row.table_name, row.row_id) for row in db.query(models.ChangeLog).order_by(models.ChangeLog.seq)]
+    # the old supplier insert is still its table's newest change; the old customer inserts are not
+    assert kept == [('suppliers', s.supplier_id), ('customers', three.customer_id)]
+    assert query_cache.table_versions(db, ['suppliers'])[0] == versions[1]
+    assert changelog.prune_changes(db, 90) == 0
@@ -0,0 +1,32 @@
+import csv
+import io
+import zlib
+
+from sqlalchemy.orm import sessionmaker
+
+import models, crud, exports
+
+
+def test_csv_streams_in_chunks_with_running_totals(db):
+    s = crud.create_supplier(db, 'sup')
+    for i in range(25):
+        crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Lawn', quantity_meters=2, price_per_meter=3)
+
+    chunks = list(exports.iter_csv(
+        lambda session: session.query(models.Purchase.purchase_id, models.Purchase.quantity_meters,
+                                      models.Purchase.total_cost).order_by(models.Purchase.purchase_id),
+        ['id', 'qty', 'cost'],
+        lambda p: [p.purchase_id, p.quantity_meters, p.total_cost],
+        totals={'qty': lambda p: p.quantity_meters, 'cost': lambda p: p.total_cost},
+        summary_rows=lambda session, t: [['TOTAL', t['qty'], t['cost']]],
+        chunk_rows=10,
+        session_factory=sessionmaker(bind=db.get_bind()),
+    ))
+    assert len(chunks) == 3
+
+    rows = list(csv.reader(io.StringIO(b''.join(chunks).decode('utf-8'))))
+    assert rows[0] == ['id', 'qty', 'cost']
+    assert len(rows) == 1 + 25 + 2
+    assert rows[-1] == ['TOTAL', '50.0', '150.0']
+
+    assert zlib.decompress(b''.join(exports.gzip_chunks(iter(chunks))), 31) == b''.join(chunks)
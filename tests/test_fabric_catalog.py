@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import models, crud, migrations
+
+
+def test_fabric_keys_resolve_to_one_catalog_row(db):
+    s = crud.create_supplier(db, 'sup')
+    c = crud.create_customer(db, 'cust')
+    first = crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Lawn', fabric_code='L1',
+                                 quantity_meters=10, price_per_meter=5)
+    second = crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type=' lawn', fabric_code='l1',
+                                  composition='', quantity_meters=5, price_per_meter=5)
+    assert first.fabric_id == second.fabric_id
+    assert (second.fabric_type, second.fabric_code, second.composition) == ('Lawn', 'L1', None)
+
+    sale = crud.create_sale(db, company_id=None, customer_id=c.customer_id, fabric_type=None,
+                            quantity_meters=12, price_per_meter=9, fabric_id=first.fabric_id)
+    assert sale.fabric_id == first.fabric_id
+    with pytest.raises(ValueError, match='^Unknown fabric_id 999$'):
+        crud.create_sale(db, company_id=None, customer_id=c.customer_id, fabric_type=None,
+                         quantity_meters=1, price_per_meter=9, fabric_id=999)
+    assert [(f['fabric_id'], f['balance_in_meters']) for f in crud.get_available_fabrics(db)] == [(first.fabric_id, 3)]
+    assert [f.fabric_type for f in crud.get_fabrics(db)] == ['Lawn']
+
+
+def test_backfill_deduplicates_keys_and_rebuilds_positions(engine):
+    # rows written before the catalog existed: fabric_id unset, keys spelled inconsistently
+    db = sessionmaker(bind=engine)()
+    s = crud.create_supplier(db, 'sup')
+    c = crud.create_customer(db, 'cust')
+    for day, (fabric_type, code) in enumerate([('Lawn', 'L1'), ('lawn ', 'l1'), ('Silk', '')], 1):
+        db.add(models.Purchase(supplier_id=s.supplier_id, date=datetime(2024, 1, day), fabric_type=fabric_type,
+                               fabric_code=code, quantity_meters=10, price_per_meter=day, total_cost=10 * day))
+    db.add(models.Sale(customer_id=c.customer_id, date=datetime(2024, 2, 1), fabric_type='LAWN', fabric_code='L1',
+                       quantity_meters=15, price_per_meter=9, tax=0, total_price_with_tax=135))
+    db.commit()
+
+    changes = migrations.run_all(engine)
+    assert 'linked 4 purchases and sales to fabrics' in changes
+    assert 'rebuilt 2 stock positions' in changes
+    assert migrations.run_all(engine) == []
+
+    db.expire_all()
+    assert sorted((f.fabric_type, f.fabric_code) for f in crud.get_fabrics(db)) == [('Lawn', 'L1'), ('Silk', None)]
+    stock = {r['fabric_type']: r for r in crud.get_stock_summary(db)}
+    assert stock['Lawn']['balance_in_meters'] == 5
+    assert stock['Lawn']['stock_valuation'] == 10.0  # 5m left of the 2/m lot
+    assert crud.verify_stock_positions(db) == []
+    assert crud.verify_fifo_allocations(db) == []
@@ -0,0 +1,53 @@
+import crud
+
+
+def buy(db, supplier_id, fabric_type, fabric_code=None, composition=None):
+    crud.create_purchase(db, supplier_id=supplier_id, fabric_type=fabric_type, fabric_code=fabric_code,
+                         composition=composition, quantity_meters=1, price_per_meter=1)
+
+
+def test_search_index_follows_purchases_and_ranks_prefix_hits_first(db, fabric_search):
+    s = crud.create_supplier(db, 'sup')
+    buy(db, s.supplier_id, 'Printed Lawn', 'PL-1', 'Cotton')
+    buy(db, s.supplier_id, 'Lawn', 'L-7', 'Cotton Blend')
+    buy(db, s.supplier_id, 'Silk', 'S-1', 'Mulberry')
+    buy(db, s.supplier_id, 'Lawn', 'L-7', 'Cotton Blend')  # same fabric again: still one entry
+
+    names = lambda rows: [(r['fabric_type'], r['fabric_code']) for r in rows]
+    assert names(crud.search_fabrics(db, 'lawn')) == [('Lawn', 'L-7'), ('Printed Lawn', 'PL-1')]
+    assert names(crud.search_fabrics(db, 'otto l-7')) == [('Lawn', 'L-7')]
+    assert names(crud.search_fabrics(db, 'lber')) == [('Silk', 'S-1')]
+    assert names(crud.search_fabrics(db, 'si')) == [('Silk', 'S-1')]
+    assert len(crud.search_fabrics(db, None, limit=2)) == 2
+
+    crud.rebuild_stock_positions(db)
+    assert names(crud.search_fabrics(db, 'mulberry')) == [('Silk', 'S-1')]
+
+
+def test_search_ranks_by_relevance_and_falls_back_to_fuzzy_matches(db, fabric_search, max_queries):
+    s = crud.create_supplier(db, 'sup')
+    buy(db, s.supplier_id, 'Lawn', 'L-7', 'Cotton Blend')
+    buy(db, s.supplier_id, 'Voile Cotton', 'VC-2', 'Cotton')
+    buy(db, s.supplier_id, 'Silk', 'S-1', 'Mulberry')
+
+    names = lambda rows: [(r['fabric_type'], r['fabric_code']) for r in rows]
+    # no prefix hit: a match in fabric_type outranks one in composition
+    with max_queries(db.get_bind(), 1):
+        assert names(crud.search_fabrics(db, 'otto')) == [('Voile Cotton', 'VC-2'), ('Lawn', 'L-7')]
+    assert names(crud.search_fabrics(db, 'mulbery')) == [('Silk', 'S-1')]
+    assert names(crud.search_fabrics(db, 'voiel')) == [('Voile Cotton', 'VC-2')]
+    assert crud.search_fabrics(db, 'xyz') == []
+
+
+def test_api_fabrics_revalidates_with_etag(app_db):
+    client, db, engine = app_db
+    s = crud.create_supplier(db, 'sup')
+    buy(db, s.supplier_id, 'Lawn')
+
+    first = client.get('/api/fabrics?q=law')
+    assert first.json() == [{'fabric_type': 'Lawn', 'fabric_code': None, 'composition': None}]
+    assert 'max-age' in first.headers['cache-control']
+    assert client.get('/api/fabrics?q=law', headers={'If-None-Match': first.headers['etag']}).status_code == 304
+
+    buy(db, s.supplier_id, 'Lawn Deluxe')
+    assert client.get('/api/fabrics?q=law', headers={'If-None-Match': first.headers['etag']}).status_code == 200
@@ -0,0 +1,97 @@
+import json
+
+import crud
+
+
+def setup_parties(db):
+    return crud.create_supplier(db, 'sup'), crud.create_customer(db, 'cust'), crud.create_company(db, 'Co')
+
+
+def test_csv_purchases_import_in_batches_and_report_bad_rows(app_db):
+    client, db, engine = app_db
+    s, c, co = setup_parties(db)
+    lines = ['supplier_id,fabric_type,fabric_code,quantity_meters,price_per_meter,payment_status,amount_paid']
+    lines += [f'{s.supplier_id},Lawn,L1,10,{price},,' for price in range(1, 6)]
+    lines += ['999,Lawn,L1,10,1,,', f'{s.supplier_id},Lawn,L1,-3,1,,', f'{s.supplier_id},Silk,,4,5,partial,20']
+    r = client.post('/api/import/purchases?batch_size=2',
+                    files={'file': ('purchases.csv', '\n'.join(lines), 'text/csv')})
+    assert r.status_code == 200
+    body = r.json()
+    assert (body['imported'], body['rejected']) == (5, 3)
+    assert [e['row'] for e in body['errors']] == [7, 8, 9]
+    assert 'Unknown supplier_id' in body['errors'][0]['error']
+    assert body['errors'][1]['error'].startswith('quantity_meters')
+
+    db.expire_all()
+    stock = {row['fabric_type']: row for row in crud.get_stock_summary(db)}
+    assert stock['Lawn']['balance_in_meters'] == 50
+    assert stock['Lawn']['stock_valuation'] == 150
+    assert crud.verify_stock_positions(db) == []
+    assert crud.verify_fifo_allocations(db) == []
+
+
+def test_jsonl_sales_check_stock_against_running_balance(app_db):
+    client, db, engine = app_db
+    s, c, co = setup_parties(db)
+    crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Denim', quantity_meters=5, price_per_meter=4)
+    crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Denim', quantity_meters=5, price_per_meter=6)
+    rows = [{'customer_id': c.customer_id, 'company_id': co.company_id, 'fabric_type': 'denim',
+             'quantity_meters': qty, 'price_per_meter': 10} for qty in (4, 4, 4, 2)]
+    payload = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+    r = client.post('/api/import/sales', files={'file': ('sales.jsonl', payload, 'application/x-ndjson')})
+    body = r.json()
+    assert (body['imported'], body['rejected']) == (3, 2)
+    assert body['errors'][0] == {'row': 3, 'error': 'Insufficient stock for denim. Available: 2.0'}
+    assert body['errors'][1]['row'] == 5
+
+    db.expire_all()
+    (denim,) = crud.get_stock_summary(db)
+    assert (denim['balance_in_meters'], denim['stock_valuation']) == (0, 0)
+    assert crud.verify_fifo_allocations(db) == []
+    assert crud.verify_stock_positions(db) == []
+
+
+def test_backdated_rows_rebuild_fifo_state(app_db):
+    client, db, engine = app_db
+    s, c, co = setup_parties(db)
+    crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Silk', quantity_meters=5, price_per_meter=9)
+    csv_text = f'supplier_id,fabric_type,quantity_meters,price_per_meter,date\n{s.supplier_id},Silk,5,2,2020-01-01T00:00:00\n'
+    r = client.post('/api/import/purchases', files={'file': ('old.csv', csv_text, 'text/csv')})
+    assert r.json()['imported'] == 1
+    crud.create_sale(db, company_id=None, customer_id=c.customer_id, fabric_type='Silk', quantity_meters=5,
+                     price_per_meter=10)
+    # the 2020 lot is the oldest, so the sale consumed it
+    assert crud.verify_fifo_allocations(db) == []
+    assert crud.get_stock_summary(db)[0]['stock_valuation'] == 45
+
+
+def test_upload_without_required_columns_is_rejected(app_db):
+    client, db, engine = app_db
+    r = client.post('/api/import/sales', files={'file': ('sales.csv', 'fabric_type,quantity_meters\nLawn,1\n', 'text/csv')})
+    assert r.status_code == 400
+    assert 'customer_id' in r.json()['detail']
+    r = client.post('/api/import/sales', files={'file': ('sales.xlsx', b'PK', 'application/octet-stream')})
+    assert r.status_code == 400
+
+
+def test_sales_only_take_stock_dated_before_them(app_db):
+    client, db, engine = app_db
+    s, c, co = setup_parties(db)
+    csv_text = f'supplier_id,fabric_type,quantity_meters,price_per_meter,date\n{s.supplier_id},Silk,5,10,2020-01-01T00:00:00\n'
+    client.post('/api/import/purchases', files={'file': ('p.csv', csv_text, 'text/csv')})
+    header = 'customer_id,fabric_type,quantity_meters,price_per_meter,date\n'
+    rows = [('2019-01-01', 2), ('2021-01-01', 2), ('2020-06-01', 1), ('2099-01-01', 1)]
+    csv_text = header + ''.join(f'{c.customer_id},Silk,{qty},20,{day}T00:00:00\n' for day, qty in rows)
+    body = client.post('/api/import/sales', files={'file': ('s.csv', csv_text, 'text/csv')}).json()
+    assert body['imported'] == 1
+    assert [e['row'] for e in body['errors']] == [2, 4, 5]
+    assert body['errors'][0]['error'] == 'Insufficient stock for Silk. Available: 0'
+    assert 'before the latest recorded sale' in body['errors'][1]['error']
+    assert 'in the future' in body['errors'][2]['error']
+
+    db.expire_all()
+    (silk,) = crud.get_stock_summary(db)
+    assert (silk['balance_in_meters'], silk['stock_valuation']) == (3, 30)
+    assert crud.get_fifo_valuation(db)[0]['total_valuation'] == 30
+    assert crud.verify_stock_positions(db) == []
+    assert crud.verify_fifo_allocations(db) == []
@@ -0,0 +1,51 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import models, migrations, query_plans
+
+
+def test_ensure_indexes_restores_missing_indexes(engine):
+    with engine.begin() as conn:
+        conn.execute(text('DROP INDEX ix_sales_fabric_date'))
+        conn.execute(text('DROP INDEX ix_bank_statements_account_date'))
+    assert sorted(migrations.ensure_indexes(engine)) == ['ix_bank_statements_account_date', 'ix_sales_fabric_date']
+    assert migrations.ensure_indexes(engine) == []
+
+
+def test_crud_queries_avoid_full_table_scans(db, fabric_search):
+    results = query_plans.audit_query_plans(db)
+    assert results
+    assert [(r['name'], r['full_scans']) for r in results if r['full_scans']] == []
+
+
+def test_run_all_adds_bank_account_column_and_backfills_accounts():
+    # a database from before bank_accounts: bank_statements without bank_account_id
+    engine = create_engine('sqlite://', connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine, tables=[
+        table for table in models.Base.metadata.sorted_tables if table.name != 'bank_statements'
+    ])
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE bank_statements (statement_id INTEGER PRIMARY KEY, transaction_date DATETIME, "
+            "transaction_type VARCHAR NOT NULL, amount FLOAT NOT NULL, description VARCHAR NOT NULL, "
+            "bank_account VARCHAR, reference_number VARCHAR, related_sale_id INTEGER, related_purchase_id INTEGER, "
+            "payment_method VARCHAR, status VARCHAR NOT NULL, reconciliation_notes VARCHAR, recorded_by VARCHAR, "
+            "created_at DATETIME)"
+        ))
+        for kind, amount, account, day in [('credit', 100, 'A', 1), ('debit', 30, 'A', 2), ('credit', 5, 'B', 3),
+                                           ('credit', 1, None, 4)]:
+            conn.execute(text(
+                "INSERT INTO bank_statements (transaction_date, transaction_type, amount, description, bank_account, status) "
+                "VALUES (:date, :kind, :amount, 'x', :account, 'cleared')"
+            ), {'date': f'2024-01-0{day} 00:00:00.000000', 'kind': kind, 'amount': amount, 'account': account})
+
+    changes = migrations.run_all(engine)
+    assert 'added column bank_statements.bank_account_id' in changes
+    assert 'linked 3 bank statements to bank_accounts' in changes
+    assert migrations.run_all(engine) == []
+
+    db = sessionmaker(bind=engine)()
+    accounts = {a.name: a for a in db.query(models.BankAccount)}
+    assert sorted(accounts) == ['A', 'B']
+    assert (accounts['A'].current_balance, accounts['A'].transaction_count) == (70, 2)
+    assert str(accounts['A'].last_transaction_date) == '2024-01-02 00:00:00'
@@ -0,0 +1,176 @@
+import asyncio
+import concurrent.futures
+import io
+import re
+import time
+import zipfile
+
+import pytest
+
+import crud, invoices
+
+
+def make_sale(db):
+    s = crud.create_supplier(db, 'sup')
+    c = crud.create_customer(db, 'Cust One')
+    co = crud.create_company(db, 'Co')
+    crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Lawn', quantity_meters=10, price_per_meter=2)
+    return crud.create_sale(db, company_id=co.company_id, customer_id=c.customer_id, fabric_type='Lawn',
+                            quantity_meters=4, price_per_meter=5, payment_status='pending')
+
+
+def test_invoice_is_rendered_once_and_revalidated_by_etag(app_db, monkeypatch, tmp_path):
+    client, db, engine = app_db
+    cache = invoices.InvoiceCache(str(tmp_path), 1024 * 1024)
+    monkeypatch.setattr(invoices, 'invoice_cache', cache)
+    sale = make_sale(db)
+
+    first = client.get(f'/invoice/{sale.sale_id}')
+    assert first.status_code == 200
+    assert first.content.startswith(b'%PDF')
+    assert 'Invoice_000001_Cust_One.pdf' in first.headers['content-disposition']
+    etag = first.headers['etag']
+
+    assert client.get(f'/invoice/{sale.sale_id}', headers={'If-None-Match': etag}).status_code == 304
+    again = client.get(f'/invoice/{sale.sale_id}')
+    assert again.content == first.content
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a payment changes the snapshot: new ETag, fresh render, old version dropped from disk
+    crud.add_payment(db, sale.sale_id, 5)
+    changed = client.get(f'/invoice/{sale.sale_id}', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['etag'] != etag
+    assert cache.stats()['entries'] == 1
+    assert client.get('/invoice/999').status_code == 404
+
+
+def test_invoice_cache_files_are_handled_off_the_event_loop(app_db, monkeypatch, tmp_path):
+    client, db, engine = app_db
+    calls = []
+
+    def on_event_loop():
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    class RecordingCache(invoices.InvoiceCache):
+        def get(self, key):
+            calls.append(('get', on_event_loop()))
+            return super().get(key)
+
+        def put(self, key, data):
+            calls.append(('put', on_event_loop()))
+            super().put(key, data)
+
+    monkeypatch.setattr(invoices, 'invoice_cache', RecordingCache(str(tmp_path), 1024 * 1024))
+    sale = make_sale(db)
+    assert client.get(f'/invoice/{sale.sale_id}').status_code == 200
+    assert client.get(f'/invoice/{sale.sale_id}').status_code == 200
+    assert calls == [('get', False), ('put', False), ('get', False)]
+
+
+def test_cache_evicts_least_recently_used_by_total_size(tmp_path):
+    cache = invoices.InvoiceCache(str(tmp_path), 25)
+    cache.put('1-a', b'x' * 10)
+    cache.put('2-a', b'x' * 10)
+    assert cache.get('1-a') == b'x' * 10
+    cache.put('3-a', b'x' * 10)
+    assert cache.get('2-a') is None
+    assert cache.get('1-a') is not None
+    assert cache.stats()['bytes'] == 20
+
+    # a new instance picks the surviving files back up from disk
+    reopened = invoices.InvoiceCache(str(tmp_path), 25)
+    assert reopened.get('3-a') == b'x' * 10
+
+
+def wait_for(client, batch):
+    for _ in range(200):
+        status = client.get(batch['status_url']).json()
+        if status['status'] in ('done', 'failed'):
+            return status
+        time.sleep(0.05)
+    raise AssertionError('batch did not finish')
+
+
+def test_batch_renders_a_zip_or_one_merged_pdf(app_db, monkeypatch, tmp_path):
+    client, db, engine = app_db
+    monkeypatch.setattr(invoices, 'invoice_cache', invoices.InvoiceCache(str(tmp_path), 1024 * 1024))
+    sale = make_sale(db)
+    for _ in range(2):
+        crud.create_sale(db, company_id=None, customer_id=sale.customer_id, fabric_type='Lawn',
+                         quantity_meters=1, price_per_meter=5)
+    client.get(f'/invoice/{sale.sale_id}')  # cached before the batch, which reuses it
+
+    batch = client.post(f'/invoices/batch?customer_id={sale.customer_id}').json()
+    assert (batch['total'], batch['format']) == (3, 'zip')
+    assert client.get(batch['download_url']).status_code in (200, 409)
+    assert wait_for(client, batch)['done'] == 3
+    archive = zipfile.ZipFile(io.BytesIO(client.get(batch['download_url']).content))
+    assert sorted(archive.namelist()) == [f'Invoice_00000{i}_Cust_One.pdf' for i in (1, 2, 3)]
+    assert archive.read('Invoice_000001_Cust_One.pdf') == client.get(f'/invoice/{sale.sale_id}').content
+
+    merged = client.post(f'/invoices/batch?customer_id={sale.customer_id}&format=pdf').json()
+    assert wait_for(client, merged)['status'] == 'done'
+    pdf = client.get(merged['download_url']).content
+    assert len(re.findall(rb'/Type /Page\b(?!s)', pdf)) == 3
+
+    assert client.post('/invoices/batch?customer_id=999').status_code == 400
+    assert client.post('/invoices/batch?format=docx').status_code == 400
+    assert client.get('/invoices/batch/nope').status_code == 404
+
+
+def test_merged_batch_is_drawn_by_one_worker_and_reports_progress_once(db, tmp_path):
+    sale = make_sale(db)
+    crud.create_sale(db, company_id=None, customer_id=sale.customer_id, fabric_type='Lawn',
+                     quantity_meters=1, price_per_meter=5)
+    snapshots = crud.get_invoice_snapshots(db, limit=10, customer_id=sale.customer_id)
+    batch = invoices.InvoiceBatch('pdf', len(snapshots))
+
+    class Recorder:
+        def __init__(self):
+            self.tasks, self.progress = [], []
+
+        def submit(self, fn, *args, block=False):
+            self.tasks.append(args[0])
+            self.progress.append(batch.done)
+            fn(*args)
+            future = concurrent.futures.Future()
+            future.set_result(None)
+            return future
+
+    executor = Recorder()
+    path = str(tmp_path / 'merged.pdf')
+    invoices._write_merged(batch, snapshots, path, executor)
+    # no merge library: the whole document is one task, so progress only moves once it is written
+    assert executor.tasks == [snapshots] and executor.progress == [0]
+    assert batch.done == batch.total == 2
+    with open(path, 'rb') as f:
+        assert len(re.findall(rb'/Type /Page\b(?!s)', f.read())) == 2
+
+
+def test_render_executor_bounds_its_queue_and_reports_metrics(app_db, monkeypatch, tmp_path):
+    client, db, engine = app_db
+    monkeypatch.setattr(invoices, 'invoice_cache', invoices.InvoiceCache(str(tmp_path), 1024 * 1024))
+    executor = invoices.RenderExecutor(1, 1)
+    try:
+        running = executor.submit(time.sleep, 0.5)
+        with pytest.raises(invoices.RenderQueueFull):
+            executor.submit(time.sleep, 0)
+        running.result()
+        executor.submit(time.sleep, 0).result()
+        metrics = executor.metrics()
+        assert (metrics['completed'], metrics['rejected'], metrics['in_flight']) == (2, 1, 0)
+        assert metrics['render_ms']['max'] >= 400
+    finally:
+        executor.shutdown()
+
+    sale = make_sale(db)
+    before = client.get('/api/invoices/metrics').json()['render']['completed']
+    assert client.get(f'/invoice/{sale.sale_id}').status_code == 200
+    metrics = client.get('/api/invoices/metrics').json()
+    assert metrics['render']['completed'] == before + 1
+    assert metrics['cache']['entries'] == 1
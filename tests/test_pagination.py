@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import models, crud
+
+
+def add_purchases(db, n):
+    s = crud.create_supplier(db, 'sup')
+    base = datetime(2024, 1, 1)
+    for i in range(n):
+        # two purchases per day so the id breaks date ties
+        db.add(models.Purchase(supplier_id=s.supplier_id, fabric_type='Lawn', quantity_meters=1, price_per_meter=1,
+                               total_cost=1, date=base + timedelta(days=i // 2)))
+    db.commit()
+
+
+def test_keyset_pages_walk_forward_and_back(db):
+    add_purchases(db, 7)
+    expected = [p.purchase_id for p in db.query(models.Purchase)
+                .order_by(models.Purchase.date.desc(), models.Purchase.purchase_id.desc())]
+
+    first = crud.get_purchases(db, limit=3)
+    second = crud.get_purchases(db, limit=3, cursor=first['next_cursor'])
+    third = crud.get_purchases(db, limit=3, cursor=second['next_cursor'])
+    assert first['prev_cursor'] is None and third['next_cursor'] is None
+    assert [p.purchase_id for page in (first, second, third) for p in page['rows']] == expected
+    assert first['total_estimate'] == 7
+
+    back = crud.get_purchases(db, limit=3, cursor=second['prev_cursor'], direction='prev')
+    assert [p.purchase_id for p in back['rows']] == [p.purchase_id for p in first['rows']]
+    assert back['prev_cursor'] is None
+
+
+def test_undated_rows_page_after_the_dated_ones(db):
+    add_purchases(db, 7)
+    db.query(models.Purchase).filter(models.Purchase.purchase_id > 4).update({models.Purchase.date: None})
+    db.commit()
+    expected = [4, 3, 2, 1, 7, 6, 5]
+
+    pages = [crud.get_purchases(db, limit=2)]
+    while pages[-1]['next_cursor']:
+        pages.append(crud.get_purchases(db, limit=2, cursor=pages[-1]['next_cursor']))
+    assert [p.purchase_id for page in pages for p in page['rows']] == expected
+
+    back = [pages[-1]]
+    while back[-1]['prev_cursor']:
+        back.append(crud.get_purchases(db, limit=2, cursor=back[-1]['prev_cursor'], direction='prev'))
+    assert [p.purchase_id for page in reversed(back) for p in page['rows']] == expected
+
+
+def test_invalid_cursor_rejected():
+    with pytest.raises(ValueError):
+        crud.decode_cursor('not-a-cursor')
+
+
+def test_ledger_totals_cover_the_whole_filter_in_one_aggregate(db, max_queries):
+    add_purchases(db, 7)
+    with max_queries(db.get_bind(), 2):
+        ledger = crud.get_purchase_ledger(db, limit=3)
+    assert ledger['count'] == 7
+    assert ledger['total_quantity'] == 7
+    assert len(ledger['purchases']) == 3
+
+
+def test_pending_payments_are_paged_with_totals_over_the_whole_filter(db, max_queries):
+    customer_id = crud.create_customer(db, 'cust').customer_id
+    for i in range(5):
+        db.add(models.Sale(customer_id=customer_id, fabric_type='Lawn', quantity_meters=1, price_per_meter=10, tax=0,
+                           total_price_with_tax=10, amount_paid=2 if i % 2 else 0,
+                           amount_due=8 if i % 2 else 10, payment_status='partial' if i % 2 else 'pending',
+                           date=datetime(2024, 1, 1) + timedelta(days=i)))
+    db.commit()
+    with max_queries(db.get_bind(), 2):
+        first = crud.get_pending_payments(db, customer_id=customer_id, limit=2)
+    assert len(first['rows']) == 2
+    assert first['count'] == first['total_estimate'] == 5
+    assert first['partial_count'] == 2
+    assert first['total_due'] == 46
+    rest = crud.get_pending_payments(db, customer_id=customer_id, limit=10, cursor=first['next_cursor'])
+    assert len(rest['rows']) == 3 and rest['next_cursor'] is None
+
+
+def test_api_listing_stays_a_list_with_pages_in_the_link_header(app_db):
+    client, db, engine = app_db
+    add_purchases(db, 3)
+    first = client.get('/api/purchases?limit=2')
+    assert [p['purchase_id'] for p in first.json()] == [3, 2]
+    assert first.headers['x-total-estimate'] == '3'
+    next_url = first.headers['link'].split('>')[0][1:]
+    second = client.get(next_url)
+    assert [p['purchase_id'] for p in second.json()] == [1]
+    assert 'rel="prev"' in second.headers['link'] and 'rel="next"' not in second.headers['link']
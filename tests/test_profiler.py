@@ -0,0 +1,41 @@
+import logging
+import re
+
+from sqlalchemy import text
+
+import crud, database
+
+
+def test_responses_carry_server_timing(app_db):
+    client, db, engine = app_db
+    crud.create_customer(db, 'cust')
+    r = client.get('/api/changes')
+    timing = r.headers['server-timing']
+    assert re.findall(r'(?:^|, )(\w+);dur=', timing) == ['total', 'db', 'slowest']
+    assert 'desc="1 queries"' in timing
+    assert re.search(r'slowest;dur=[\d.]+;desc="SELECT change_log', timing)
+
+
+def test_slow_statements_are_logged_with_their_plan(app_db, monkeypatch):
+    client, db, engine = app_db
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    monkeypatch.setattr(database.slow_query_logger, 'handlers', [handler])
+    monkeypatch.setattr(database, 'slow_query_ms', 0)
+    client.get('/api/changes?since=3')
+    (record,) = [r for r in records if 'FROM change_log' in r.getMessage()]
+    message = record.getMessage()
+    assert 'in GET /api/changes' in message
+    assert 'parameters: (3,' in message
+    assert 'plan: SEARCH change_log USING INTEGER PRIMARY KEY' in message
+
+
+def test_nested_blocks_count_towards_every_enclosing_block(app_db):
+    client, db, engine = app_db
+    with database.track_queries() as outer:
+        db.execute(text('SELECT 1'))
+        with database.track_queries() as inner:
+            db.execute(text('SELECT 2'))
+    assert (outer.count, inner.count) == (2, 1)
+    assert outer.db_time >= inner.db_time > 0
@@ -0,0 +1,55 @@
+import crud, models, query_cache
+
+
+def test_summaries_are_cached_until_their_tables_are_written(app_db, monkeypatch, max_queries):
+    client, db, engine = app_db
+    cache = query_cache.QueryCache(max_entries=2, ttl=60)
+    monkeypatch.setattr(query_cache, 'cache', cache)
+    s = crud.create_supplier(db, 'sup')
+    c = crud.create_customer(db, 'cust')
+    crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Lawn', quantity_meters=10, price_per_meter=2)
+    sale = crud.create_sale(db, company_id=None, customer_id=c.customer_id, fabric_type='Lawn',
+                            quantity_meters=4, price_per_meter=5, apply_tax=False, payment_status='pending')
+
+    assert crud.get_profit_loss(db)['profit'] == 0
+    # a hit costs only the change_log check
+    with max_queries(engine, 1):
+        pnl = crud.get_profit_loss(db)
+    pnl['profit'] = 'changed by the caller'
+    assert crud.get_profit_loss(db)['profit'] == 0
+
+    assert crud.get_customer_credit_summary(db)[0]['total_due'] == 20
+    crud.add_payment(db, sale.sale_id, 5)
+    assert crud.get_customer_credit_summary(db)[0]['total_due'] == 15
+    # a payment rewrites the sale, which also drops profit & loss
+    assert cache.stats()['functions']['get_profit_loss'] == {'hits': 2, 'misses': 1}
+    assert crud.get_profit_loss(db)['profit'] == 0
+    assert cache.stats()['functions']['get_profit_loss']['misses'] == 2
+
+    # uncommitted writes of the session itself are never served from (or stored in) the cache
+    db.add(models.Purchase(supplier_id=s.supplier_id, fabric_type='Silk', quantity_meters=1, price_per_meter=4, total_cost=4))
+    db.flush()
+    assert crud.get_profit_loss(db)['profit'] == -4
+    db.rollback()
+    assert crud.get_profit_loss(db)['profit'] == 0
+
+    crud.get_supplier_ledger_summary(db)
+    assert cache.stats()['entries'] == 2
+    assert client.get('/api/cache/stats').status_code == 200
+
+
+def test_writes_committed_elsewhere_invalidate_the_cache(app_db, monkeypatch):
+    client, db, engine = app_db
+    monkeypatch.setattr(query_cache, 'cache', query_cache.QueryCache(max_entries=8, ttl=60))
+    s = crud.create_supplier(db, 'sup')
+    crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Lawn', quantity_meters=10, price_per_meter=2)
+    assert crud.get_profit_loss(db)['total_purchased_cost'] == 20
+
+    # another worker's session: its after_commit never runs in this process's cache
+    with engine.begin() as conn:
+        conn.execute(models.Purchase.__table__.insert().values(
+            supplier_id=s.supplier_id, fabric_type='Silk', quantity_meters=1, price_per_meter=4, total_cost=4))
+        conn.execute(models.ChangeLog.__table__.insert().values(
+            table_name='purchases', row_id=0, operation='insert'))
+    db.commit()
+    assert crud.get_profit_loss(db)['total_purchased_cost'] == 24
@@ -0,0 +1,37 @@
+import pytest
+
+import crud
+
+
+def seed(db, rows):
+    company = crud.create_company(db, 'Co')
+    for i in range(rows):
+        s = crud.create_supplier(db, f'sup{i}')
+        c = crud.create_customer(db, f'cust{i}')
+        p = crud.create_purchase(db, supplier_id=s.supplier_id, fabric_type='Lawn', quantity_meters=10, price_per_meter=2,
+                                 payment_status='partial', amount_paid=1)
+        crud.add_purchase_payment(db, p.purchase_id, 1)
+        sale = crud.create_sale(db, company_id=company.company_id, customer_id=c.customer_id, fabric_type='Lawn',
+                                quantity_meters=4, price_per_meter=3, payment_status='partial', amount_paid=1)
+        crud.add_payment(db, sale.sale_id, 1)
+
+
+@pytest.mark.parametrize('url', [
+    '/purchases',
+    '/sales',
+    '/ledger/purchases',
+    '/ledger/sales',
+    '/payments/history',
+    '/purchase-payments/history',
+    '/payments/pending',
+    '/purchase-payments/pending',
+    '/export/ledger/purchases.csv',
+    '/export/ledger/sales.csv',
+])
+def test_list_pages_issue_a_bounded_number_of_queries(app_db, max_queries, url):
+    client, db, engine = app_db
+    seed(db, 20)
+    # per-row relationship loads would add 20+ statements here
+    with max_queries(engine, 5):
+        r = client.get(url)
+    assert r.status_code == 200